@@ -11,7 +11,8 @@ Arguments:
   -m   Max number of abstracts to read  (the only use of the -n argument on
        build_topic_model.py to reduce the number of abstracts to a number
        that that program can handle.
-  -o   Destination file, defaults to stdout
+  -o   Destination file, defaults to stdout; compressed if the name ends in
+       .gz, .zst or .xz (see compressed_io.py)
   -e   Error output file, defaults to stderr (error output may be voluminous
        if the list of IDs is even a few months newer than the downloaded abstracts)
 
@@ -31,10 +32,11 @@ contains a single line, the abstract text in UTF-8.
 from argparse import ArgumentParser
 from pathlib import Path
 import codecs
-from pandas import read_excel
 import regex  #Note regex, not re
 import sys
 
+from compressed_io import open_text
+
 
 
 def GetCmdLineParameters():
@@ -71,7 +73,8 @@ def GetCmdLineParameters():
                        )
     args = parser.parse_args()
 
-    #Open Excel file:
+    #Open Excel file (pandas is slow to import, so not until we need it):
+    from pandas import read_excel
     sys.stderr.write("Reading %s...\n" %args.sExcelFName)
         #read_excel() can be slow, so output status (here and when done)
     try:
@@ -91,7 +94,7 @@ def GetCmdLineParameters():
         if args.sOutFileName == 'stdout':
             strOut = codecs.getwriter('utf-8')(sys.stdout.buffer)
         else:
-            strOut = open(args.sOutFileName, 'w+', encoding='utf-8')
+            strOut = open_text(args.sOutFileName, 'w')
     except:
         sys.stderr.write("Failed to open output file %s for writing"
             %args.sOutFileName)
@@ -0,0 +1,475 @@
+#!/usr/bin/env python3
+"""
+Anchor search and topic recovery (Arora et al., 2013) from precomputed
+cooccurrence statistics, for when Q is not computed by
+anchor_topic.topics.model_topics() itself (out-of-core matrices, sharded
+accumulation).
+
+By default the search and recovery are anchor_topic's, which need a dense Q.
+The functions greedy_anchors() and recover_topics() here do the same
+computations on a Q which may be a scipy.sparse matrix, working only with the
+rows they need: the anchor search projects just the candidate rows, and the
+recovery densifies one row at a time.  So for a sparse Q, memory grows with the
+number of cooccurring word pairs, not with the square of the vocabulary.
+
+model_topics_candidates() goes further, and never computes Q as a whole: it
+computes only the rows of Q for the anchor candidates (the words above the
+document frequency threshold), which is all the anchor search needs, and for
+the recovery, only the products of the chosen anchors' rows with Q (plus the
+row sums of Q), which is all the exponentiated gradient solver needs.
+
+Run this module to check that each of these paths finds the same anchors and
+word-topic matrix as anchor_topic.topics.model_topics(), on a fixed random
+matrix.
+"""
+
+import multiprocessing.pool
+
+from numba import jit
+import numpy
+from scipy import sparse
+from anchor_topic import search, recover
+
+from cooccurrence import column_chunks, identify_candidates, scale_chunk
+
+
+def _rows(Q, Rows):
+    """Return the given rows of Q (sparse or dense) as a dense array."""
+    if sparse.issparse(Q):
+        return Q[Rows].toarray()
+    return numpy.array(Q[Rows], dtype=float)
+
+
+def row_sums(Q):
+    """Return the row sums of Q (sparse or dense) as a 1-D array."""
+    return numpy.asarray(Q.sum(axis=1)).ravel()
+
+
+def greedy_anchors(Q, k, Candidates, seed=1, project_dim=1000):
+    """
+    Same as anchor_topic.search.greedy_anchors(), for a sparse or dense Q,
+    touching only the candidate rows of Q (see greedy_anchors_from_rows()).
+
+    Returns:
+        list of k word indices
+    """
+    Candidates = numpy.asarray(Candidates)
+    return greedy_anchors_from_rows(Q[Candidates], Candidates, k, seed, project_dim)
+
+
+def greedy_anchors_from_rows(QCandidates, Candidates, k, seed=1, project_dim=1000):
+    """
+    Find anchors given just the candidates' rows of Q (sparse or dense).  The
+    rows are normalized and randomly projected to project_dim dimensions (with
+    the same projection as anchor_topic.projection.random_projection()), and
+    anchors found by Gram-Schmidt, vectorized over the candidates.
+
+    Args:
+        QCandidates: matrix whose i'th row is the row of Q for word Candidates[i]
+        Candidates: word indices of the candidates
+        k, seed, project_dim: as for anchor_topic.search.greedy_anchors()
+    Returns:
+        list of k word indices
+    """
+    Sums = row_sums(QCandidates)
+    Scale = numpy.ones(len(Sums))
+    Scale[Sums != 0] = 1.0 / Sums[Sums != 0]
+    if sparse.issparse(QCandidates):
+        QBar = sparse.diags(Scale) @ QCandidates
+    else:
+        QBar = QCandidates * Scale[:, numpy.newaxis]
+    iColumns = QCandidates.shape[1]
+    if iColumns > project_dim:
+        #Draw the projection matrix a block of rows at a time (which yields the
+        # same matrix as drawing it all at once), so it needn't fit in memory:
+        state = numpy.random.RandomState(seed)
+        QRed = numpy.empty((len(Candidates), project_dim))
+        iBlock = 64
+        for iStart in range(0, project_dim, iBlock):
+            iRows = min(iBlock, project_dim - iStart)
+            R = state.choice([-1, 0, 0, 0, 0, 1], (iRows, iColumns)) * numpy.sqrt(3)
+            QRed[:, iStart : iStart + iRows] = QBar @ R.T
+    else:
+        QRed = QBar.toarray() if sparse.issparse(QBar) else numpy.array(QBar)
+    del QBar
+
+    Anchors = numpy.zeros(k, dtype=int) #Positions in Candidates
+    def farthest():
+        Dists = numpy.einsum('ij,ij->i', QRed, QRed)
+        iBest = int(numpy.argmax(Dists))
+        return iBest if Dists[iBest] > 0 else 0
+
+    #Find p1 with farthest distance from origin, and let it be the origin.
+    # (anchor_topic shifts the candidates in place one at a time, so once it
+    # reaches p1 itself, the candidates after it are shifted by zero; we do the
+    # same, so as to find the same anchors.)
+    Anchors[0] = farthest()
+    QRed[:Anchors[0] + 1] -= QRed[Anchors[0]].copy()
+    #Find farthest point from p1:
+    Anchors[1] = farthest()
+    Basis = QRed[Anchors[1]] / numpy.sqrt(numpy.dot(QRed[Anchors[1]], QRed[Anchors[1]]))
+    #Stabilized Gram-Schmidt which finds new anchor words to expand our subspace:
+    for j in range(1, k - 1):
+        QRed -= numpy.outer(QRed @ Basis, Basis)
+        Anchors[j+1] = farthest()
+        Basis = QRed[Anchors[j+1]] / numpy.sqrt(numpy.dot(QRed[Anchors[j+1]], QRed[Anchors[j+1]]))
+    return [int(Candidates[iAnchor]) for iAnchor in Anchors]
+
+
+@jit(nopython=True)
+def exponentiated_gradient_xy(XY, XX, epsilon, alpha):
+    """
+    Same as anchor_topic.recover.exponentiated_gradient(), but given the
+    product XY of the (normalized) anchor rows with the word's normalized row
+    of Q, rather than the row itself, and starting from alpha (rather than from
+    the uniform distribution).  Stops when the convergence measure falls below
+    epsilon.  The objective is computed without the constant term Y.Y, which
+    doesn't affect the steps taken.
+    """
+    _C1 = 1e-4
+    _C2 = .75
+    k = XY.shape[0]
+    alpha = numpy.copy(alpha)
+    log_alpha = numpy.log(alpha)
+    AXX = numpy.dot(alpha, XX)
+    AXY = numpy.dot(alpha, XY)
+    AXXA = numpy.dot(AXX, alpha)
+    grad = 2 * (AXX - XY)
+    new_obj = AXXA - 2 * AXY
+    stepsize = 1.0
+    decreased = False
+    convergence = numpy.inf
+    while convergence >= epsilon:
+        old_obj = new_obj
+        old_alpha = numpy.copy(alpha)
+        old_log_alpha = numpy.copy(log_alpha)
+        if stepsize == 0:
+            break
+        #Add the gradient and renormalize in logspace, then exponentiate:
+        log_alpha -= stepsize * grad
+        ymax = log_alpha.max()
+        log_alpha -= ymax + numpy.log(numpy.exp(log_alpha - ymax).sum())
+        alpha = numpy.exp(log_alpha)
+        AXX = numpy.dot(alpha, XX)
+        AXY = numpy.dot(alpha, XY)
+        AXXA = numpy.dot(AXX, alpha)
+        #See if stepsize should decrease:
+        old_obj, new_obj = new_obj, AXXA - 2 * AXY
+        offset = _C1 * stepsize * numpy.dot(grad, alpha - old_alpha)
+        if new_obj >= old_obj + offset:
+            stepsize /= 2.0
+            alpha = old_alpha
+            log_alpha = old_log_alpha
+            new_obj = old_obj
+            decreased = True
+            continue
+        old_grad, grad = grad, 2 * (AXX - XY)
+        #See if stepsize should increase:
+        if numpy.dot(grad, alpha - old_alpha) < _C2 * numpy.dot(old_grad, alpha - old_alpha) \
+           and not decreased:
+            stepsize *= 2.0
+            alpha = old_alpha
+            log_alpha = old_log_alpha
+            grad = old_grad
+            new_obj = old_obj
+            continue
+        decreased = False
+        convergence = numpy.dot(alpha, grad - grad.min())
+    if numpy.isnan(alpha).any():
+        alpha = numpy.ones(k) / k
+    return alpha
+
+
+def recover_from_products(XQ, XX, RowSums, epsilon=2e-7, Cache=None, AnchorLists=None):
+    """
+    Recover the word-topic matrix from the products of the normalized anchor
+    rows X with Q, rather than from Q itself.
+
+    Args:
+        XQ (numpy array): k x n_words array X . Q (Q being symmetric, column w
+            is X times row w of Q)
+        XX (numpy array): X . X.T
+        RowSums (numpy array): row sums of Q
+        epsilon: convergence tolerance of each word's optimization
+        Cache (recovery_cache.RecoveryCache): if given, reuse the cached
+            solution for AnchorLists (the anchors X was made from), or start
+            from the nearest cached solution; and cache the result
+    Returns:
+        (numpy array) word-topic matrix A
+    """
+    k = XQ.shape[0]
+    C, bExact = Cache.lookup(AnchorLists) if Cache is not None else (None, False)
+    if not bExact:
+        Scale = numpy.ones(len(RowSums))
+        Scale[RowSums != 0] = 1.0 / RowSums[RowSums != 0]
+        XY = numpy.ascontiguousarray((XQ * Scale).T)
+        Start = numpy.ascontiguousarray(C) if C is not None \
+            else numpy.full((len(RowSums), k), 1.0 / k)
+        with multiprocessing.pool.ThreadPool() as pool:
+            C = numpy.array(pool.map(
+                lambda iWord: exponentiated_gradient_xy(XY[iWord], XX, epsilon, Start[iWord]),
+                range(len(RowSums)), 5000)).reshape(len(RowSums), k)
+        if Cache is not None:
+            Cache.store(AnchorLists, C)
+    P_w = RowSums.copy()
+    P_w[numpy.isnan(P_w)] = 1e-16
+    #Use Bayes rule to compute topic matrix, and normalize columns:
+    A = P_w[:, numpy.newaxis] * C
+    A /= A.sum(axis=0)
+    return A
+
+
+def recover_topics(Q, Anchors, epsilon=2e-7, iChunkRows=5000):
+    """
+    Same as anchor_topic.recover.computeA(), for a sparse or dense Q: represent
+    each word as a convex combination of the anchors (by exponentiated
+    gradient), then use Bayes' rule to get the word-topic matrix.  Rows of Q are
+    densified iChunkRows at a time.
+
+    Returns:
+        (numpy array) word-topic matrix A
+    """
+    iWords = Q.shape[0]
+    k = len(Anchors)
+    RowSums = row_sums(Q)
+    #Compute normalized anchors X and precompute X*X.T:
+    QAnchors = _rows(Q, list(Anchors))
+    X = QAnchors / QAnchors.sum(axis=1)[:, numpy.newaxis]
+    XX = numpy.dot(X, X.transpose())
+    #Store normalization constants:
+    P_w = RowSums.copy()
+    P_w[numpy.isnan(P_w)] = 1e-16
+
+    C = numpy.zeros((iWords, k))
+    with multiprocessing.pool.ThreadPool() as pool:
+        for iStart in range(0, iWords, iChunkRows):
+            QPrime = _rows(Q, numpy.arange(iStart, min(iStart + iChunkRows, iWords)))
+            Sums = RowSums[iStart : iStart + len(QPrime)]
+            NonZero = Sums != 0
+            QPrime[NonZero] /= Sums[NonZero, numpy.newaxis]
+            C[iStart : iStart + len(QPrime)] = pool.map(
+                lambda Y: recover.exponentiated_gradient(Y, X, XX, epsilon, k), QPrime)
+    #Use Bayes rule to compute topic matrix, and normalize columns:
+    A = P_w[:, numpy.newaxis] * C
+    A /= A.sum(axis=0)
+    return A
+
+
+def anchor_rows(Q, AnchorLists, epsilon=1e-10):
+    """
+    Return a k x n_words array with one row per topic: the row of Q of the
+    topic's anchor word, or, for a topic with several anchor words, the
+    harmonic mean of their rows, as in anchor_topic.cooccur.augmentQ()
+    (Lund et al., 2017).
+    """
+    Rows = numpy.zeros((len(AnchorLists), Q.shape[1]))
+    for iTopic, Anchors in enumerate(AnchorLists):
+        QAnchors = _rows(Q, list(Anchors))
+        if len(Anchors) == 1:
+            Rows[iTopic] = QAnchors[0]
+        else:
+            Rows[iTopic] = len(Anchors) / (1.0 / (QAnchors + epsilon)).sum(axis=0)
+    return Rows
+
+
+def update_topics(Q, AnchorLists, RowSums=None, epsilon=2e-7, Cache=None):
+    """
+    Same as anchor_topic.topics.update_topics(): recover the topics for the
+    given anchors (a list of lists of word indices, one list per topic), for a
+    sparse or dense Q.  Rather than appending pseudo-words to Q, this computes
+    the products of the (pseudo-)anchor rows with Q, a single matrix product,
+    and recovers from those (see recover_from_products()); so it is quick
+    enough to rerun after every change to the anchors.
+
+    Args:
+        RowSums: row sums of Q, if already computed (they don't depend on the
+            anchors)
+        epsilon, Cache: as for recover_from_products()
+    Returns:
+        (numpy array) word-topic matrix A
+    """
+    if RowSums is None:
+        RowSums = row_sums(Q)
+    X = anchor_rows(Q, AnchorLists)
+    X /= X.sum(axis=1)[:, numpy.newaxis]
+    XQ = numpy.asarray(Q @ X.T).T
+    return recover_from_products(XQ, numpy.dot(X, X.T), RowSums, epsilon, Cache,
+                                 AnchorLists)
+
+
+def model_topics_candidates(matrixWordDoc, k, threshold, DocFreqs, iChunkColumns,
+                            seed=1, bSparseQ=False, epsilon=1e-15, fTolerance=2e-7,
+                            Cache=None):
+    """
+    Same as anchor_topic.topics.model_topics(), but computing only the rows of
+    Q for the anchor candidates, and for the recovery, only X . Q and the row
+    sums of Q (see module documentation).  Makes two passes over the
+    word-document matrix, one chunk of documents at a time.
+
+    Args:
+        matrixWordDoc (scipy.sparse matrix or disk_matrix.DiskCSCMatrix):
+            word-document matrix
+        k, threshold, seed: as for model_topics()
+        DocFreqs (numpy array): number of documents each word occurs in
+            (computed during ingestion)
+        iChunkColumns: number of documents per chunk
+        bSparseQ: keep the candidates' rows of Q sparse
+        fTolerance, Cache: as for recover_from_products()
+
+    Returns:
+        A tuple (A, QCandidates, Anchors): the word-topic matrix, the
+        candidates' rows of Q, and the list of anchor lists.
+    """
+    iWords, iDocs = matrixWordDoc.shape
+    Candidates = identify_candidates(numpy.asarray(DocFreqs), iDocs, threshold)
+    #Pass 1: rows of Q for the candidates, and row sums of Q:
+    if bSparseQ:
+        QCandidates = sparse.csr_matrix((len(Candidates), iWords))
+    else:
+        QCandidates = numpy.zeros((len(Candidates), iWords))
+    RowSums = numpy.zeros(iWords)
+    WordProbs = numpy.zeros(iWords)
+    for Chunk in column_chunks(matrixWordDoc, iChunkColumns):
+        Scaled, ChunkWordProbs = scale_chunk(Chunk)
+        Product = Scaled.tocsr()[Candidates] @ Scaled.T
+        if bSparseQ:
+            QCandidates = QCandidates + Product
+        else:
+            QCandidates += Product.toarray()
+        RowSums += Scaled @ (Scaled.T @ numpy.ones(iWords))
+        WordProbs += ChunkWordProbs
+    QCandidates = QCandidates / iDocs
+    if bSparseQ:
+        QCandidates = (QCandidates - sparse.csr_matrix(
+            (WordProbs[Candidates] / iDocs, (numpy.arange(len(Candidates)), Candidates)),
+            shape=QCandidates.shape)).tocsr()
+        QCandidates.data[(-epsilon < QCandidates.data) & (QCandidates.data < epsilon)] = 0
+        QCandidates.eliminate_zeros()
+    else:
+        QCandidates[numpy.arange(len(Candidates)), Candidates] -= WordProbs[Candidates] / iDocs
+        QCandidates[(-epsilon < QCandidates) & (QCandidates < epsilon)] = 0
+    RowSums = (RowSums - WordProbs) / iDocs
+
+    Anchors = greedy_anchors_from_rows(QCandidates, Candidates, k, seed)
+
+    #Pass 2: products of the (normalized) anchor rows X with Q:
+    Positions = numpy.searchsorted(Candidates, Anchors)
+    X = QCandidates[Positions]
+    X = X.toarray() if sparse.issparse(X) else numpy.array(X)
+    X /= X.sum(axis=1)[:, numpy.newaxis]
+    XQ = numpy.zeros((k, iWords))
+    for Chunk in column_chunks(matrixWordDoc, iChunkColumns):
+        Scaled, _ = scale_chunk(Chunk)
+        XQ += (Scaled @ (Scaled.T @ X.T)).T
+    XQ = (XQ - X * WordProbs) / iDocs
+    AnchorLists = [[w] for w in Anchors]
+    A = recover_from_products(XQ, numpy.dot(X, X.T), RowSums, fTolerance, Cache, AnchorLists)
+    return A, QCandidates, AnchorLists
+
+
+def anchors_from_sums(Sums, k, threshold, seed=1, bSparseQ=False, iMinCoDocs=1):
+    """
+    The first half of model_topics_from_sums(): compute Q from the sums and
+    find the anchors.  Returns (Q, list of anchor lists).
+    """
+    Candidates = identify_candidates(Sums.DocFreqs, Sums.iDocs, threshold)
+    if bSparseQ:
+        Q = Sums.sparse_Q(iMinCoDocs=iMinCoDocs)
+        Anchors = greedy_anchors(Q, k, Candidates, seed)
+    else:
+        Q = Sums.Q()
+        Anchors = search.greedy_anchors(Q, k, Candidates, seed)
+    return Q, [[w] for w in Anchors]
+
+
+def recover_word_topics(Q, AnchorLists, fTolerance=2e-7, Cache=None):
+    """
+    The second half of model_topics_from_sums(): recover the word-topic matrix
+    for the anchors, from a dense or sparse Q.
+    """
+    if Cache is not None:
+        return update_topics(Q, AnchorLists, epsilon=fTolerance, Cache=Cache)
+    Anchors = [Anchor[0] for Anchor in AnchorLists]
+    if sparse.issparse(Q):
+        return recover_topics(Q, Anchors, fTolerance)
+    return recover.computeA(Q, Anchors, epsilon=fTolerance)
+
+
+def model_topics_from_sums(Sums, k, threshold, seed=1, bSparseQ=False, iMinCoDocs=1,
+                           fTolerance=2e-7, Cache=None):
+    """
+    Same as anchor_topic.topics.model_topics(), but starting from
+    cooccurrence sums rather than from the word-document matrix.
+
+    Args:
+        Sums (cooccurrence.CooccurrenceSums): sums over the whole corpus
+        k: number of topics
+        threshold: minimum fraction of documents a word must occur in to be an
+            anchor candidate
+        seed: seed for the random projection used by the anchor search
+        bSparseQ: keep Q sparse (see module documentation)
+        iMinCoDocs: with bSparseQ, drop word pairs which cooccur in fewer than
+            this many documents
+        fTolerance, Cache: as for recover_from_products(); if Cache is given,
+            the recovery is done by update_topics() (for a sparse or dense Q)
+
+    Returns:
+        A tuple (A, Q, Anchors) as returned by model_topics(): the word-topic
+        matrix, the word cooccurrence matrix (a scipy.sparse.csr_matrix if
+        bSparseQ), and the list of anchor lists.
+    """
+    Q, AnchorLists = anchors_from_sums(Sums, k, threshold, seed, bSparseQ, iMinCoDocs)
+    return recover_word_topics(Q, AnchorLists, fTolerance, Cache), Q, AnchorLists
+
+
+
+if __name__ == '__main__':
+    #Self-check: the anchors and word-topic matrix found here, by each path
+    # build_topic_model.py can take, must be anchor_topic's (e.g. after
+    # upgrading anchor_topic, numpy or scipy, or changing this module).  The
+    # matrix has more words than project_dim, so that the anchor search
+    # projects the rows (and reproduces anchor_topic's in-place shift).
+    import sys
+    from anchor_topic.topics import model_topics
+    from cooccurrence import CooccurrenceSums
+    from recovery_cache import RecoveryCache
+    iWords, iDocs, k, fThreshold = 1200, 600, 6, 0.02
+    Random = numpy.random.RandomState(0)
+    TopicWords = Random.dirichlet(numpy.full(iWords, 0.05), size=k)
+    Counts = numpy.zeros((iWords, iDocs), dtype=int)
+    for iDoc in range(iDocs):
+        Mix = Random.dirichlet(numpy.full(k, 0.3))
+        Counts[:, iDoc] = Random.multinomial(Random.randint(20, 120), Mix @ TopicWords)
+    M = sparse.csc_matrix(Counts)
+    DocFreqs = numpy.diff(M.tocsr().indptr)
+    AExpected, _, AnchorsExpected = model_topics(M, k, fThreshold)
+    AnchorsExpected = [[int(w) for w in Anchor] for Anchor in AnchorsExpected]
+
+    def sums(bSparse, bCoDocs=False):
+        Sums = CooccurrenceSums(iWords, bSparse=bSparse, bCoDocs=bCoDocs)
+        for Chunk in column_chunks(M, 250):
+            Sums.add_chunk(Chunk)
+        return Sums
+    Paths = [('dense (-m)',   lambda: model_topics_from_sums(sums(False), k, fThreshold)),
+             ('sparse (-S)',  lambda: model_topics_from_sums(sums(True), k, fThreshold, bSparseQ=True)),
+             ('candidates (-R)',
+                  lambda: model_topics_candidates(M, k, fThreshold, DocFreqs, 250)),
+             ('candidates, sparse (-R -S)',
+                  lambda: model_topics_candidates(M, k, fThreshold, DocFreqs, 250, bSparseQ=True)),
+             ('recovery cache (--recovery-cache)',
+                  lambda: model_topics_from_sums(sums(True), k, fThreshold, bSparseQ=True,
+                                                 Cache=RecoveryCache(None, 'check')))]
+    bFailed = False
+    for sPath, fnModel in Paths:
+        A, _, Anchors = fnModel()
+        if Anchors != AnchorsExpected:
+            print("%s: anchors %s, expected %s: FAILED" %(sPath, Anchors, AnchorsExpected))
+            bFailed = True
+        elif not numpy.allclose(A, AExpected, rtol=1e-6, atol=1e-10):
+            print("%s: word-topic matrix differs by up to %g: FAILED"
+                %(sPath, numpy.abs(A - AExpected).max()))
+            bFailed = True
+        else:
+            print("%s: ok (largest difference in A %g)" %(sPath, numpy.abs(A - AExpected).max()))
+    if bFailed:
+        sys.exit(1)
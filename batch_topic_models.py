@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+"""
+Run a list of build_topic_model.py jobs on one node, as many at a time as fit
+in a memory budget, rather than all at once (which overcommits the node's
+memory until it dies with MemoryError).
+
+Each job's peak memory is estimated from its arguments and a sample of its
+input (see estimate_memory()), and a job is started only while the estimates of
+the jobs running, plus its own, fit in the budget; a job whose estimate alone
+exceeds the budget is run by itself.  When a job ends, its elapsed time, peak
+resident memory (from os.wait4()) and exit status are recorded, so that the
+estimates can be checked against reality.
+
+Command line arguments:
+     -J <fname>  Job list: one job per line, giving the arguments to
+                 build_topic_model.py (e.g. "-i 'abstracts*.txt' -a 50 -o t50.txt").
+                 Blank lines and lines starting with '#' are ignored.
+     -M <size>   Memory budget, e.g. 60G or 512M, default 80% of physical memory
+     -j <int>    Maximum number of jobs to run at once, default the number of CPUs
+     -L <dir>    Directory for each job's stdout and stderr, default batch_logs
+     -r <fname>  Results file (tab-separated, one line per job), default
+                 batch_results.tsv
+     -s <int>    Number of abstracts to sample from each job's input to
+                 estimate its vocabulary size, default 5,000
+     -n          Only print the estimates; don't run the jobs
+"""
+
+from argparse import ArgumentParser
+from glob import glob
+import math
+import os
+from pathlib import Path
+import shlex
+import subprocess
+import sys
+import time
+
+from build_topic_model import make_parser
+from compressed_io import compression_of, open_binary_reader, open_text
+from corpus import is_word, read_stopwords
+
+
+iFLOAT_BYTES = 8  #numpy float64: Q, A and the scaled word-document matrix
+iINDEX_BYTES = 4  #int32 sparse matrix indices
+iBASE_BYTES = 250 * 2**20 #Interpreter plus numpy, scipy, numba and anchor_topic
+
+
+def parse_size(sSize):
+    """Parse a size such as '60G', '512M' or '1000000' into bytes."""
+    sSize = sSize.strip().upper().rstrip('B')
+    Units = {'K': 2**10, 'M': 2**20, 'G': 2**30, 'T': 2**40}
+    if sSize and sSize[-1] in Units:
+        return int(float(sSize[:-1]) * Units[sSize[-1]])
+    return int(sSize)
+
+
+def format_size(iBytes):
+    """Format a number of bytes in MB."""
+    return "%.0fM" %(iBytes / 2**20)
+
+
+def GetCmdLineParameters():
+    """Return the parsed command line args."""
+    parser = ArgumentParser(description="Run build_topic_model.py jobs within a memory budget")
+    parser.add_argument( "-J", "--Jobs"
+                       , dest    = "sJobsFName"
+                       , metavar = "<JobFile>"
+                       , required = True
+                       , help    = "File listing the jobs, one line of build_topic_model.py arguments per job"
+                       )
+    parser.add_argument( "-M", "--MemoryBudget"
+                       , dest    = "sBudget"
+                       , metavar = "<Size>"
+                       , default = None
+                       , help    = "Memory budget, e.g. 60G; default 80%% of physical memory"
+                       )
+    parser.add_argument( "-j", "--MaxJobs"
+                       , type    = int
+                       , dest    = "iMaxJobs"
+                       , metavar = "<MaxJobs>"
+                       , default = os.cpu_count()
+                       , help    = "Maximum number of jobs to run at once, default the number of CPUs"
+                       )
+    parser.add_argument( "-L", "--LogDir"
+                       , dest    = "sLogDir"
+                       , metavar = "<LogDir>"
+                       , default = "batch_logs"
+                       , help    = "Directory for each job's stdout and stderr"
+                       )
+    parser.add_argument( "-r", "--Results"
+                       , dest    = "sResultsFName"
+                       , metavar = "<ResultsFile>"
+                       , default = "batch_results.tsv"
+                       , help    = "File to record each job's time and peak memory in"
+                       )
+    parser.add_argument( "-s", "--SampleAbstracts"
+                       , type    = int
+                       , dest    = "iSampleAbstracts"
+                       , metavar = "<SampleAbstracts>"
+                       , default = 5000
+                       , help    = "Abstracts to sample from each job's input, for the estimates"
+                       )
+    parser.add_argument( "-n", "--DryRun"
+                       , dest    = "bDryRun"
+                       , action  = "store_true"
+                       , default = False
+                       , help    = "Only print the memory estimates"
+                       )
+    args = parser.parse_args()
+    try:
+        if args.sBudget is None:
+            args.iBudget = int(0.8 * os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES'))
+        else:
+            args.iBudget = parse_size(args.sBudget)
+    except ValueError:
+        sys.stderr.write("Cannot parse memory budget '%s'\n" %args.sBudget)
+        exit(1)
+    if args.iMaxJobs < 1 or args.iSampleAbstracts < 2:
+        sys.stderr.write("Need at least one job at a time, and a sample of at least two abstracts.\n")
+        exit(1)
+    return args
+
+
+def read_jobs(sJobsFName):
+    """
+    Read the job list; returns a list of (iLine, list of arguments, parsed
+    build_topic_model.py arguments).  Exits if a job's arguments are invalid.
+    """
+    parser = make_parser()
+    parser.prog = "build_topic_model.py"
+    Jobs = []
+    try:
+        with open(sJobsFName, 'r', encoding='utf-8') as strJobs:
+            for iLine, sLine in enumerate(strJobs, start=1):
+                if not sLine.strip() or sLine.lstrip().startswith('#'):
+                    continue
+                Args = shlex.split(sLine)
+                try:
+                    Jobs.append((iLine, Args, parser.parse_args(Args)))
+                except SystemExit:
+                    sys.stderr.write("Invalid arguments for job on line %i of %s\n"
+                        %(iLine, sJobsFName))
+                    exit(1)
+    except (FileNotFoundError, PermissionError, IOError):
+        sys.stderr.write("Unable to read job file '%s'\n" %sJobsFName)
+        exit(1)
+    return Jobs
+
+
+def count_abstracts(PathList, iSampleBytes, iSampleAbstracts):
+    """
+    Estimate the number of abstracts (lines) in the input files: uncompressed
+    files from their size and the mean length of the sampled lines, compressed
+    ones by counting their lines.
+    """
+    fBytesPerLine = iSampleBytes / max(iSampleAbstracts, 1)
+    fCount = 0
+    for sFileName in PathList:
+        if compression_of(sFileName) is None:
+            fCount += os.path.getsize(sFileName) / fBytesPerLine
+            continue
+        with open_binary_reader(sFileName) as strIn:
+            fCount += sum(sBlock.count(b'\n') for sBlock in iter(lambda: strIn.read(2**22), b''))
+    return int(fCount)
+
+
+def sample_corpus(PathList, iSampleAbstracts, iMinWordLength, StopWords):
+    """
+    Read the first iSampleAbstracts abstracts of the input.  Returns a dict of
+    the sample's statistics: abstracts, bytes, distinct words in each half and
+    in the whole of it (for Heaps' law), mean distinct words per abstract, and
+    document frequency of each word.
+    """
+    DocFreqs = {}
+    iAbstracts = iBytes = iWordsInDocs = iHalfWords = 0
+    for sFileName in PathList:
+        with open_text(sFileName) as strIn:
+            for sLine in strIn:
+                if iAbstracts >= iSampleAbstracts:
+                    break
+                iAbstracts += 1
+                iBytes += len(sLine.encode('utf-8'))
+                Words = set(sToken for sToken in sLine.strip().split(' ')[1:]
+                            if sToken not in StopWords and is_word(sToken, iMinWordLength))
+                iWordsInDocs += len(Words)
+                for sWord in Words:
+                    DocFreqs[sWord] = DocFreqs.get(sWord, 0) + 1
+                if iAbstracts == iSampleAbstracts // 2:
+                    iHalfWords = len(DocFreqs)
+        if iAbstracts >= iSampleAbstracts:
+            break
+    return {'iAbstracts': iAbstracts, 'iBytes': iBytes, 'iHalfWords': iHalfWords,
+            'iWords': len(DocFreqs), 'fWordsPerDoc': iWordsInDocs / max(iAbstracts, 1),
+            'DocFreqs': DocFreqs}
+
+
+def estimate_memory(Args, iSampleAbstracts=5000):
+    """
+    Estimate the peak memory (in bytes) of a build_topic_model.py job, given
+    its parsed arguments.  Returns (iBytes, iDocs, iWords): the estimate, and
+    the estimated numbers of abstracts and of words in the vocabulary.
+
+    The vocabulary size is extrapolated from a sample of the input by Heaps'
+    law (V = K n**beta, beta fitted from the vocabulary of the sample's first
+    half and of the whole).  The terms are those that dominate each method:
+        dense Q (the default, -m):  ~3 V x V float arrays (Q, its row-normalized
+            copy, and the recovery's copy; this matches the failures at ~55,000
+            words in 64G and ~77,000 in 128G noted in build_topic_model.py), plus the word-document matrix
+            (~3 copies, while it is converted to CSC) unless it is on disk (-m)
+        sparse Q (-S):  ~3 copies of the cooccurring pairs, at most
+            min(V*V, docs * (words per doc)**2)
+        candidate rows (-R):  ~3 candidates x V float arrays
+    plus the word-topic matrix and the interpreter and libraries.
+    """
+    PathList = glob(Args.sInputGlob)
+    StopWords = read_stopwords(Args.sStopWordsFName)
+    Sample = sample_corpus(PathList, iSampleAbstracts, Args.iMinWordLength, StopWords)
+    n = Sample['iAbstracts']
+    if n < 2:
+        return iBASE_BYTES, n, Sample['iWords']
+    iDocs = min(count_abstracts(PathList, Sample['iBytes'], n),
+                Args.iSampleAbstracts or Args.iMaxAbstracts)
+    fBeta = 0.6 #Typical for text, if the sample is too small to fit
+    if Sample['iHalfWords'] and Sample['iWords'] > Sample['iHalfWords']:
+        fBeta = min(max(math.log(Sample['iWords'] / Sample['iHalfWords'], 2), 0.3), 0.9)
+    V = int(Sample['iWords'] * max(iDocs / n, 1) ** fBeta)
+    if Args.iHashBits:
+        V = min(V, 2 ** Args.iHashBits)
+    fNonZero = iDocs * Sample['fWordsPerDoc']
+    iMatrix = 0 if Args.sMatrixDir else int(3 * fNonZero * (iFLOAT_BYTES + iINDEX_BYTES))
+    if Args.bCandidateRows:
+        iMinDocs = Args.fAnchorThreshold * n
+        fCandidates = sum(1 for iFreq in Sample['DocFreqs'].values() if iFreq >= iMinDocs)
+        iQ = int(3 * fCandidates * V * iFLOAT_BYTES)
+    elif Args.bSparseQ:
+        fPairs = min(float(V) * V, fNonZero * Sample['fWordsPerDoc'])
+        iQ = int(3 * fPairs * (iFLOAT_BYTES + iINDEX_BYTES))
+    else:
+        iQ = 3 * V * V * iFLOAT_BYTES
+    iA = 3 * V * Args.iNumAnchors * iFLOAT_BYTES
+    return iBASE_BYTES + iMatrix + iQ + iA, iDocs, V
+
+
+def run_jobs(Jobs, iBudget, iMaxJobs, sLogDir, strResults):
+    """
+    Run the jobs (a list of (sName, Args, iEstimate)) within the budget (see
+    module documentation), in the order given except that a job which doesn't
+    fit yet is passed over for later ones which do.  Writes a line per job to
+    strResults as it ends.  Returns the number of jobs which failed.
+    """
+    Path(sLogDir).mkdir(parents=True, exist_ok=True)
+    sScript = str(Path(__file__).resolve().parent / 'build_topic_model.py')
+    Pending = list(Jobs)
+    Running = {} #pid -> (sName, iEstimate, fStart, Popen)
+    iInUse = 0
+    iFailed = 0
+    while Pending or Running:
+        for Job in list(Pending):
+            sName, Args, iEstimate = Job
+            if len(Running) >= iMaxJobs:
+                break
+            if Running and iInUse + iEstimate > iBudget:
+                continue
+            if iEstimate > iBudget:
+                sys.stderr.write("Job %s is estimated to need %s, more than the budget; running it alone\n"
+                    %(sName, format_size(iEstimate)))
+            with open(os.path.join(sLogDir, sName + '.out'), 'wb') as strOut, \
+                 open(os.path.join(sLogDir, sName + '.err'), 'wb') as strErr:
+                Process = subprocess.Popen([sys.executable, sScript] + Args,
+                                           stdout=strOut, stderr=strErr)
+            Running[Process.pid] = (sName, iEstimate, time.time(), Process)
+            iInUse += iEstimate
+            Pending.remove(Job)
+            sys.stderr.write("Started job %s (estimated %s; %s of %s in use)\n"
+                %(sName, format_size(iEstimate), format_size(iInUse), format_size(iBudget)))
+        iPID, iStatus, Usage = os.wait4(-1, 0)
+        if iPID not in Running:
+            continue
+        sName, iEstimate, fStart, Process = Running.pop(iPID)
+        Process.returncode = os.waitstatus_to_exitcode(iStatus) #We reaped it, not Popen
+        iInUse -= iEstimate
+        fSeconds = time.time() - fStart
+        iPeakRSS = Usage.ru_maxrss * 1024 #KB on Linux
+        iFailed += Process.returncode != 0
+        strResults.write("%s\t%i\t%.1f\t%s\t%s\n"
+            %(sName, Process.returncode, fSeconds, format_size(iPeakRSS), format_size(iEstimate)))
+        strResults.flush()
+        sys.stderr.write("Finished job %s: exit status %i, %.1f s, peak RSS %s (estimated %s)\n"
+            %(sName, Process.returncode, fSeconds, format_size(iPeakRSS), format_size(iEstimate)))
+    return iFailed
+
+
+
+if __name__ == '__main__':
+    args = GetCmdLineParameters()
+    Jobs = []
+    for iLine, Args, ParsedArgs in read_jobs(args.sJobsFName):
+        iEstimate, iDocs, iWords = estimate_memory(ParsedArgs, args.iSampleAbstracts)
+        sName = "job%03i" %iLine
+        sys.stderr.write("%s: ~%i abstracts, ~%i words, estimated peak memory %s: %s\n"
+            %(sName, iDocs, iWords, format_size(iEstimate), " ".join(Args)))
+        Jobs.append((sName, Args, iEstimate))
+    if args.bDryRun:
+        exit(0)
+    with open(args.sResultsFName, 'w', encoding='utf-8') as strResults:
+        strResults.write("job\texit_status\tseconds\tpeak_rss\testimated\n")
+        iFailed = run_jobs(Jobs, args.iBudget, args.iMaxJobs, args.sLogDir, strResults)
+    if iFailed:
+        sys.stderr.write("%i of %i jobs failed\n" %(iFailed, len(Jobs)))
+        exit(1)
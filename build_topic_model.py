@@ -9,11 +9,66 @@ Command line arguments:
      -x          Output to Excel format (incompatible with output to stdout)
      -s <fname>  Filename for stopwords (optional)
      -n <int>    Max number of abstracts to read, default 12,000
+     --sample <int>
+                 Read a uniform random sample of <int> abstracts from all the
+                 input files, rather than the first -n.  Uses (and, the first
+                 time, builds) an index of the lines of each file (see
+                 line_index.py).
+     --sample-seed <int>
+                 Random seed for --sample, default 0
      -l <int>    Minimum length of words in characters (default 2)
      -a <int>    Number of anchors (topics), default 50
      -w <int>    Number of words in each topic, default 20
+     -m <dir>    Build the word-document matrix out-of-core, in <dir> (see
+                 disk_matrix.py), and compute cooccurrences from it one chunk of
+                 documents at a time.  Use for corpora whose matrix doesn't fit
+                 in memory.
+     -c <int>    Documents per chunk when using -m or -S, default 10,000
+     -S          Keep the cooccurrence matrix sparse, computing it a chunk of
+                 documents at a time (see anchor_model.py).  Memory then grows
+                 with the number of cooccurring word pairs, rather than with
+                 the square of the vocabulary size.
+     -P <int>    With -S, drop word pairs which cooccur in fewer than <int>
+                 documents, default 1 (no pruning)
+     -R          Compute only the rows of the cooccurrence matrix that the
+                 anchor search needs (those of the anchor candidates), and for
+                 the recovery only the products of the anchors' rows with it
+                 (see anchor_model.model_topics_candidates()).  Much faster
+                 when the candidates are a small part of the vocabulary.
+     --anchor-threshold <float>
+                 Minimum fraction of abstracts a word must occur in to be an
+                 anchor candidate, default 0.01
+     --recovery-cache <dir>
+                 Cache the topic recovery's solutions in <dir> (see
+                 recovery_cache.py).  A rerun over the same corpus with the
+                 same anchors then reuses the cached solution, and one with
+                 partly different anchors starts from the closest one.
+     --recovery-tolerance <float>
+                 Convergence tolerance of the topic recovery, default 2e-7
+     -D <float>  Drop abstracts whose similarity to an earlier abstract is at
+                 least <float> (near-duplicates; see dedup.py)
+     --dedup-report <fname>
+                 With -D, list the abstracts dropped in <fname>, rather than on
+                 stderr
+     -E          Evaluate the topics (coherence and overlap; see topic_quality.py),
+                 and add the measures to the output
+     --hash-features <int>
+                 Give each word the row of its hash bucket, of 2**<int>, rather
+                 than of its place in the vocabulary (see feature_hashing.py),
+                 so the matrix is built in one pass over the corpus, with no
+                 vocabulary.  Each row is labeled with its bucket's most
+                 frequent words, joined by '|', and the fraction of buckets
+                 holding more than one word is reported.  Not with --run-dir.
+                 (sharded_cooccur.py --hash-features does the same in shards.)
+     --run-dir <dir>
+                 Checkpoint the result of each phase (vocabulary, matrix,
+                 cooccurrences, anchors, recovery) in <dir> (see checkpoint.py)
+     --resume    With --run-dir, reuse the checkpoints of a previous run with
+                 the same input files and arguments, and start from the first
+                 phase that it didn't complete
 
-Assumes abstracts are contained in one or more text files. Each line of each
+Assumes abstracts are contained in one or more text files, which may be
+compressed (.gz, .zst or .xz; see compressed_io.py). Each line of each
 text file corresponds to a unique abstract.  A line consists of two or more
 space-separated tokens.  The first token is interpreted as the abstract's
 ID, while remaining tokens constitute the abstract.  Tokens should be normalized,
@@ -24,6 +79,13 @@ during pre-processing):
   2) Numbers
   3) Short words (those shorter than the size specified by the -l arg)
 
+Importable: the phases (get_words_and_documents(), build_matrix(),
+compute_topics(), and topic_output.write_topics()) can be called in-process.
+Importing this module has no side effects (logging is configured by
+setup_logging(), which the command line calls), and the heavy libraries
+(scipy, numpy, numba, anchor_topic) are only imported by the phases that use
+them, so that --help and argument errors are immediate.
+
 Imports anchor_topic, which allows interactive topic modeling.  Documentation here:
     https://github.com/forest-snow/anchor-topic
 For the interactive part, see:
@@ -35,7 +97,9 @@ a record representing a topic.  The Anchor is in column 1, and the list of words
 for the topic is in column 2, comma-delimited.  Otherwise (if there is no -x arg),
 each record is written on two lines, with the anchor on one line, and the related
 words written in comma-delimited form to the next line.  Each record in this text
-format is followed by a blank line.
+format is followed by a blank line.  With -E, each text record has a third line giving the
+topic's quality measures, and Excel output has a second worksheet ("Quality")
+with a row of measures for each topic, followed by their means.
 
 ToDo:
 1) For purposes of preventing memory overflow, should we be counting number of
@@ -62,21 +126,23 @@ ToDo:
 """
 
 import argparse    #Command line switch handling
-import codecs
-import xlsxwriter  #Output to Excel format
 from glob import glob
 from collections import Counter
 import logging
 from pathlib import Path
-from scipy import sparse
-import re
 import sys
 import time
-from anchor_topic.topics import model_topics
+from compressed_io import open_text
+from corpus import check_anchor_candidates, corpus_fingerprint, is_word, read_stopwords
+from topic_output import open_output, write_topics
+#scipy, anchor_topic and the modules using them (anchor_model, cooccurrence,
+# disk_matrix, recovery_cache) are imported by the functions that need them.
 
 
-def GetCmdLineParameters():
-    """Return a tuple of args based on command line parameters.
+def make_parser():
+    """
+    Return the parser for the command line arguments (also used by
+    batch_topic_models.py to read its job lists).
     """
     parser = argparse.ArgumentParser(description="Build a topic model")
     parser.add_argument( "-i", "--InputGlob"
@@ -119,6 +185,20 @@ def GetCmdLineParameters():
     #Fix: e.g. abstracts vary in word length.  In the test data, 6500 abstracts
     #Fix: = 52,145 words.
                        )
+    parser.add_argument( "--sample"
+                       , type    = int
+                       , dest    = "iSampleAbstracts"
+                       , metavar = "<SampleAbstracts>"
+                       , default = None
+                       , help    = "Read a uniform random sample of this many abstracts, instead of the first -n"
+                       )
+    parser.add_argument( "--sample-seed"
+                       , type    = int
+                       , dest    = "iSampleSeed"
+                       , metavar = "<SampleSeed>"
+                       , default = 0
+                       , help    = "Random seed for --sample, default 0"
+                       )
     parser.add_argument( "-l", "--MinWordLength"
                        , type    = int
                        , dest    = "iMinWordLength"
@@ -140,40 +220,155 @@ def GetCmdLineParameters():
                        , default = 20
                        , help    = "Number of words to output for each topic"
                        )
+    parser.add_argument( "-m", "--MatrixDir"
+                       , dest    = "sMatrixDir"
+                       , metavar = "<MatrixDir>"
+                       , default = None
+                       , help    = "Build the word-document matrix on disk in this directory, rather than in memory"
+                       )
+    parser.add_argument( "-c", "--ChunkSize"
+                       , type    = int
+                       , dest    = "iChunkColumns"
+                       , metavar = "<ChunkSize>"
+                       , default = None
+                       , help    = "Number of documents per chunk for an on-disk matrix (-m) or sparse cooccurrences (-S), default 10,000"
+                       )
+    parser.add_argument( "-S", "--SparseQ"
+                       , dest    = "bSparseQ"
+                       , action  = "store_true"
+                       , default = False
+                       , help    = "Optional; if used, keep the cooccurrence matrix sparse"
+                       )
+    parser.add_argument( "-P", "--MinCoDocs"
+                       , type    = int
+                       , dest    = "iMinCoDocs"
+                       , metavar = "<MinCoDocs>"
+                       , default = 1
+                       , help    = "With -S, minimum number of documents a word pair must cooccur in to be kept"
+                       )
+    parser.add_argument( "-R", "--CandidateRows"
+                       , dest    = "bCandidateRows"
+                       , action  = "store_true"
+                       , default = False
+                       , help    = "Optional; if used, compute only the anchor candidates' rows of the cooccurrence matrix"
+                       )
+    parser.add_argument( "--anchor-threshold"
+                       , type    = float
+                       , dest    = "fAnchorThreshold"
+                       , metavar = "<AnchorThreshold>"
+                       , default = 0.01
+                       , help    = "Minimum fraction of abstracts a word must occur in to be an anchor candidate"
+                       )
+    parser.add_argument( "--recovery-cache"
+                       , dest    = "sRecoveryCacheDir"
+                       , metavar = "<RecoveryCacheDir>"
+                       , default = None
+                       , help    = "Optional; directory in which to cache topic recovery solutions"
+                       )
+    parser.add_argument( "--recovery-tolerance"
+                       , type    = float
+                       , dest    = "fRecoveryTolerance"
+                       , metavar = "<RecoveryTolerance>"
+                       , default = None
+                       , help    = "Convergence tolerance of the topic recovery (default 2e-7)"
+                       )
+    parser.add_argument( "-D", "--Dedup"
+                       , type    = float
+                       , dest    = "fDedupThreshold"
+                       , metavar = "<DedupThreshold>"
+                       , default = None
+                       , help    = "Optional; drop abstracts at least this similar to an earlier one"
+                       )
+    parser.add_argument( "--dedup-report"
+                       , dest    = "sDedupReportFName"
+                       , metavar = "<DedupReportFile>"
+                       , default = "stderr"
+                       , help    = "With -D, file to list the dropped abstracts in, defaults to stderr"
+                       )
+    parser.add_argument( "-E", "--Evaluate"
+                       , dest    = "bEvaluate"
+                       , action  = "store_true"
+                       , default = False
+                       , help    = "Optional; if used, add topic coherence and overlap measures to the output"
+                       )
+    parser.add_argument( "--hash-features"
+                       , type    = int
+                       , dest    = "iHashBits"
+                       , metavar = "<Bits>"
+                       , default = None
+                       , help    = "Map words to 2**Bits rows by hashing, building the matrix in one pass"
+                       )
+    parser.add_argument( "--run-dir"
+                       , dest    = "sRunDir"
+                       , metavar = "<RunDir>"
+                       , default = None
+                       , help    = "Optional; directory in which to checkpoint each phase's result"
+                       )
+    parser.add_argument( "--resume"
+                       , dest    = "bResume"
+                       , action  = "store_true"
+                       , default = False
+                       , help    = "With --run-dir, skip the phases whose checkpoints are valid"
+                       )
+    return parser
+
 
-    args = parser.parse_args()
+def GetCmdLineParameters():
+    """Return a tuple of args based on command line parameters.
+    """
+    args = make_parser().parse_args()
+    if not (0 <= args.fAnchorThreshold <= 1):
+        sys.stderr.write("Anchor threshold must be between 0 and 1.\n")
+        exit(1)
+    if args.fDedupThreshold is not None and not (0 < args.fDedupThreshold <= 1):
+        sys.stderr.write("Dedup threshold must be between 0 and 1.\n")
+        exit(1)
+    if args.iMinCoDocs > 1 and not args.bSparseQ:
+        sys.stderr.write("Pruning word pairs (-P) requires a sparse cooccurrence matrix (-S).\n")
+        exit(1)
+    if args.iSampleAbstracts is not None and args.iSampleAbstracts < 1:
+        sys.stderr.write("Sample size must be positive.\n")
+        exit(1)
+    if args.iHashBits is not None and not (1 <= args.iHashBits <= 30):
+        sys.stderr.write("--hash-features takes between 1 and 30 bits.\n")
+        exit(1)
+    if args.iHashBits is not None and args.sRunDir:
+        sys.stderr.write("--hash-features can't be used with --run-dir.\n")
+        exit(1)
+    if args.bResume and not args.sRunDir:
+        sys.stderr.write("--resume requires --run-dir.\n")
+        exit(1)
     #Open output (we don't open the input, because it's a glob; rather, we open
     # each input file separately, below):
-    if args.sOutFileName == 'stdout' and args.bExcel:
-        sys.stderr.write("Excel output incompatible with stdout.\n")
-        exit(1)
-    #If we get here, either output is text to stdout, or we're outputting to a file.
-    if args.sOutFileName == 'stdout':
-        strOut = codecs.getwriter('utf-8')(sys.stdout.buffer)
-    else:
-        if args.bExcel:
-            strOut = xlsxwriter.Workbook(args.sOutFileName)
-        else:
-            strOut = open(args.sOutFileName, 'w+', encoding='utf-8')
+    strOut = open_output(args.sOutFileName, args.bExcel)
 
     return (args.sInputGlob, strOut, args.bExcel, args.sStopWordsFName, \
             args.iMaxAbstracts, args.iMinWordLength, args.iNumAnchors, \
-            args.iNumWords)
+            args.iNumWords, args.sMatrixDir, args.iChunkColumns, args.bSparseQ, \
+            args.iMinCoDocs, args.bCandidateRows, args.fAnchorThreshold, \
+            args.sRecoveryCacheDir, args.fRecoveryTolerance, args.fDedupThreshold, \
+            args.sDedupReportFName, args.sRunDir, args.bResume, args.bEvaluate, \
+            args.iSampleAbstracts, args.iSampleSeed, args.iHashBits)
 
 
 
-#Set up logging:
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s %(name)-12s %(levelname)-8s %(message)s",
-    datefmt="%m-%d %H:%M",
-    filename="build_topic_model.log"
-)
-console = logging.StreamHandler()
-console.setLevel(logging.INFO) #Send all logging msgs to console
-formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
-console.setFormatter(formatter)
-logging.getLogger('').addHandler(console)
+def setup_logging(sLogFName="build_topic_model.log"):
+    """
+    Log everything to sLogFName, and info and above to the console.  Called by
+    the command line; a program importing this module configures its own
+    logging.
+    """
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format="%(asctime)s %(name)-12s %(levelname)-8s %(message)s",
+        datefmt="%m-%d %H:%M",
+        filename=sLogFName
+    )
+    console = logging.StreamHandler()
+    console.setLevel(logging.INFO) #Send all logging msgs to console
+    formatter = logging.Formatter('%(name)-12s: %(levelname)-8s %(message)s')
+    console.setFormatter(formatter)
+    logging.getLogger('').addHandler(console)
 
 
 def time_logger(logger, interval=5):
@@ -195,18 +390,41 @@ def time_logger(logger, interval=5):
             t = time.time()
 
 
-def read_stopwords(sStopWordsFile):
-    """Read StopWords from a file and return them as a set."""
-    try:
-        with Path(sStopWordsFile).open('r', encoding='utf-8') as strStopWordsFile:
-            return set(strStopWordsFile.read().splitlines())
-    except (FileNotFoundError, PermissionError, IOError):
-        sys.stderr.write("Unable to open stop words file '%s'\n"
-            %sStopWordsFile)
-        exit(1)
+def read_abstracts(PathList, iMaxAbstracts, Selection=None, bReport=False):
+    """
+    Yield (iFile, iAbstract, sAbstract) for each of the first iMaxAbstracts
+    abstracts (lines) of the input files, with iFile numbered from 1 and
+    iAbstract from 0 across all the files; or, if Selection is given, for the
+    abstracts it selects instead (see line_index.CorpusIndex), whatever
+    iMaxAbstracts.  If bReport, write each file's name to stderr as it's read.
+    """
+    if Selection is not None:
+        from line_index import CorpusIndex
+        for iFile, iAbstract, sAbstract in CorpusIndex(PathList).read(Selection):
+            yield iFile + 1, iAbstract, sAbstract
+        return
+    iAbstract = 0 #Abstracts read so far, from all the files
+    for iFile, sFileName in enumerate(PathList, start=1):
+        if iAbstract >= iMaxAbstracts:
+            if bReport:
+                sys.stderr.write("Too many abstracts, skipping file %s\n" %sFileName)
+            break
+        if bReport:
+            sys.stderr.write("Reading file %i = '%s'\n" %(iFile, sFileName))
+        try:
+            with open_text(sFileName) as strFile:
+                for sAbstract in strFile:
+                    if iAbstract >= iMaxAbstracts:
+                        break
+                    yield iFile, iAbstract, sAbstract
+                    iAbstract += 1
+        except (FileNotFoundError, PermissionError, IOError):
+            sys.stderr.write("Unable to open abstracts file '%s'\n" %sFileName)
+            exit(1)
 
 
-def get_words_and_documents(PathList, iMaxAbstracts, iMinWordLength, StopWords=set()):
+def get_words_and_documents(PathList, iMaxAbstracts, iMinWordLength, StopWords=set(),
+                            Dedup=None, Selection=None):
     """
     Identify all words and document IDs in the corpus.
 
@@ -222,54 +440,50 @@ def get_words_and_documents(PathList, iMaxAbstracts, iMinWordLength, StopWords=s
         iMaxAbstracts: Maximum number of abstracts to read
         iMinWordLength: Minimum word length, in characters
         StopWords (set of str): a set of words to ignore.
+        Dedup (dedup.NearDuplicateFilter): if given, skip the abstracts it
+            finds to be near-duplicates; their (iFile, iAbstract) positions
+            are left in Dedup.RemovedKeys, for build_matrix() to skip too.
+        Selection: if given, read only the abstracts it selects, rather than
+            the first iMaxAbstracts (see read_abstracts())
 
     Returns:
-        A tuple of (<list of str>, <list of str>): a list of all words in
-        the corpus, and a list of all document IDs in the corpus.
+        A tuple of (<StringStore>, <StringStore>, <list of int>): all the words
+        in the corpus (sorted), all the document IDs in the corpus, and the
+        number of documents each word occurs in (in the same order as the
+        words; used to pick anchor candidates).  The words and IDs are kept in
+        string_store.StringStore's, which act as lists of str.  The IDs are
+        collected straight into theirs, which also serves build_matrix() as
+        its index of them.  The words are counted in a Counter first, so
+        their peak memory is that of a dict; their store is for --run-dir,
+        which saves it and memory-maps it on --resume.
 
     Side-effects:
         writes to log.
     """
-    rxNum = re.compile("[\+\-]?[0-9\.\,]\%?") #Abstracts contain lots of numbers,
-       # don't want to capture those
-    Words = set()
-    Docs  = list()
+    from string_store import StringStore, StringStoreBuilder
+    Words = Counter() #Word -> number of documents it occurs in
+    Docs  = StringStoreBuilder()
     gwd_logger = logging.getLogger('get_words_...')
     tl = time_logger(gwd_logger)
-    iAbstractsPreviousFiles = 0
-    for iFile, sFileName in enumerate(PathList, start=1):
-        if iAbstractsPreviousFiles > iMaxAbstracts:
-            sys.stderr.write("Too many abstracts, skipping file %s\n"
-                %sFileName)
-            break
-        else:
-            sys.stderr.write("Reading file %i = '%s'\n" %(iFile, sFileName))
-        try:
-            with Path(sFileName).open('r', encoding='utf-8') as strFile:
-                for iAbstract, sAbstract in enumerate(strFile, start=iAbstractsPreviousFiles):
-                    #Init count with the count of abstracts found in previous files
-                    if iAbstract > iMaxAbstracts:
-                        break #Both from this loop, and from the outer for-loop
-                    next(tl)
-                    tl.send(('info', 'file {}, sAbstract {}'.format(sFileName, iFile)))
-                    Values = sAbstract.strip().split(' ')
-                    Docs.append(Values[0])
-                    NewWords = (set(Values[1:]) - StopWords)
-                    for sToken in sorted(NewWords):
-                        if '--' in sToken or \
-                           sToken[0] == '-' or \
-                           rxNum.match(sToken) or \
-                           len(sToken) < iMinWordLength:
-                            NewWords.remove(sToken)
-                    Words |= NewWords
-                iAbstractsPreviousFiles = iAbstract #For next file
-        except (FileNotFoundError, PermissionError, IOError):
-            sys.stderr.write("Unable to open abstracts file '%s'\n" %sFileName)
-            exit(1)
-    return sorted(Words), Docs
+    for iFile, iAbstract, sAbstract in read_abstracts(PathList, iMaxAbstracts, Selection,
+                                                      bReport=True):
+        next(tl)
+        tl.send(('info', 'file {}, sAbstract {}'.format(iFile, iAbstract)))
+        Values = sAbstract.strip().split(' ')
+        if Dedup is not None and \
+           Dedup.check(Values[0], Values[1:], (iFile, iAbstract)) is not None:
+            continue
+        Docs.append(Values[0])
+        NewWords = (set(Values[1:]) - StopWords)
+        Words.update(sToken for sToken in NewWords
+                     if is_word(sToken, iMinWordLength))
+    SortedWords = sorted(Words)
+    return StringStore.from_strings(SortedWords), Docs.finish(), \
+        [Words[sWord] for sWord in SortedWords]
 
 
-def build_matrix(PathList, WordsInCorpus, Docs, iMaxAbstracts):
+def build_matrix(PathList, WordsInCorpus, Docs, iMaxAbstracts, sMatrixDir=None,
+                 iChunkColumns=None, Skip=frozenset(), Selection=None):
     """
     Create a sparse matrix containing the counts of each word in each
     document in the corpus.
@@ -280,23 +494,42 @@ def build_matrix(PathList, WordsInCorpus, Docs, iMaxAbstracts):
            in each line is the PubMed ID for the abstract.  The other tokens
            on the line are preprocessed tokens from the abstract, separated by
            spaces.
-        WordsInCorpus (list of str): the complete list of words that appear in
-            the corpus.
-        Docs (list of str): the complete list of document IDs that
-            occur in the corpus.
+        WordsInCorpus (list of str, or string_store.StringStore): the complete
+            list of words that appear in the corpus.
+        Docs (list of str, or string_store.StringStore): the complete list of
+            document IDs that occur in the corpus.  If this is a StringStore
+            (as get_words_and_documents() returns), it serves as the index of
+            documents (one lookup per abstract); the index of words, looked up
+            for every token, is always a dict, which is much faster.
         iMaxAbstracts
+        sMatrixDir (str): if given, write the matrix to this directory, one
+            chunk of iChunkColumns documents at a time, instead of building it
+            in memory.  Each abstract then gets its own column, in the order
+            read (in memory, a repeated ID overwrites the earlier column).
+            iChunkColumns defaults to disk_matrix.iDEFAULT_CHUNK_COLUMNS.
+        Skip (set): (iFile, iAbstract) positions of abstracts to leave out
+            (see get_words_and_documents())
+        Selection: as for get_words_and_documents()
 
     Returns:
-        (scipy.sparse.csc_matrix): a matrix where each row represents a
+        (scipy.sparse.csc_matrix, or disk_matrix.DiskCSCMatrix if sMatrixDir
+            is given): a matrix where each row represents a
             word, each column represents a document, and each cell
             represents the frequency of a given word in a given
             document.
     """
-    DocIndex = {sDocID: iDoc for iDoc, sDocID in enumerate(Docs)}
+    from scipy import sparse
+    from disk_matrix import DiskCSCWriter, iDEFAULT_CHUNK_COLUMNS
+    from string_store import StringStore
+    DocIndex = Docs if isinstance(Docs, StringStore) else StringStore.from_strings(Docs)
     WordIndex = {sWord: iWord for iWord, sWord in enumerate(WordsInCorpus)}
     buildm_logger = logging.getLogger('build_matrix')
     tl = time_logger(buildm_logger)
-    matrixWordDoc = sparse.lil_matrix((len(WordsInCorpus), len(Docs)), dtype=int)
+    if sMatrixDir:
+        DiskWriter = DiskCSCWriter(sMatrixDir, len(WordsInCorpus),
+                                   iChunkColumns or iDEFAULT_CHUNK_COLUMNS)
+    else:
+        matrixWordDoc = sparse.lil_matrix((len(WordsInCorpus), len(Docs)), dtype=int)
     #Attempted this with various types of sparse matrices; see documentation of
     # these at https://rushter.com/blog/scipy-sparse-matrices/.  Results:
     #   bsr_matrix: Fails with NotImplementedError
@@ -337,75 +570,429 @@ def build_matrix(PathList, WordsInCorpus, Docs, iMaxAbstracts):
     #              line 255, in diag
     #              res = zeros((n, n), v.dtype)
     #       MemoryError
-    iAbstractsPreviousFiles = 0
-    for iFile, sFileName in enumerate(PathList, start=1):
-        with Path(sFileName).open('r', encoding='utf-8') as strFile:
-            for iAbstract, sAbstract in enumerate(strFile, start=iAbstractsPreviousFiles):
-                #Init count with the count of abstracts found in previous files
-                if iAbstract > iMaxAbstracts:
-                    break
-                next(tl)
-                tl.send(('info', 'file {}, sAbstract {}'.format(iFile, iAbstract)))
-                #Tokenize:
-                TokensInAbstract = [sWordToken for sWordToken in sAbstract.strip().split(' ')]
-                #tokens --> types with count:
-                WordCounts = Counter([sWordToken for sWordToken in TokensInAbstract[1:] \
-                                        if sWordToken in WordIndex])
-                    #Starting TokensInAbstract at [1] means we skip the first "token"
-                    # in sAbstract, which is actually the document ID
-                for sWordType in WordCounts: #sWord is a key in WordCounts
-                    matrixWordDoc[WordIndex[sWordType], DocIndex[TokensInAbstract[0]]] = \
-                        WordCounts[sWordType]
-            iAbstractsPreviousFiles = iAbstract #For next file
+    for iFile, iAbstract, sAbstract in read_abstracts(PathList, iMaxAbstracts, Selection):
+        if (iFile, iAbstract) in Skip:
+            continue
+        next(tl)
+        tl.send(('info', 'file {}, sAbstract {}'.format(iFile, iAbstract)))
+        #Tokenize:
+        TokensInAbstract = [sWordToken for sWordToken in sAbstract.strip().split(' ')]
+        #tokens --> types with count --> rows with count:
+        WordCounts = {}
+        for sWordType, iCount in Counter(TokensInAbstract[1:]).items():
+            iWord = WordIndex.get(sWordType)
+            if iWord is not None:
+                WordCounts[iWord] = iCount
+            #Starting TokensInAbstract at [1] means we skip the first "token"
+            # in sAbstract, which is actually the document ID
+        if sMatrixDir:
+            WordIndices = sorted(WordCounts)
+            DiskWriter.add_column(WordIndices, [WordCounts[iWord] for iWord in WordIndices])
+            continue
+        iDoc = DocIndex.index(TokensInAbstract[0])
+        for iWord in WordCounts:
+            matrixWordDoc[iWord, iDoc] = WordCounts[iWord]
+    if sMatrixDir:
+        return DiskWriter.close()
     return matrixWordDoc.tocsc()
 
 
-# =============== MAIN ===================
-(sInputGlob, strOut, bExcel, sStopWordsFName, iMaxAbstracts, iMinWordLength, iNumAnchors, iNumWords) \
-    = GetCmdLineParameters()
-StopWords = read_stopwords(sStopWordsFName)
-PathList = glob(sInputGlob)
-Words, Docs = get_words_and_documents(PathList, iMaxAbstracts, iMinWordLength, StopWords)
-sys.stderr.write("Read %i abstracts, containing %i Words.\n"
-    %(len(Docs), len(Words)))
-matrixWordDoc = build_matrix(PathList, Words, Docs, iMaxAbstracts)
-#Fix: why do we pass PathList and iMaxAbstracts to both get_words_and_documents()
-#Fix: and build_matrix()?
-
-#Fix: Ff requires scipy_sparse v0.19, we have 0.18
-#Fix: scipy.sparse.save_npz("matrixWordDoc.npz", matrixWordDoc)
-    #Debug: Save the above matrix so we don't have to rebuild it while
-    #Debug: with changes to other modules.
-matrixWordTopic, matrixWordCoocur, Anchors = \
-   model_topics(M=matrixWordDoc, k=iNumAnchors, threshold=0.01)
+def hash_words_and_documents(PathList, iMaxAbstracts, iMinWordLength, iHashBits,
+                             StopWords=set(), Dedup=None, Selection=None, sMatrixDir=None,
+                             iChunkColumns=None):
+    """
+    Same as get_words_and_documents() followed by build_matrix(), but in a
+    single pass over the corpus, giving each word the row of its hash bucket
+    (see feature_hashing.py) rather than of its place in the vocabulary.
+
+    Args:
+        iHashBits: number of bits of the hash to use (2**iHashBits buckets)
+        Others: as for get_words_and_documents() and build_matrix()
+
+    Returns:
+        (Words, Docs, DocFreqs, matrixWordDoc), as returned by
+        get_words_and_documents() and build_matrix(), except that the rows are
+        the buckets used, in order of bucket number, and each of Words is the
+        label of its bucket (its most frequent words, joined by '|').  As with
+        sMatrixDir, each abstract gets its own column, in the order read.
+    """
+    from array import array
+    import numpy
+    from scipy import sparse
+    from disk_matrix import DiskCSCMatrix, DiskCSCWriter, compact_rows, iDEFAULT_CHUNK_COLUMNS
+    from feature_hashing import FeatureHasher
+    from string_store import StringStore, StringStoreBuilder
+    Hasher = FeatureHasher(iHashBits)
+    Docs = StringStoreBuilder()
+    if sMatrixDir:
+        DiskWriter = DiskCSCWriter(sMatrixDir, 2 ** iHashBits,
+                                   iChunkColumns or iDEFAULT_CHUNK_COLUMNS)
+    else:
+        Indices, Counts, Indptr = array('q'), array('i'), array('q', [0])
+    hash_logger = logging.getLogger('hash_words_...')
+    tl = time_logger(hash_logger)
+    for iFile, iAbstract, sAbstract in read_abstracts(PathList, iMaxAbstracts, Selection,
+                                                      bReport=True):
+        next(tl)
+        tl.send(('info', 'file {}, sAbstract {}'.format(iFile, iAbstract)))
+        Values = sAbstract.strip().split(' ')
+        if Dedup is not None and \
+           Dedup.check(Values[0], Values[1:], (iFile, iAbstract)) is not None:
+            continue
+        Docs.append(Values[0])
+        BucketCounts = Counter()
+        for sToken, iCount in Counter(Values[1:]).items():
+            if sToken not in StopWords and is_word(sToken, iMinWordLength):
+                BucketCounts[Hasher.add(sToken)] += iCount
+        Buckets = sorted(BucketCounts)
+        if sMatrixDir:
+            DiskWriter.add_column(Buckets, [BucketCounts[iBucket] for iBucket in Buckets])
+            continue
+        Indices.extend(Buckets)
+        Counts.extend(BucketCounts[iBucket] for iBucket in Buckets)
+        Indptr.append(len(Indices))
+    sys.stderr.write(Hasher.report())
+    #Keep only the rows of the buckets used (numbered in the same order, so
+    # each column's rows stay sorted):
+    Used = numpy.array(sorted(Hasher.Forms), dtype=numpy.int64)
+    Words = StringStore.from_strings(Hasher.label(iBucket) for iBucket in Used)
+    if sMatrixDir:
+        DiskWriter.close()
+        DocFreqs = compact_rows(sMatrixDir, Used)
+        return Words, Docs.finish(), DocFreqs.tolist(), DiskCSCMatrix(sMatrixDir)
+    Rows = numpy.searchsorted(Used, numpy.frombuffer(Indices, dtype=numpy.int64)).astype(numpy.int32)
+    matrixWordDoc = sparse.csc_matrix((numpy.frombuffer(Counts, dtype=numpy.int32).astype(int),
+                                       Rows, numpy.frombuffer(Indptr, dtype=numpy.int64)),
+                                      shape=(len(Used), len(Docs)))
+    DocFreqs = numpy.bincount(Rows, minlength=len(Used))
+    return Words, Docs.finish(), DocFreqs.tolist(), matrixWordDoc
+
+
+def model_topics_chunked(matrixWordDoc, k, threshold, iChunkColumns, seed=1,
+                         bSparseQ=False, iMinCoDocs=1, fTolerance=2e-7, Cache=None):
+    """
+    Same as anchor_topic.topics.model_topics(), but the cooccurrence matrix Q is
+    accumulated one chunk of documents at a time, so an out-of-core
+    word-document matrix is never in memory as a whole; and Q may be kept
+    sparse.
+
+    Args:
+        matrixWordDoc (scipy.sparse matrix or disk_matrix.DiskCSCMatrix):
+            word-document matrix
+        k, threshold, seed: as for model_topics()
+        iChunkColumns: number of documents per chunk
+        bSparseQ: keep Q sparse
+        iMinCoDocs: with bSparseQ, drop word pairs which cooccur in fewer than
+            this many documents
+        fTolerance, Cache: convergence tolerance of the topic recovery, and
+            recovery_cache.RecoveryCache (or None)
+
+    Returns:
+        Same as model_topics(): (word-topic matrix, Q, list of anchor lists)
+    """
+    from anchor_model import model_topics_from_sums
+    from cooccurrence import CooccurrenceSums, column_chunks
+    Sums = CooccurrenceSums(matrixWordDoc.shape[0], bSparse=bSparseQ,
+                            bCoDocs=bSparseQ and iMinCoDocs > 1)
+    for Chunk in column_chunks(matrixWordDoc, iChunkColumns):
+        Sums.add_chunk(Chunk)
+    return model_topics_from_sums(Sums, k, threshold, seed, bSparseQ, iMinCoDocs,
+                                  fTolerance, Cache)
+
+
+def write_dedup_report(Dedup, sDedupReportFName):
+    """Write the report of a dedup.NearDuplicateFilter to a file, or 'stderr'."""
+    if sDedupReportFName == 'stderr':
+        Dedup.write_report(sys.stderr)
+    else:
+        with open(sDedupReportFName, 'w', encoding='utf-8') as strReport:
+            Dedup.write_report(strReport)
+
+
+def compute_topics(matrixWordDoc, Words, DocFreqs, iNumAnchors, fAnchorThreshold,
+                   iChunkColumns=None, bSparseQ=False, iMinCoDocs=1,
+                   bCandidateRows=False, sRecoveryCacheDir=None, fRecoveryTolerance=None):
+    """
+    Model the topics of a word-document matrix, by whichever of the methods
+    described in the module documentation the arguments select.
+
+    Args:
+        matrixWordDoc: as returned by build_matrix()
+        Words, DocFreqs: as returned by get_words_and_documents()
+        iNumAnchors, fAnchorThreshold: number of topics, and minimum fraction
+            of documents an anchor candidate must occur in
+        iChunkColumns, bSparseQ, iMinCoDocs, bCandidateRows, sRecoveryCacheDir,
+            fRecoveryTolerance: as for the -c, -S, -P, -R, --recovery-cache
+            and --recovery-tolerance arguments (None for their defaults)
+
+    Returns:
+        Same as anchor_topic.topics.model_topics(): (word-topic matrix, Q,
+        list of anchor lists)
+    """
+    from disk_matrix import iDEFAULT_CHUNK_COLUMNS
+    iChunkColumns = iChunkColumns or iDEFAULT_CHUNK_COLUMNS
+    RecoveryCacheObj = None
+    if sRecoveryCacheDir:
+        from recovery_cache import RecoveryCache
+        #-R doesn't prune Q; and only -S does:
+        RecoveryCacheObj = RecoveryCache(sRecoveryCacheDir,
+                                         corpus_fingerprint(Words, DocFreqs, matrixWordDoc.shape[1]),
+                                         iMinCoDocs if bSparseQ and not bCandidateRows else 1,
+                                         fRecoveryTolerance or 2e-7)
+    if bCandidateRows:
+        from anchor_model import model_topics_candidates
+        return model_topics_candidates(matrixWordDoc, iNumAnchors, fAnchorThreshold, DocFreqs,
+                                       iChunkColumns, bSparseQ=bSparseQ,
+                                       fTolerance=fRecoveryTolerance or 2e-7,
+                                       Cache=RecoveryCacheObj)
+    if hasattr(matrixWordDoc, 'iter_column_chunks') or bSparseQ or RecoveryCacheObj \
+       or fRecoveryTolerance is not None:
+        return model_topics_chunked(matrixWordDoc, iNumAnchors, fAnchorThreshold, iChunkColumns,
+                                    bSparseQ=bSparseQ, iMinCoDocs=iMinCoDocs,
+                                    fTolerance=fRecoveryTolerance or 2e-7,
+                                    Cache=RecoveryCacheObj)
+    from anchor_topic.topics import model_topics
+    return model_topics(M=matrixWordDoc, k=iNumAnchors, threshold=fAnchorThreshold)
   #Documentation for model_topics() at
   #    https://github.com/forest-snow/anchor-topic
   # Args:
   #   M         = a word-document matrix
   #   k         = number of topics
   #   threshold = minimum percentage of document occurrences for word to be
-  #               considered as an anchor candidate  (How to set this?)
+  #               considered as an anchor candidate  (set by --anchor-threshold)
   #Outputs:
   # A       = word-topic matrix
   # Q       = word-cooccurrence matrix
   # Anchors = 2D list of anchor words for each topic
-if bExcel:
-    TextFormat = strOut.add_format()
-    TextFormat.set_align('vjustify')   #'vjustify' means wrapped
-    strWorksheet = strOut.add_worksheet()
-    strWorksheet.set_default_row(30)  #Sets height; default is 15 (units of what?)
-    strWorksheet.set_column(0, 0,  25, TextFormat) #Column A:  25 "default" characters wide
-    strWorksheet.set_column(1, 1, 125, TextFormat) #Column B: 125 "default" characters wide
-for iAnchor, Anchor in enumerate(Anchors, start=0):
-    if bExcel:
-        strWorksheet.write("A%i" %(iAnchor+1), " ".join(Words[iAnchor] for iAnchor in Anchor))
-    else: #Text output
-        strOut.write("%s\n" %" ".join(Words[iAnchor] for iAnchor in Anchor))
-    TopicWords = []
-    for iWord in list(matrixWordTopic[:,iAnchor].argsort())[:-(iNumWords+1):-1]:
-        TopicWords.append(Words[iWord])
-    if bExcel:
-        strWorksheet.write("B%i" %(iAnchor+1), ", ".join(TopicWords))
-    else: #Text output
-        strOut.write("%s\n\n" %", ".join(TopicWords))
-strOut.close()
+
+
+
+def load_checkpointed_matrix(Run, sMatrixDir=None):
+    """
+    Return the word-document matrix checkpointed by run_checkpointed() in Run
+    (a checkpoint.RunDirectory), or written to sMatrixDir.
+    """
+    if sMatrixDir:
+        from disk_matrix import DiskCSCMatrix
+        return DiskCSCMatrix(sMatrixDir)
+    from scipy import sparse
+    return sparse.load_npz(Run.path('matrix.npz')).tocsc()
+
+
+def run_checkpointed(Run, PathList, iMaxAbstracts, iMinWordLength, StopWords, iNumAnchors,
+                     fAnchorThreshold, sMatrixDir=None, iChunkColumns=None, bSparseQ=False,
+                     iMinCoDocs=1, bCandidateRows=False, sRecoveryCacheDir=None,
+                     fRecoveryTolerance=None, Dedup=None, sDedupReportFName='stderr',
+                     Selection=None):
+    """
+    Same as get_words_and_documents(), build_matrix() and compute_topics() in
+    turn, but checkpointing the result of each phase in a run directory, and
+    (when resuming) reusing the results of the phases already completed.  With
+    bCandidateRows, the anchors and recovery are a single phase.  Unlike
+    compute_topics(), the default method goes through cooccurrence sums (as
+    with -m), since the library's model_topics() has no intermediate results.
+
+    Args:
+        Run (checkpoint.RunDirectory): the run directory
+        Others: as for get_words_and_documents(), build_matrix() and
+            compute_topics()
+
+    Returns:
+        (Words, word-topic matrix, list of anchor lists)
+    """
+    import json
+    import numpy
+    from scipy import sparse
+    from anchor_model import anchors_from_sums, model_topics_candidates, recover_word_topics
+    from checkpoint import input_key, phase_key
+    from cooccurrence import CooccurrenceSums, column_chunks
+    from disk_matrix import iDEFAULT_CHUNK_COLUMNS, is_disk_matrix
+    from string_store import StringStore
+    iChunkColumns = iChunkColumns or iDEFAULT_CHUNK_COLUMNS
+    fTolerance = fRecoveryTolerance or 2e-7
+    #The keys depend only on the arguments, so we know up front which phases
+    # are complete, and need only load the results that later phases use:
+    Keys = {'vocabulary': input_key(PathList, iMaxAbstracts, iMinWordLength, sorted(StopWords),
+                                    Dedup and Dedup.fThreshold,
+                                    Selection and [Lines.tobytes() for Lines in Selection],
+                                    'string stores')} #Format of the checkpoint
+    Keys['matrix'] = phase_key('matrix', Keys['vocabulary'],
+                               sMatrixDir and str(Path(sMatrixDir).resolve()))
+    if bCandidateRows:
+        Keys['topics'] = phase_key('topics', Keys['matrix'], iNumAnchors, fAnchorThreshold,
+                                   bSparseQ, fTolerance)
+        Phases = ['vocabulary', 'matrix', 'topics']
+    else:
+        Keys['cooccurrence'] = phase_key('cooccurrence', Keys['matrix'], bSparseQ,
+                                         bSparseQ and iMinCoDocs > 1)
+        Keys['anchors'] = phase_key('anchors', Keys['cooccurrence'], iNumAnchors,
+                                    fAnchorThreshold, iMinCoDocs)
+        Keys['recovery'] = phase_key('recovery', Keys['anchors'], fTolerance)
+        Phases = ['vocabulary', 'matrix', 'cooccurrence', 'anchors', 'recovery']
+    Done = [Run.completed(sPhase, Keys[sPhase])
+            and (sPhase != 'matrix' or not sMatrixDir or is_disk_matrix(sMatrixDir))
+            for sPhase in Phases]
+    iFirstToDo = Done.index(False) if False in Done else len(Phases)
+    for sPhase in Phases[:iFirstToDo]:
+        sys.stderr.write("Reusing checkpoint of phase '%s'\n" %sPhase)
+    def to_do(sPhase):
+        if Phases.index(sPhase) < iFirstToDo:
+            return False
+        Run.begin(sPhase)
+        return True
+
+    if to_do('vocabulary'):
+        Words, Docs, DocFreqs = get_words_and_documents(PathList, iMaxAbstracts, iMinWordLength,
+                                                        StopWords, Dedup, Selection)
+        Skip = []
+        if Dedup is not None:
+            write_dedup_report(Dedup, sDedupReportFName)
+            Skip = sorted(Dedup.RemovedKeys)
+        Words.save(Run.path('words'))
+        Docs.save(Run.path('docs'))
+        with open(Run.path('vocabulary.npz'), 'wb') as strOut:
+            numpy.savez(strOut, DocFreqs=numpy.array(DocFreqs),
+                        Skip=numpy.array(Skip, dtype=numpy.int64).reshape(-1, 2))
+        Run.complete('vocabulary', Keys['vocabulary'], ['words', 'docs', 'vocabulary.npz'])
+    else:
+        Words, Docs = StringStore.load(Run.path('words')), StringStore.load(Run.path('docs'))
+        with numpy.load(Run.path('vocabulary.npz')) as Arrays:
+            DocFreqs = Arrays['DocFreqs'].tolist()
+            Skip = [tuple(Key) for Key in Arrays['Skip'].tolist()]
+    sys.stderr.write("Read %i abstracts, containing %i Words.\n" %(len(Docs), len(Words)))
+    check_anchor_candidates(DocFreqs, len(Docs), fAnchorThreshold, iNumAnchors)
+
+    matrixWordDoc = None
+    if to_do('matrix'):
+        matrixWordDoc = build_matrix(PathList, Words, Docs, iMaxAbstracts, sMatrixDir,
+                                     iChunkColumns, set(Skip), Selection)
+        Files = []
+        if not sMatrixDir:
+            sparse.save_npz(Run.path('matrix.npz'), matrixWordDoc, compressed=False)
+            Files = ['matrix.npz']
+        Run.complete('matrix', Keys['matrix'], Files)
+    elif iFirstToDo < len(Phases) and Phases[iFirstToDo] in ('cooccurrence', 'topics'):
+        matrixWordDoc = load_checkpointed_matrix(Run, sMatrixDir)
+
+    Cache = None
+    if sRecoveryCacheDir:
+        from recovery_cache import RecoveryCache
+        Cache = RecoveryCache(sRecoveryCacheDir, corpus_fingerprint(Words, DocFreqs, len(Docs)),
+                              iMinCoDocs if bSparseQ and not bCandidateRows else 1, fTolerance)
+    if bCandidateRows:
+        if to_do('topics'):
+            A, _, Anchors = model_topics_candidates(matrixWordDoc, iNumAnchors, fAnchorThreshold,
+                                                    DocFreqs, iChunkColumns, bSparseQ=bSparseQ,
+                                                    fTolerance=fTolerance, Cache=Cache)
+            with open(Run.path('topics.npz'), 'wb') as strOut:
+                numpy.savez(strOut, A=A, Anchors=numpy.array(Anchors))
+            Run.complete('topics', Keys['topics'], ['topics.npz'])
+            return Words, A, Anchors
+        with numpy.load(Run.path('topics.npz')) as Arrays:
+            return Words, Arrays['A'], Arrays['Anchors'].tolist()
+
+    if to_do('cooccurrence'):
+        Sums = CooccurrenceSums(matrixWordDoc.shape[0], bSparse=bSparseQ,
+                                bCoDocs=bSparseQ and iMinCoDocs > 1)
+        for Chunk in column_chunks(matrixWordDoc, iChunkColumns):
+            Sums.add_chunk(Chunk)
+        Sums.save(Run.path('cooccurrence.npz'), Keys['cooccurrence'])
+        Run.complete('cooccurrence', Keys['cooccurrence'], ['cooccurrence.npz'])
+    elif iFirstToDo < len(Phases):
+        Sums = CooccurrenceSums.load(Run.path('cooccurrence.npz'))[0]
+    del matrixWordDoc
+
+    if to_do('anchors'):
+        Q, Anchors = anchors_from_sums(Sums, iNumAnchors, fAnchorThreshold,
+                                       bSparseQ=bSparseQ, iMinCoDocs=iMinCoDocs)
+        with open(Run.path('anchors.json'), 'w', encoding='utf-8') as strOut:
+            json.dump([list(map(int, Anchor)) for Anchor in Anchors], strOut)
+        Run.complete('anchors', Keys['anchors'], ['anchors.json'])
+    else:
+        with open(Run.path('anchors.json'), 'r', encoding='utf-8') as strIn:
+            Anchors = json.load(strIn)
+        if iFirstToDo < len(Phases):
+            Q = Sums.sparse_Q(iMinCoDocs=iMinCoDocs) if bSparseQ else Sums.Q()
+
+    if to_do('recovery'):
+        A = recover_word_topics(Q, Anchors, fTolerance, Cache)
+        numpy.save(Run.path('recovery.npy'), A)
+        Run.complete('recovery', Keys['recovery'], ['recovery.npy'])
+    else:
+        A = numpy.load(Run.path('recovery.npy'))
+    return Words, A, Anchors
+
+
+
+# =============== MAIN ===================
+if __name__ == '__main__':
+    (sInputGlob, strOut, bExcel, sStopWordsFName, iMaxAbstracts, iMinWordLength, iNumAnchors,
+     iNumWords, sMatrixDir, iChunkColumns, bSparseQ, iMinCoDocs, bCandidateRows,
+     fAnchorThreshold, sRecoveryCacheDir, fRecoveryTolerance, fDedupThreshold,
+     sDedupReportFName, sRunDir, bResume, bEvaluate, iSampleAbstracts, iSampleSeed,
+     iHashBits) \
+        = GetCmdLineParameters()
+    setup_logging()
+    StopWords = read_stopwords(sStopWordsFName)
+    PathList = glob(sInputGlob)
+    Selection = None
+    if iSampleAbstracts:
+        from line_index import CorpusIndex
+        Corpus = CorpusIndex(PathList)
+        Selection = Corpus.sample(iSampleAbstracts, iSampleSeed)
+        sys.stderr.write("Sampling %i of %i abstracts\n"
+            %(sum(len(Lines) for Lines in Selection), Corpus.iLines))
+    Dedup = None
+    if fDedupThreshold is not None:
+        from dedup import NearDuplicateFilter
+        Dedup = NearDuplicateFilter(fDedupThreshold)
+    if sRunDir:
+        from checkpoint import RunDirectory
+        Run = RunDirectory(sRunDir, bResume)
+        Words, matrixWordTopic, Anchors = \
+            run_checkpointed(Run, PathList, iMaxAbstracts,
+                             iMinWordLength, StopWords, iNumAnchors, fAnchorThreshold,
+                             sMatrixDir, iChunkColumns, bSparseQ, iMinCoDocs, bCandidateRows,
+                             sRecoveryCacheDir, fRecoveryTolerance, Dedup, sDedupReportFName,
+                             Selection)
+    else:
+        if iHashBits:
+            Words, Docs, DocFreqs, matrixWordDoc = \
+                hash_words_and_documents(PathList, iMaxAbstracts, iMinWordLength, iHashBits,
+                                         StopWords, Dedup, Selection, sMatrixDir, iChunkColumns)
+        else:
+            Words, Docs, DocFreqs = get_words_and_documents(PathList, iMaxAbstracts,
+                                                            iMinWordLength, StopWords, Dedup,
+                                                            Selection)
+        if Dedup is not None:
+            write_dedup_report(Dedup, sDedupReportFName)
+        sys.stderr.write("Read %i abstracts, containing %i Words.\n"
+            %(len(Docs), len(Words)))
+        check_anchor_candidates(DocFreqs, len(Docs), fAnchorThreshold, iNumAnchors)
+        if not iHashBits:
+            matrixWordDoc = build_matrix(PathList, Words, Docs, iMaxAbstracts, sMatrixDir,
+                                         iChunkColumns,
+                                         Dedup.RemovedKeys if Dedup is not None else frozenset(),
+                                         Selection)
+        #Fix: why do we pass PathList and iMaxAbstracts to both get_words_and_documents()
+        #Fix: and build_matrix()?
+
+        #Fix: Ff requires scipy_sparse v0.19, we have 0.18
+        #Fix: scipy.sparse.save_npz("matrixWordDoc.npz", matrixWordDoc)
+            #Debug: Save the above matrix so we don't have to rebuild it while
+            #Debug: with changes to other modules.
+        matrixWordTopic, matrixWordCoocur, Anchors = \
+            compute_topics(matrixWordDoc, Words, DocFreqs, iNumAnchors, fAnchorThreshold,
+                           iChunkColumns, bSparseQ, iMinCoDocs, bCandidateRows,
+                           sRecoveryCacheDir, fRecoveryTolerance)
+    Metrics = None
+    if bEvaluate:
+        from disk_matrix import iDEFAULT_CHUNK_COLUMNS
+        from topic_quality import evaluate_topics, summary
+        if sRunDir:
+            matrixWordDoc = load_checkpointed_matrix(Run, sMatrixDir)
+        Metrics = evaluate_topics(matrixWordDoc, Anchors, matrixWordTopic, iNumWords,
+                                  iChunkColumns or iDEFAULT_CHUNK_COLUMNS)
+        sys.stderr.write("Topic quality: %s\n" %summary(Metrics))
+    write_topics(strOut, bExcel, Words, Anchors, matrixWordTopic, iNumWords, Metrics)
+    strOut.close()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Checkpoints of the phases of a long topic-model run (vocabulary, matrix,
+cooccurrences, anchors, recovery), so that a run which fails in a late phase
+can be resumed from the last phase completed, rather than from the start.
+
+A run directory holds each phase's result (in numpy's binary formats) and a
+manifest, phases.json, recording for each completed phase a key and the files
+it wrote.  The key is a hash of everything the phase's result depends on: its
+own parameters, and the key of the phase it starts from (the first phase's key
+covers the input files, by path, size and modification time, rather than by
+content, which would mean reading them all).  So a checkpoint is reused only if
+it was computed from the same inputs with the same parameters, and a change to
+any phase invalidates it and every later phase.
+
+A phase's manifest entry is removed before it starts writing its files, and
+added back when it is done, so that a run killed part way through a phase
+never leaves a checkpoint that looks complete.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+
+sMANIFEST_FNAME = 'phases.json'
+
+
+def input_key(PathList, *Params):
+    """
+    Return a key for a list of input files (in order, each identified by
+    resolved path, size and modification time) and any other parameters.
+    """
+    Stats = []
+    for sFileName in map(str, PathList):
+        Stat = os.stat(sFileName)
+        Stats.append((str(Path(sFileName).resolve()), Stat.st_size, Stat.st_mtime_ns))
+    return phase_key('inputs', Stats, *Params)
+
+
+def phase_key(*Parts):
+    """Return a key (hex digest) for a phase, from its parent's key and parameters."""
+    return hashlib.sha1(repr(Parts).encode('utf-8')).hexdigest()
+
+
+class RunDirectory:
+    """
+    A run directory (see module documentation).  If bResume is False, existing
+    checkpoints are ignored (and overwritten as the run proceeds).
+    """
+    def __init__(self, sRunDir, bResume=False):
+        self.Dir = Path(sRunDir)
+        self.Dir.mkdir(parents=True, exist_ok=True)
+        self.bResume = bResume
+        try:
+            with (self.Dir / sMANIFEST_FNAME).open('r', encoding='utf-8') as strIn:
+                self.Phases = json.load(strIn)
+        except (FileNotFoundError, ValueError):
+            self.Phases = {}
+
+    def path(self, sFName):
+        """Return the path of a file in the run directory, as a str."""
+        return str(self.Dir / sFName)
+
+    def completed(self, sPhase, sKey):
+        """
+        Return True if resuming, and phase sPhase was completed with key sKey
+        and its files are all still there.
+        """
+        Entry = self.Phases.get(sPhase)
+        return self.bResume and Entry is not None and Entry['key'] == sKey \
+            and all((self.Dir / sFName).exists() for sFName in Entry['files'])
+
+    def _write_manifest(self):
+        sTmpFName = self.path(sMANIFEST_FNAME + '.tmp')
+        with open(sTmpFName, 'w', encoding='utf-8') as strOut:
+            json.dump(self.Phases, strOut, indent=1)
+        os.replace(sTmpFName, self.path(sMANIFEST_FNAME))
+
+    def begin(self, sPhase):
+        """Mark phase sPhase as incomplete, before (re)writing its files."""
+        if self.Phases.pop(sPhase, None) is not None:
+            self._write_manifest()
+
+    def complete(self, sPhase, sKey, Files):
+        """Record that phase sPhase has written Files (names in the run directory)."""
+        self.Phases[sPhase] = {'key': sKey, 'files': list(Files)}
+        self._write_manifest()
@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+"""
+Transparent reading and writing of compressed text files (abstract files and
+tokenized corpora), selected by file extension:
+    .gz, .gzip   gzip
+    .zst, .zstd  Zstandard (requires the 'zstandard' package)
+    .xz, .lzma   xz
+Any other extension is read and written as plain text.
+
+Large compressed files are normally decompressed on a single core.  To allow
+multi-threaded decompression, files written by this module are split into
+independently compressed blocks of about BLOCK_SIZE bytes (of uncompressed
+text), together with the information needed to find the blocks without
+decompressing anything:
+  gzip: each block is a separate gzip member, whose header carries an extra
+        subfield 'PB' holding the compressed size of the member (the same idea
+        as BGZF, but without BGZF's 64KB limit on block size).  Any gzip reader
+        can read these files, since gzip allows multiple members.
+  zstd: each block is a separate frame, and the file ends with a seek table in
+        the Zstandard "seekable format" (a skippable frame listing the
+        compressed and decompressed size of each frame).  Any zstd reader can
+        read these files, since readers skip skippable frames.
+When reading such a file, the blocks are decompressed in parallel by a pool of
+threads (zlib and zstandard release the GIL while decompressing).  The pool
+has iDEFAULT_THREADS threads (at most 8) unless told otherwise, and however
+many threads there are, a reader or writer holds at most LOOKAHEAD_SIZE bytes
+of uncompressed data in blocks waiting to be read or written.  Files
+without block information (e.g. made by the gzip or zstd command line tools),
+and all xz files, are decompressed serially.
+
+Usage:
+    with open_text(sFileName) as strIn:        #Read, any format
+        for sLine in strIn: ...
+    with open_text(sFileName, 'w') as strOut:  #Write, format from extension
+        strOut.write(...)
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import gzip
+import io
+import lzma
+import os
+from pathlib import Path
+import struct
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+BLOCK_SIZE = 4 * 1024 * 1024 #Uncompressed bytes per independently compressed block
+LOOKAHEAD_SIZE = 64 * 1024 * 1024 #Uncompressed bytes in blocks queued per reader or writer
+iDEFAULT_THREADS = min(os.cpu_count() or 1, 8)
+
+GZIP_EXTENSIONS = ('.gz', '.gzip')
+ZSTD_EXTENSIONS = ('.zst', '.zstd')
+XZ_EXTENSIONS   = ('.xz', '.lzma')
+
+#gzip member header with FEXTRA set, followed by XLEN and a 'PB' subfield:
+GZIP_HEADER = struct.Struct('<BBBBIBBH2sHI')
+GZIP_MAGIC  = b'\x1f\x8b'
+GZIP_FLAG_FEXTRA = 4
+GZIP_PB_ID  = b'PB'
+#zstd seekable format:
+ZSTD_SKIPPABLE_MAGIC = 0x184D2A5E
+ZSTD_SEEKABLE_MAGIC  = 0x8F92EAB1
+ZSTD_SEEK_FOOTER = struct.Struct('<IBI') #Number of frames, descriptor, magic
+ZSTD_SEEK_ENTRY  = struct.Struct('<II')  #Compressed size, decompressed size
+
+
+def compression_of(sFileName):
+    """Return 'gzip', 'zstd', 'xz' or None, according to the file's extension."""
+    sSuffix = Path(str(sFileName)).suffix.lower()
+    if sSuffix in GZIP_EXTENSIONS:
+        return 'gzip'
+    if sSuffix in ZSTD_EXTENSIONS:
+        return 'zstd'
+    if sSuffix in XZ_EXTENSIONS:
+        return 'xz'
+    return None
+
+
+#zstandard's compressor and decompressor objects are not thread-safe, so each
+# thread of a pool keeps its own:
+_ThreadLocal = threading.local()
+
+
+def _compress_zstd_frame(sData, iLevel):
+    Compressors = _ThreadLocal.__dict__.setdefault('Compressors', {})
+    if iLevel not in Compressors:
+        Compressors[iLevel] = zstandard.ZstdCompressor(level=iLevel, write_content_size=True)
+    return Compressors[iLevel].compress(sData)
+
+
+def _decompress_zstd_frame(sFrame, iDataSize):
+    if not hasattr(_ThreadLocal, 'Decompressor'):
+        _ThreadLocal.Decompressor = zstandard.ZstdDecompressor()
+    #Frames written by other tools may not record their decompressed size, so
+    # pass it from the seek table:
+    return _ThreadLocal.Decompressor.decompress(sFrame, max_output_size=iDataSize)
+
+
+def _require_zstandard(sFileName):
+    if zstandard is None:
+        raise IOError("Reading or writing %s requires the 'zstandard' package"
+            %sFileName)
+
+
+# =============== Reading ===================
+
+def gzip_blocks(strRaw):
+    """
+    Return a list of (iOffset, iSize, iDataSize) for the members of a gzip file
+    written by BlockWriter (iDataSize being the decompressed size), or None if
+    the file was not, or its block information is corrupt.
+    """
+    Blocks = []
+    iFileSize = os.fstat(strRaw.fileno()).st_size
+    iOffset = 0
+    while iOffset < iFileSize:
+        strRaw.seek(iOffset)
+        sHeader = strRaw.read(GZIP_HEADER.size)
+        if len(sHeader) < GZIP_HEADER.size:
+            return None
+        (iID1, iID2, _, iFlags, _, _, _, iXLen, sSubfieldID, iSubfieldLen, iSize) \
+            = GZIP_HEADER.unpack(sHeader)
+        if bytes((iID1, iID2)) != GZIP_MAGIC or not (iFlags & GZIP_FLAG_FEXTRA) \
+           or sSubfieldID != GZIP_PB_ID or iSubfieldLen != 4 or iXLen != 8:
+            return None
+        if iSize < GZIP_HEADER.size + 8 or iOffset + iSize > iFileSize:
+            return None
+        strRaw.seek(iOffset + iSize - 4) #ISIZE, at the end of the member
+        iDataSize, = struct.unpack('<I', strRaw.read(4))
+        Blocks.append((iOffset, iSize, iDataSize))
+        iOffset += iSize
+    return Blocks
+
+
+def zstd_blocks(strRaw):
+    """
+    Return a list of (iOffset, iSize, iDataSize) for the frames of a zstd file
+    in the seekable format (iDataSize being the decompressed size), or None if
+    the file has no seek table.
+    """
+    iFileSize = os.fstat(strRaw.fileno()).st_size
+    if iFileSize < ZSTD_SEEK_FOOTER.size:
+        return None
+    strRaw.seek(iFileSize - ZSTD_SEEK_FOOTER.size)
+    iFrames, iDescriptor, iMagic = ZSTD_SEEK_FOOTER.unpack(strRaw.read(ZSTD_SEEK_FOOTER.size))
+    if iMagic != ZSTD_SEEKABLE_MAGIC or iDescriptor & 0x80: #Checksums not supported
+        return None
+    iTableSize = iFrames * ZSTD_SEEK_ENTRY.size + ZSTD_SEEK_FOOTER.size
+    strRaw.seek(iFileSize - iTableSize)
+    sTable = strRaw.read(iTableSize - ZSTD_SEEK_FOOTER.size)
+    Blocks = []
+    iOffset = 0
+    for iFrame in range(iFrames):
+        iSize, iDataSize = ZSTD_SEEK_ENTRY.unpack_from(sTable, iFrame * ZSTD_SEEK_ENTRY.size)
+        Blocks.append((iOffset, iSize, iDataSize))
+        iOffset += iSize
+    return Blocks
+
+
+def _inflate_gzip_member(sMember, iDataSize):
+    #Skip the (fixed size) header; the member ends with CRC32 and ISIZE:
+    sData = zlib.decompress(sMember[GZIP_HEADER.size:-8], -zlib.MAX_WBITS)
+    iCRC, iSize = struct.unpack('<II', sMember[-8:])
+    if zlib.crc32(sData) != iCRC or len(sData) & 0xFFFFFFFF != iSize:
+        raise IOError("Corrupt gzip block")
+    return sData
+
+
+class ParallelBlockReader(io.RawIOBase):
+    """
+    Read-only binary stream over a file made of independently compressed
+    blocks, decompressing blocks ahead of the reader in a thread pool, up to
+    LOOKAHEAD_SIZE bytes of them (but always at least one).
+    """
+    def __init__(self, strRaw, Blocks, fnDecompress, iThreads):
+        super().__init__()
+        self.strRaw = strRaw
+        self.Blocks = deque(Blocks)
+        self.fnDecompress = fnDecompress
+        self.pool = ThreadPoolExecutor(max_workers=iThreads)
+        self.Pending = deque()
+        self.iPendingSize = 0 #Decompressed size of the blocks in Pending
+        self.sBuffer = b''
+        self.iPos = 0
+
+    def readable(self):
+        return True
+
+    def _fill_pending(self):
+        while self.Blocks and (not self.Pending or
+                               self.iPendingSize + self.Blocks[0][2] <= LOOKAHEAD_SIZE):
+            iOffset, iSize, iDataSize = self.Blocks.popleft()
+            self.strRaw.seek(iOffset)
+            self.Pending.append((self.pool.submit(self.fnDecompress, self.strRaw.read(iSize),
+                                                  iDataSize), iDataSize))
+            self.iPendingSize += iDataSize
+
+    def readinto(self, Buffer):
+        while self.iPos >= len(self.sBuffer):
+            self._fill_pending()
+            if not self.Pending:
+                return 0 #EOF
+            Future, iDataSize = self.Pending.popleft()
+            self.iPendingSize -= iDataSize
+            self.sBuffer = Future.result()
+            self.iPos = 0
+        iCount = min(len(Buffer), len(self.sBuffer) - self.iPos)
+        Buffer[:iCount] = self.sBuffer[self.iPos : self.iPos + iCount]
+        self.iPos += iCount
+        return iCount
+
+    def close(self):
+        if not self.closed:
+            for Future, _ in self.Pending:
+                Future.cancel()
+            self.pool.shutdown(wait=True)
+            self.strRaw.close()
+        super().close()
+
+
+def open_binary_reader(sFileName, iThreads=None):
+    """
+    Open a (possibly compressed) file for reading, returning a binary stream of
+    the decompressed data.  Uses parallel decompression when the file's blocks
+    can be located (see module documentation).
+    """
+    iThreads = iThreads or iDEFAULT_THREADS
+    sCompression = compression_of(sFileName)
+    if sCompression is None:
+        return open(sFileName, 'rb')
+    if sCompression == 'xz':
+        return lzma.open(sFileName, 'rb')
+    if sCompression == 'zstd':
+        _require_zstandard(sFileName)
+    strRaw = open(sFileName, 'rb')
+    try:
+        if sCompression == 'gzip':
+            Blocks = gzip_blocks(strRaw)
+            fnDecompress = _inflate_gzip_member
+        else:
+            Blocks = zstd_blocks(strRaw)
+            fnDecompress = _decompress_zstd_frame
+        strRaw.seek(0)
+        if Blocks is None or iThreads == 1:
+            if sCompression == 'gzip':
+                strRaw.close()
+                return gzip.open(sFileName, 'rb')
+            Decompressor = zstandard.ZstdDecompressor()
+            return io.BufferedReader(Decompressor.stream_reader(strRaw,
+                                                                read_across_frames=True,
+                                                                closefd=True))
+    except:
+        strRaw.close()
+        raise
+    return io.BufferedReader(ParallelBlockReader(strRaw, Blocks, fnDecompress, iThreads),
+                             buffer_size=1024 * 1024)
+
+
+# =============== Writing ===================
+
+def _deflate_gzip_member(sData, iLevel):
+    Compressor = zlib.compressobj(iLevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+    sDeflated = Compressor.compress(sData) + Compressor.flush()
+    iSize = GZIP_HEADER.size + len(sDeflated) + 8
+    sHeader = GZIP_HEADER.pack(0x1f, 0x8b, 8, GZIP_FLAG_FEXTRA, 0, 0, 255,
+                               8, GZIP_PB_ID, 4, iSize)
+    return sHeader + sDeflated + struct.pack('<II', zlib.crc32(sData),
+                                             len(sData) & 0xFFFFFFFF)
+
+
+class BlockWriter(io.RawIOBase):
+    """
+    Write-only binary stream which compresses its input in independent blocks
+    of BLOCK_SIZE bytes, using a thread pool, and writes them (in order) to a
+    gzip or zstd file that ParallelBlockReader can read back in parallel.  At
+    most LOOKAHEAD_SIZE bytes (but at least one block) wait to be compressed.
+    """
+    def __init__(self, strRaw, sCompression, iThreads, iLevel=None):
+        super().__init__()
+        self.strRaw = strRaw
+        self.sCompression = sCompression
+        if sCompression == 'gzip':
+            iLevel = 6 if iLevel is None else iLevel
+            self.fnCompress = lambda sData: _deflate_gzip_member(sData, iLevel)
+        else:
+            iLevel = 3 if iLevel is None else iLevel
+            self.fnCompress = lambda sData: _compress_zstd_frame(sData, iLevel)
+        self.pool = ThreadPoolExecutor(max_workers=iThreads)
+        self.Pending = deque()
+        self.iPendingSize = 0 #Uncompressed size of the blocks in Pending
+        self.FrameSizes = [] #(compressed, decompressed) for the zstd seek table
+        self.Buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def _write_block(self, Future, iDataSize):
+        sBlock = Future.result()
+        self.iPendingSize -= iDataSize
+        self.strRaw.write(sBlock)
+        self.FrameSizes.append((len(sBlock), iDataSize))
+
+    def _submit(self, sData):
+        self.Pending.append((self.pool.submit(self.fnCompress, sData), len(sData)))
+        self.iPendingSize += len(sData)
+        while len(self.Pending) > 1 and self.iPendingSize > LOOKAHEAD_SIZE:
+            self._write_block(*self.Pending.popleft())
+
+    def write(self, Data):
+        self.Buffer += Data
+        while len(self.Buffer) >= BLOCK_SIZE:
+            self._submit(bytes(self.Buffer[:BLOCK_SIZE]))
+            del self.Buffer[:BLOCK_SIZE]
+        return len(Data)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.Buffer or not (self.Pending or self.FrameSizes):
+                self._submit(bytes(self.Buffer)) #Ensure at least one block
+                self.Buffer = bytearray()
+            while self.Pending:
+                self._write_block(*self.Pending.popleft())
+            if self.sCompression == 'zstd':
+                sTable = b''.join(ZSTD_SEEK_ENTRY.pack(*Sizes) for Sizes in self.FrameSizes)
+                sTable += ZSTD_SEEK_FOOTER.pack(len(self.FrameSizes), 0, ZSTD_SEEKABLE_MAGIC)
+                self.strRaw.write(struct.pack('<II', ZSTD_SKIPPABLE_MAGIC, len(sTable)))
+                self.strRaw.write(sTable)
+        finally:
+            self.pool.shutdown(wait=True)
+            self.strRaw.close()
+            super().close()
+
+
+def open_binary_writer(sFileName, iThreads=None, iLevel=None):
+    """
+    Open a file for writing, compressed according to its extension; returns a
+    binary stream.
+    """
+    iThreads = iThreads or iDEFAULT_THREADS
+    sCompression = compression_of(sFileName)
+    if sCompression is None:
+        return open(sFileName, 'wb')
+    if sCompression == 'xz':
+        return lzma.open(sFileName, 'wb', preset=iLevel)
+    if sCompression == 'zstd':
+        _require_zstandard(sFileName)
+    return io.BufferedWriter(BlockWriter(open(sFileName, 'wb'), sCompression,
+                                         iThreads, iLevel),
+                             buffer_size=1024 * 1024)
+
+
+def open_text(sFileName, sMode='r', sEncoding='utf-8', iThreads=None):
+    """
+    Open a text file, which may be compressed (according to its extension), for
+    reading ('r') or writing ('w').  Returns a text stream.  Lines end only at
+    '\n' (not at a lone '\r', as with universal newlines), so that they are
+    the same lines as line_index.py indexes, and are written back unchanged.
+    """
+    if sMode.startswith('r'):
+        strBinary = open_binary_reader(sFileName, iThreads)
+    elif sMode.startswith('w'):
+        strBinary = open_binary_writer(sFileName, iThreads)
+    else:
+        raise ValueError("Unsupported mode %s" %sMode)
+    return io.TextIOWrapper(strBinary, encoding=sEncoding, newline='\n')
+
+
+
+if __name__ == '__main__':
+    #Self-check: write and read back a file of many blocks in each format, with
+    # several threads, e.g. after upgrading zlib or zstandard.
+    import random
+    import tempfile
+    BLOCK_SIZE = 200000
+    LOOKAHEAD_SIZE = 1000000 #A few blocks, so that the bound is reached
+    Random = random.Random(1)
+    sText = ''.join('%08d %s\n' %(iLine, ' '.join(Random.choice(('cell', 'virus', 'gene', 'brain'))
+                                                  + str(Random.randrange(30)) for _ in range(80)))
+                    for iLine in range(20000))
+    with tempfile.TemporaryDirectory() as sDir:
+        for sExtension in ('.txt', '.gz', '.zst', '.xz'):
+            if sExtension == '.zst' and zstandard is None:
+                print("%s: skipped (no zstandard)" %sExtension)
+                continue
+            sFileName = os.path.join(sDir, 'check' + sExtension)
+            with open_text(sFileName, 'w', iThreads=16) as strOut:
+                strOut.write(sText)
+            for iThreads in (1, 16):
+                with open_text(sFileName, iThreads=iThreads) as strIn:
+                    if strIn.read() != sText:
+                        print("%s, %i threads: FAILED" %(sExtension, iThreads))
+                        exit(1)
+            print("%s: %i bytes in %i blocks: ok" %(sExtension, len(sText), len(sText) // BLOCK_SIZE + 1))
+        #A gzip member claiming a compressed size of 0 must not be followed forever:
+        sFileName = os.path.join(sDir, 'corrupt.gz')
+        with open(sFileName, 'wb') as strOut:
+            strOut.write(GZIP_HEADER.pack(0x1f, 0x8b, 8, GZIP_FLAG_FEXTRA, 0, 0, 255,
+                                          8, GZIP_PB_ID, 4, 0) + b'\0' * 100)
+        with open(sFileName, 'rb') as strRaw:
+            if gzip_blocks(strRaw) is not None:
+                print("corrupt .gz: FAILED")
+                exit(1)
+        print("corrupt .gz: ok")
+        #A seekable zstd file whose frames don't record their decompressed size
+        # (as other tools write them):
+        if zstandard is not None:
+            sData = sText.encode('utf-8')
+            Sizes = []
+            sFileName = os.path.join(sDir, 'other.zst')
+            with open(sFileName, 'wb') as strOut:
+                for iStart in range(0, len(sData), BLOCK_SIZE):
+                    sBlock = sData[iStart : iStart + BLOCK_SIZE]
+                    Compressor = zstandard.ZstdCompressor(write_content_size=False)
+                    sFrame = Compressor.compress(sBlock)
+                    strOut.write(sFrame)
+                    Sizes.append((len(sFrame), len(sBlock)))
+                sTable = b''.join(ZSTD_SEEK_ENTRY.pack(*Pair) for Pair in Sizes)
+                sTable += ZSTD_SEEK_FOOTER.pack(len(Sizes), 0, ZSTD_SEEKABLE_MAGIC)
+                strOut.write(struct.pack('<II', ZSTD_SKIPPABLE_MAGIC, len(sTable)) + sTable)
+            with open_text(sFileName, iThreads=16) as strIn:
+                if strIn.read() != sText:
+                    print("seekable .zst without content sizes: FAILED")
+                    exit(1)
+            print("seekable .zst without content sizes: ok")
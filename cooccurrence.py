@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+Word cooccurrence statistics (the matrix Q of Arora et al., 2013) computed a
+chunk of documents at a time, so that the word-document matrix never has to be
+in memory all at once.
+
+Computes the same Q as anchor_topic.cooccur.computeQ(): for each document d
+with n_d words, the word counts are scaled by 1/sqrt(n_d * (n_d - 1)), Q is the
+product of the scaled matrix with its transpose (less the diagonal terms
+contributed by each word with itself), and the whole is divided by the number
+of documents.  Since this is a sum over documents, it can be accumulated over
+any partition of the documents into chunks.
+"""
+
+import numpy
+from scipy import sparse
+
+
+def scale_chunk(Chunk):
+    """
+    Scale the columns (documents) of a chunk of the word-document matrix.
+
+    Args:
+        Chunk (scipy.sparse matrix): word-document counts for some documents.
+    Returns:
+        A tuple (scipy.sparse.csc_matrix, numpy array): the chunk with each
+        column divided by sqrt(n_d * (n_d - 1)), and the contribution of the
+        chunk to the word probabilities (the diagonal correction to Q).
+    """
+    Chunk = sparse.csc_matrix(Chunk, dtype=float)
+    WordsPerDoc = numpy.asarray(Chunk.sum(axis=0)).ravel()
+    Norms = WordsPerDoc * (WordsPerDoc - 1)
+    Norms[Norms == 0] = 1
+    WordProbs = Chunk @ (1.0 / Norms)
+    Scaled = Chunk @ sparse.diags(1.0 / numpy.sqrt(Norms))
+    return sparse.csc_matrix(Scaled), WordProbs
+
+
+def document_frequencies(Chunks, iWords):
+    """Return an array of the number of documents each word occurs in."""
+    DocFreqs = numpy.zeros(iWords, dtype=numpy.int64)
+    for Chunk in Chunks:
+        DocFreqs += numpy.diff(sparse.csr_matrix(Chunk).indptr)
+    return DocFreqs
+
+
+class CooccurrenceSums:
+    """
+    Running (unnormalized) sums from which Q is computed: the sum over
+    documents of the scaled word-word products, the sum of the diagonal
+    corrections (word probabilities), the document frequency of each word, and
+    the number of documents.  All of these are additive over documents, so sums
+    computed over separate parts of a corpus (e.g. on separate nodes) can be
+    added together, and Q computed from the total.
+
+    If bSparse, the word-word sums are kept as a scipy.sparse.csr_matrix, which
+    is smaller when most word pairs don't cooccur; else as a dense array.  If
+    bCoDocs, the number of documents in which each pair of words cooccurs is
+    also kept (as a sparse matrix), so that rare pairs can be pruned from Q.
+    """
+    def __init__(self, iWords, bSparse=False, bCoDocs=False):
+        self.iWords = iWords
+        self.bSparse = bSparse
+        if bSparse:
+            self.QSum = sparse.csr_matrix((iWords, iWords))
+        else:
+            self.QSum = numpy.zeros((iWords, iWords))
+        self.CoDocs = sparse.csr_matrix((iWords, iWords), dtype=numpy.int32) if bCoDocs else None
+        self.WordProbs = numpy.zeros(iWords)
+        self.DocFreqs = numpy.zeros(iWords, dtype=numpy.int64)
+        self.iDocs = 0
+
+    def add_chunk(self, Chunk):
+        """Add the contribution of a chunk (scipy.sparse matrix) of documents."""
+        Scaled, ChunkWordProbs = scale_chunk(Chunk)
+        Product = Scaled @ Scaled.T
+        if self.bSparse:
+            self.QSum = self.QSum + Product.tocsr()
+        else:
+            self.QSum += Product.toarray()
+        self.WordProbs += ChunkWordProbs
+        self.DocFreqs += numpy.diff(Scaled.tocsr().indptr)
+        self.iDocs += Chunk.shape[1]
+        if self.CoDocs is not None:
+            Occurs = sparse.csr_matrix(Chunk, dtype=numpy.int32, copy=True)
+            Occurs.data[:] = 1
+            self.CoDocs = self.CoDocs + (Occurs @ Occurs.T).tocsr()
+
+    def add(self, Other):
+        """Add the sums from another CooccurrenceSums (over the same words)."""
+        if Other.iWords != self.iWords:
+            raise ValueError("Cannot add cooccurrence sums over %i words to sums over %i words"
+                %(Other.iWords, self.iWords))
+        if self.bSparse:
+            self.QSum = self.QSum + sparse.csr_matrix(Other.QSum)
+        else:
+            self.QSum += Other.QSum.toarray() if Other.bSparse else Other.QSum
+        self.WordProbs += Other.WordProbs
+        self.DocFreqs += Other.DocFreqs
+        self.iDocs += Other.iDocs
+        if self.CoDocs is not None:
+            if Other.CoDocs is None:
+                raise ValueError("Cannot add cooccurrence sums without co-document counts")
+            self.CoDocs = self.CoDocs + Other.CoDocs
+
+    def compact(self, Rows):
+        """
+        Return the sums restricted to the words numbered in Rows (a sorted
+        array), renumbered from 0 in the same order; e.g. to drop the hash
+        buckets no word fell in (see feature_hashing.py).
+        """
+        Compact = CooccurrenceSums(len(Rows), self.bSparse)
+        if self.bSparse:
+            Compact.QSum = sparse.csr_matrix(self.QSum)[Rows][:, Rows]
+        else:
+            Compact.QSum = self.QSum[numpy.ix_(Rows, Rows)]
+        if self.CoDocs is not None:
+            Compact.CoDocs = self.CoDocs[Rows][:, Rows]
+        Compact.WordProbs = self.WordProbs[Rows]
+        Compact.DocFreqs = self.DocFreqs[Rows]
+        Compact.iDocs = self.iDocs
+        return Compact
+
+    def Q(self, epsilon=1e-15):
+        """
+        Return the (dense) word cooccurrence matrix Q.  Entries smaller than
+        epsilon (in magnitude) are set to 0.
+        """
+        if self.bSparse:
+            Q = self.QSum.toarray()
+        else:
+            Q = self.QSum.copy()
+        Q /= self.iDocs
+        Q[numpy.diag_indices(self.iWords)] -= self.WordProbs / self.iDocs
+        #Handle precision errors:
+        Q[(-epsilon < Q) & (Q < epsilon)] = 0
+        return Q
+
+    def sparse_Q(self, epsilon=1e-15, iMinCoDocs=1):
+        """
+        Return the word cooccurrence matrix Q as a scipy.sparse.csr_matrix,
+        without ever materializing it densely: memory grows with the number of
+        cooccurring word pairs rather than with the square of the vocabulary.
+        Entries smaller than epsilon (in magnitude) are dropped, as are pairs of
+        words which cooccur in fewer than iMinCoDocs documents (which requires
+        the sums to have been computed with bCoDocs).
+        """
+        Q = sparse.csr_matrix(self.QSum) / self.iDocs
+        Q = (Q - sparse.diags(self.WordProbs / self.iDocs)).tocsr()
+        if iMinCoDocs > 1:
+            if self.CoDocs is None:
+                raise ValueError("Pruning by co-document count requires co-document counts")
+            Keep = self.CoDocs >= iMinCoDocs
+            Q = Q.multiply(Keep).tocsr()
+        #Handle precision errors:
+        Q.data[(-epsilon < Q.data) & (Q.data < epsilon)] = 0
+        Q.eliminate_zeros()
+        return Q
+
+    def save(self, sFName, sFingerprint='', Extra=None):
+        """
+        Save the sums to a .npz file, along with a fingerprint (e.g. of the
+        vocabulary) to be checked when the sums are loaded, and any Extra
+        arrays (a dict of them, by name; read back with numpy.load()).
+        """
+        Arrays = {'WordProbs': self.WordProbs, 'DocFreqs': self.DocFreqs,
+                  'iDocs': numpy.array(self.iDocs), 'iWords': numpy.array(self.iWords),
+                  'sFingerprint': numpy.array(sFingerprint)}
+        if self.bSparse:
+            QSum = self.QSum.tocsr()
+            Arrays.update(QData=QSum.data, QIndices=QSum.indices, QIndptr=QSum.indptr)
+        else:
+            Arrays.update(QDense=self.QSum)
+        if self.CoDocs is not None:
+            Arrays.update(CoData=self.CoDocs.data, CoIndices=self.CoDocs.indices,
+                          CoIndptr=self.CoDocs.indptr)
+        Arrays.update(Extra or {})
+        with open(sFName, 'wb') as strOut: #So numpy doesn't append '.npz'
+            numpy.savez(strOut, **Arrays)
+
+    @classmethod
+    def load(cls, sFName):
+        """Load sums saved by save().  Returns (CooccurrenceSums, fingerprint)."""
+        with numpy.load(sFName) as Arrays:
+            iWords = int(Arrays['iWords'])
+            bSparse = 'QData' in Arrays
+            Sums = cls(iWords, bSparse)
+            if bSparse:
+                Sums.QSum = sparse.csr_matrix((Arrays['QData'], Arrays['QIndices'],
+                                               Arrays['QIndptr']), shape=(iWords, iWords))
+            else:
+                Sums.QSum = Arrays['QDense']
+            Sums.WordProbs = Arrays['WordProbs']
+            Sums.DocFreqs = Arrays['DocFreqs']
+            Sums.iDocs = int(Arrays['iDocs'])
+            if 'CoData' in Arrays:
+                Sums.CoDocs = sparse.csr_matrix((Arrays['CoData'], Arrays['CoIndices'],
+                                                 Arrays['CoIndptr']), shape=(iWords, iWords))
+            return Sums, str(Arrays['sFingerprint'])
+
+
+def column_chunks(matrixWordDoc, iChunkColumns):
+    """
+    Yield a word-document matrix (an in-memory scipy.sparse matrix, or a
+    disk_matrix.DiskCSCMatrix) as a sequence of chunks of iChunkColumns columns.
+    """
+    if hasattr(matrixWordDoc, 'iter_column_chunks'):
+        yield from matrixWordDoc.iter_column_chunks(iChunkColumns)
+        return
+    matrixWordDoc = sparse.csc_matrix(matrixWordDoc)
+    for iStart in range(0, matrixWordDoc.shape[1], iChunkColumns):
+        yield matrixWordDoc[:, iStart : iStart + iChunkColumns]
+
+
+def compute_Q(Chunks, iWords, iDocs, epsilon=1e-15):
+    """
+    Compute the (dense) word cooccurrence matrix Q one chunk of documents at a
+    time.
+
+    Args:
+        Chunks: iterable of scipy.sparse matrices of shape (iWords, <docs in
+            chunk>), which together make up the word-document matrix.
+        iWords: number of words (rows).
+        iDocs:  total number of documents (columns, summed over the chunks).
+        epsilon: entries of Q smaller than this (in magnitude) are set to 0.
+    Returns:
+        A tuple (Q, DocFreqs): the iWords x iWords numpy array Q, and the
+        number of documents each word occurs in (which is needed to identify
+        anchor candidates, and costs nothing extra to compute here).
+    """
+    Sums = CooccurrenceSums(iWords)
+    for Chunk in Chunks:
+        Sums.add_chunk(Chunk)
+    assert Sums.iDocs == iDocs
+    return Sums.Q(epsilon), Sums.DocFreqs
+
+
+def identify_candidates(DocFreqs, iDocs, threshold):
+    """
+    Return an array of the indices of the words which occur in at least
+    threshold * iDocs documents (cf. anchor_topic.topics.identify_candidates()).
+    """
+    return numpy.flatnonzero(DocFreqs >= int(iDocs * threshold))
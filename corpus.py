@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Helpers shared by the programs which read tokenized abstract files (see
+build_topic_model.py for the file format): stop words, the filter that decides
+which tokens count as words, and vocabulary files.
+
+Vocabulary file format:
+One word per line, UTF-8, in the order of the rows of the word-document matrix
+(i.e. sorted, as returned by build_topic_model.get_words_and_documents()).
+"""
+
+from pathlib import Path
+import hashlib
+import re
+import sys
+
+
+rxNum = re.compile(r"[\+\-]?[0-9\.\,]\%?") #Abstracts contain lots of numbers,
+   # don't want to capture those
+
+
+def read_stopwords(sStopWordsFile):
+    """Read StopWords from a file and return them as a set."""
+    try:
+        with Path(sStopWordsFile).open('r', encoding='utf-8') as strStopWordsFile:
+            return set(strStopWordsFile.read().splitlines())
+    except (FileNotFoundError, PermissionError, IOError):
+        sys.stderr.write("Unable to open stop words file '%s'\n"
+            %sStopWordsFile)
+        exit(1)
+
+
+def is_word(sToken, iMinWordLength):
+    """
+    Return True if sToken should be treated as a word, i.e. it is not a number,
+    does not begin with a hyphen or contain a double hyphen, and is at least
+    iMinWordLength characters long.  (Stop words are checked separately.)
+    """
+    return not ('--' in sToken or
+                sToken[:1] == '-' or
+                rxNum.match(sToken) or
+                len(sToken) < iMinWordLength or
+                not sToken)
+
+
+def check_anchor_candidates(DocFreqs, iDocs, fAnchorThreshold, iNumAnchors):
+    """
+    Exit with a message if fewer than iNumAnchors words occur in enough
+    documents (fAnchorThreshold of iDocs) to be anchor candidates.
+    """
+    iMinDocs = int(iDocs * fAnchorThreshold) #As in cooccurrence.identify_candidates()
+    iCandidates = sum(1 for iFreq in DocFreqs if iFreq >= iMinDocs)
+    if iCandidates < iNumAnchors:
+        sys.stderr.write("Only %i words pass --anchor-threshold %g, need at least -a %i\n"
+            %(iCandidates, fAnchorThreshold, iNumAnchors))
+        exit(1)
+
+
+def write_vocabulary(Words, sVocabFName):
+    """Write a list of words to a vocabulary file."""
+    with Path(sVocabFName).open('w', encoding='utf-8') as strVocab:
+        for sWord in Words:
+            strVocab.write(sWord + '\n')
+
+
+def corpus_fingerprint(Words, DocFreqs, iDocs):
+    """
+    Return a hex digest identifying a corpus (as far as the topic model is
+    concerned) by its vocabulary, document frequencies and number of documents.
+    Used to key results cached across runs.
+    """
+    Hash = hashlib.sha1()
+    Hash.update('\n'.join(Words).encode('utf-8'))
+    Hash.update(','.join(str(int(iFreq)) for iFreq in DocFreqs).encode('ascii'))
+    Hash.update(str(iDocs).encode('ascii'))
+    return Hash.hexdigest()
+
+
+def read_vocabulary(sVocabFName):
+    """
+    Read a vocabulary file.  Returns a tuple (list of words, fingerprint), where
+    the fingerprint is a hex digest of the file's contents, used to check that
+    results computed against the vocabulary are combined with the same one.
+    """
+    try:
+        with Path(sVocabFName).open('rb') as strVocab:
+            sData = strVocab.read()
+    except (FileNotFoundError, PermissionError, IOError):
+        sys.stderr.write("Unable to open vocabulary file '%s'\n" %sVocabFName)
+        exit(1)
+    return sData.decode('utf-8').splitlines(), hashlib.sha1(sData).hexdigest()
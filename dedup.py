@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Remove duplicate and near-duplicate abstracts (errata, reprints, conference
+versions, abstracts imported twice) before topic modeling, so that they don't
+skew the cooccurrence statistics.
+
+Each abstract is reduced to the set of its word n-grams ("shingles"), and the
+set to a MinHash signature: the minimum, over the shingles, of each of
+iPerms hash functions.  The fraction of positions at which two signatures
+agree estimates the Jaccard similarity of the two shingle sets.  To avoid
+comparing every pair of abstracts, the signatures are split into bands
+(locality sensitive hashing): only abstracts which agree on all of some band
+are compared, and the number of bands is chosen so that pairs at the
+similarity threshold are very likely to agree on at least one.
+
+The filter streams: each abstract is compared with the abstracts kept so far,
+and dropped if its estimated similarity to one of them is at least the
+threshold; so of each group of duplicates, the first one read is kept.  Memory
+grows with the number of abstracts kept (a signature and iBands hash table
+entries each).
+
+Command line arguments (to filter files of tokenized abstracts, as read by
+build_topic_model.py):
+     -i <glob>   Glob for abstracts (use quotes if this has wild cards)
+     -o <fname>  Output file for the abstracts kept, defaults to stdout
+     -t <float>  Similarity threshold, default 0.8
+     -k <int>    Words per shingle, default 3
+     -p <int>    Number of hash functions (signature length), default 128
+     -R <fname>  Report of the abstracts removed, defaults to stderr: one line
+                 per abstract, "<removed ID>\t<ID of abstract kept>\t<similarity>"
+"""
+
+from argparse import ArgumentParser
+from glob import glob
+import sys
+import zlib
+
+import numpy
+
+from compressed_io import open_text
+
+
+def choose_bands(iPerms, fThreshold):
+    """
+    Return (iBands, iRows) with iBands * iRows == iPerms, such that the LSH
+    threshold (1/iBands)**(1/iRows) (the similarity at which a pair has about
+    even odds of sharing a band) is as high as possible while still at most
+    0.9 * fThreshold, so that pairs at fThreshold are found with high
+    probability.
+    """
+    Best = (iPerms, 1)
+    for iRows in range(1, iPerms + 1):
+        if iPerms % iRows == 0 and (iRows / iPerms) ** (1.0 / iRows) <= 0.9 * fThreshold:
+            Best = (iPerms // iRows, iRows)
+    return Best
+
+
+class NearDuplicateFilter:
+    """
+    Streaming MinHash/LSH near-duplicate filter (see module documentation).
+    After filtering, Removed is the list of (removed ID, kept ID, similarity),
+    and RemovedKeys the set of caller-supplied keys of the abstracts removed
+    (e.g. positions in the input, for a caller that reads it more than once).
+    """
+    def __init__(self, fThreshold=0.8, iShingleWords=3, iPerms=128, iSeed=1):
+        self.fThreshold = fThreshold
+        self.iShingleWords = iShingleWords
+        self.iBands, self.iRows = choose_bands(iPerms, fThreshold)
+        Random = numpy.random.RandomState(iSeed)
+        #Multiply-shift hashing of 32-bit shingle hashes: (a*x + b) mod 2**64,
+        # top 32 bits; a odd
+        self.A = Random.randint(0, 2**63, size=iPerms, dtype=numpy.uint64) * 2 + 1
+        self.B = Random.randint(0, 2**63, size=iPerms, dtype=numpy.uint64)
+        self.Bands = [{} for _ in range(self.iBands)] #Band contents -> indices of kept abstracts
+        self.Signatures = [] #Signature of each kept abstract
+        self.KeptIDs = []
+        self.iSeen = 0
+        self.Removed = []
+        self.RemovedKeys = set()
+
+    def signature(self, Tokens):
+        """Return the MinHash signature of a list of tokens, or None if it is empty."""
+        if not Tokens:
+            return None
+        k = min(self.iShingleWords, len(Tokens))
+        Shingles = set(' '.join(Tokens[i : i + k]) for i in range(len(Tokens) - k + 1))
+        X = numpy.fromiter((zlib.crc32(sShingle.encode('utf-8')) for sShingle in Shingles),
+                           dtype=numpy.uint64, count=len(Shingles))
+        return ((numpy.outer(self.A, X) + self.B[:, numpy.newaxis]) >> numpy.uint64(32)) \
+            .astype(numpy.uint32).min(axis=1)
+
+    def check(self, sDocID, Tokens, Key=None):
+        """
+        Return None if the abstract is to be kept (and remember it), or the ID
+        of the kept abstract it duplicates (and add Key to RemovedKeys).
+        """
+        self.iSeen += 1
+        Signature = self.signature(Tokens)
+        if Signature is None:
+            return None #Nothing to compare
+        BandKeys = [Signature[iBand * self.iRows : (iBand + 1) * self.iRows].tobytes()
+                for iBand in range(self.iBands)]
+        Compared = set()
+        for Band, BandKey in zip(self.Bands, BandKeys):
+            for iKept in Band.get(BandKey, ()):
+                if iKept in Compared:
+                    continue
+                Compared.add(iKept)
+                fSimilarity = numpy.mean(self.Signatures[iKept] == Signature)
+                if fSimilarity >= self.fThreshold:
+                    self.Removed.append((sDocID, self.KeptIDs[iKept], fSimilarity))
+                    if Key is not None:
+                        self.RemovedKeys.add(Key)
+                    return self.KeptIDs[iKept]
+        iKept = len(self.KeptIDs)
+        self.KeptIDs.append(sDocID)
+        self.Signatures.append(Signature)
+        for Band, BandKey in zip(self.Bands, BandKeys):
+            Band.setdefault(BandKey, []).append(iKept)
+        return None
+
+    def filter(self, Abstracts):
+        """Yield the (sDocID, Tokens) pairs of Abstracts that are kept."""
+        for sDocID, Tokens in Abstracts:
+            if self.check(sDocID, Tokens) is None:
+                yield sDocID, Tokens
+
+    def write_report(self, strReport):
+        """Write the list of abstracts removed (see module documentation) and a summary."""
+        for sDocID, sKeptID, fSimilarity in self.Removed:
+            strReport.write("%s\t%s\t%.3f\n" %(sDocID, sKeptID, fSimilarity))
+        sys.stderr.write("Removed %i of %i abstracts as near-duplicates (similarity >= %g)\n"
+            %(len(self.Removed), self.iSeen, self.fThreshold))
+
+
+def GetCmdLineParameters():
+    """Return the parsed command line args."""
+    parser = ArgumentParser(description="Remove near-duplicate abstracts from tokenized abstract files")
+    parser.add_argument( "-i", "--InputGlob"
+                       , dest    = "sInputGlob"
+                       , metavar = "<InputGlob>"
+                       , required = True
+                       , help    = "Glob of files to read (quote if contains wildcards)"
+                       )
+    parser.add_argument( "-o", "--output"
+                       , dest    = "sOutFileName"
+                       , default = "stdout"
+                       , help    = "Takes arg <OutputFile>. Optional, defaults to stdout."
+                       )
+    parser.add_argument( "-t", "--Threshold"
+                       , type    = float
+                       , dest    = "fThreshold"
+                       , metavar = "<Threshold>"
+                       , default = 0.8
+                       , help    = "Similarity at or above which an abstract is a near-duplicate, default 0.8"
+                       )
+    parser.add_argument( "-k", "--ShingleWords"
+                       , type    = int
+                       , dest    = "iShingleWords"
+                       , metavar = "<ShingleWords>"
+                       , default = 3
+                       , help    = "Words per shingle, default 3"
+                       )
+    parser.add_argument( "-p", "--Perms"
+                       , type    = int
+                       , dest    = "iPerms"
+                       , metavar = "<Perms>"
+                       , default = 128
+                       , help    = "Number of hash functions, default 128"
+                       )
+    parser.add_argument( "-R", "--Report"
+                       , dest    = "sReportFName"
+                       , metavar = "<ReportFile>"
+                       , default = "stderr"
+                       , help    = "File to list the removed abstracts in, defaults to stderr"
+                       )
+    args = parser.parse_args()
+    if not (0 < args.fThreshold <= 1):
+        sys.stderr.write("Threshold must be between 0 and 1.\n")
+        exit(1)
+    if args.iShingleWords < 1 or args.iPerms < 1:
+        sys.stderr.write("Shingle size and number of hash functions must be positive.\n")
+        exit(1)
+    return args
+
+
+
+if __name__ == '__main__':
+    args = GetCmdLineParameters()
+    Dedup = NearDuplicateFilter(args.fThreshold, args.iShingleWords, args.iPerms)
+    strOut = sys.stdout if args.sOutFileName == 'stdout' else open_text(args.sOutFileName, 'w')
+    for sFileName in sorted(glob(args.sInputGlob)):
+        with open_text(sFileName) as strIn:
+            for sLine in strIn:
+                Values = sLine.strip().split(' ')
+                if Dedup.check(Values[0], Values[1:]) is None:
+                    strOut.write(sLine)
+    strOut.close()
+    strReport = sys.stderr if args.sReportFName == 'stderr' else open(args.sReportFName, 'w', encoding='utf-8')
+    Dedup.write_report(strReport)
+    if strReport is not sys.stderr:
+        strReport.close()
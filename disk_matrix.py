@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Out-of-core sparse word-document matrix, for corpora whose matrix (or whose
+matrix plus the copy made when converting it to CSC) doesn't fit in memory.
+
+The matrix is stored in CSC form (one column per document) in a directory:
+    indptr.npy   int64, n_docs + 1 entries
+    indices.npy  int32, row (word) index of each non-zero entry
+    data.npy     int32, count of each non-zero entry
+    shape.txt    "<n_words> <n_docs>"
+The .npy files are standard numpy files, so they can be memory-mapped with
+numpy.load(fname, mmap_mode='r').  DiskCSCWriter writes them incrementally,
+one chunk of columns at a time, as the documents are read; DiskCSCMatrix reads
+them back one chunk of columns at a time, so that resident memory is bounded by
+the chunk size rather than by the size of the corpus.
+"""
+
+from pathlib import Path
+
+import numpy
+from scipy import sparse
+
+
+iDEFAULT_CHUNK_COLUMNS = 10000 #Documents per chunk
+NPY_HEADER_SIZE = 128 #Fixed size, so the header can be rewritten in place
+
+
+def write_npy_header(strOut, sDescr, iLength):
+    """
+    Write the header of a 1-D .npy file (format version 1.0) of iLength entries,
+    padded to exactly NPY_HEADER_SIZE bytes.
+    """
+    sDict = "{'descr': '%s', 'fortran_order': False, 'shape': (%i,), }" %(sDescr, iLength)
+    iPadding = NPY_HEADER_SIZE - 10 - len(sDict) - 1
+    sHeader = b'\x93NUMPY\x01\x00' + (NPY_HEADER_SIZE - 10).to_bytes(2, 'little') \
+        + sDict.encode('latin1') + b' ' * iPadding + b'\n'
+    assert len(sHeader) == NPY_HEADER_SIZE
+    strOut.write(sHeader)
+
+
+class DiskCSCWriter:
+    """
+    Write a CSC matrix to a directory (see module documentation) one column at a
+    time.  Columns are buffered in memory and appended to the files every
+    iChunkColumns columns; the .npy headers are filled in by close().
+    """
+    ARRAYS = (('indptr', numpy.dtype('<i8')),
+              ('indices', numpy.dtype('<i4')),
+              ('data', numpy.dtype('<i4')))
+
+    def __init__(self, sDir, iRows, iChunkColumns=iDEFAULT_CHUNK_COLUMNS):
+        self.Dir = Path(sDir)
+        self.Dir.mkdir(parents=True, exist_ok=True)
+        try: #An incomplete matrix must not look complete
+            (self.Dir / 'shape.txt').unlink()
+        except FileNotFoundError:
+            pass
+        self.iRows = iRows
+        self.iChunkColumns = iChunkColumns
+        self.Files = {}
+        self.Lengths = {}
+        for sName, dtype in self.ARRAYS:
+            self.Files[sName] = (self.Dir / (sName + '.npy')).open('wb')
+            write_npy_header(self.Files[sName], dtype.str, 0)
+            self.Lengths[sName] = 0
+        self.iColumns = 0
+        self.iNonZero = 0
+        self._write('indptr', [0])
+        self.Indptr, self.Indices, self.Data = [], [], []
+
+    def _write(self, sName, Values):
+        dtype = dict(self.ARRAYS)[sName]
+        self.Files[sName].write(numpy.asarray(Values, dtype=dtype).tobytes())
+        self.Lengths[sName] += len(Values)
+
+    def add_column(self, Indices, Counts):
+        """Append a column with the given (row) indices and counts."""
+        self.Indices.extend(Indices)
+        self.Data.extend(Counts)
+        self.iNonZero += len(Indices)
+        self.Indptr.append(self.iNonZero)
+        self.iColumns += 1
+        if len(self.Indptr) >= self.iChunkColumns:
+            self.flush()
+
+    def flush(self):
+        """Append the buffered columns to the files."""
+        self._write('indptr', self.Indptr)
+        self._write('indices', self.Indices)
+        self._write('data', self.Data)
+        self.Indptr, self.Indices, self.Data = [], [], []
+
+    def close(self):
+        """Flush, fill in the array lengths, and return the DiskCSCMatrix."""
+        self.flush()
+        for sName, dtype in self.ARRAYS:
+            strFile = self.Files[sName]
+            strFile.seek(0)
+            write_npy_header(strFile, dtype.str, self.Lengths[sName])
+            strFile.close()
+        (self.Dir / 'shape.txt').write_text('%i %i\n' %(self.iRows, self.iColumns))
+        return DiskCSCMatrix(self.Dir)
+
+
+class DiskCSCMatrix:
+    """
+    Read-only, memory-mapped CSC matrix stored in a directory by DiskCSCWriter.
+    """
+    def __init__(self, sDir):
+        self.Dir = Path(sDir)
+        self.shape = tuple(int(sDim) for sDim in (self.Dir / 'shape.txt').read_text().split())
+        self.indptr  = numpy.load(str(self.Dir / 'indptr.npy'), mmap_mode='r')
+        self.indices = numpy.load(str(self.Dir / 'indices.npy'), mmap_mode='r')
+        self.data    = numpy.load(str(self.Dir / 'data.npy'), mmap_mode='r')
+
+    def iter_column_chunks(self, iChunkColumns=iDEFAULT_CHUNK_COLUMNS):
+        """
+        Yield the matrix as a sequence of scipy.sparse.csc_matrix's, each
+        containing (at most) iChunkColumns consecutive columns.
+        """
+        iRows, iColumns = self.shape
+        for iStart in range(0, iColumns, iChunkColumns):
+            iEnd = min(iStart + iChunkColumns, iColumns)
+            Indptr = numpy.array(self.indptr[iStart : iEnd + 1])
+            iFirst, iLast = Indptr[0], Indptr[-1]
+            yield sparse.csc_matrix((numpy.array(self.data[iFirst:iLast]),
+                                     numpy.array(self.indices[iFirst:iLast]),
+                                     Indptr - iFirst),
+                                    shape=(iRows, iEnd - iStart))
+
+    def tocsc(self):
+        """Return the whole matrix, in memory."""
+        return sparse.csc_matrix((numpy.array(self.data), numpy.array(self.indices),
+                                  numpy.array(self.indptr)), shape=self.shape)
+
+
+def compact_rows(sDir, Rows, iChunkEntries=2**24):
+    """
+    Renumber the rows of the matrix in sDir in place, keeping only the rows
+    listed in Rows (a sorted numpy array, which must include every row with a
+    non-zero entry): row Rows[i] becomes row i.  Returns a numpy array of the
+    number of non-zero entries in each row kept.
+    """
+    Dir = Path(sDir)
+    iRows, iColumns = (int(sDim) for sDim in (Dir / 'shape.txt').read_text().split())
+    (Dir / 'shape.txt').unlink() #Incomplete until renumbered
+    Indices = numpy.load(str(Dir / 'indices.npy'), mmap_mode='r+')
+    RowCounts = numpy.zeros(len(Rows), dtype=numpy.int64)
+    for iStart in range(0, len(Indices), iChunkEntries):
+        Chunk = numpy.searchsorted(Rows, Indices[iStart : iStart + iChunkEntries])
+        Indices[iStart : iStart + iChunkEntries] = Chunk
+        RowCounts += numpy.bincount(Chunk, minlength=len(Rows))
+    Indices.flush()
+    del Indices
+    (Dir / 'shape.txt').write_text('%i %i\n' %(len(Rows), iColumns))
+    return RowCounts
+
+
+def is_disk_matrix(sDir):
+    """Return True if sDir contains a complete matrix written by DiskCSCWriter."""
+    return (Path(sDir) / 'shape.txt').exists()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Feature hashing (the "hashing trick") for the rows of the word-document
+matrix: each word is given the row numbered by the low iBits bits of a hash of
+the word, rather than its position in a vocabulary.  So the matrix can be built
+in a single pass over the corpus, without first collecting the vocabulary; and
+the cooccurrence sums computed from different parts of the corpus, by
+different processes, have the same 2**iBits rows, so they can simply be added,
+with no vocabulary to agree on first (sharded_cooccur.py --hash-features).
+The buckets no word fell in are only dropped once everything has been added:
+by build_topic_model.py after its single pass, and by sharded_cooccur.py at
+reduce.  The shards' FeatureHasher's are merged too (merge()), by adding the
+counts of the words they kept for each bucket.
+
+The hash is BLAKE2b, which (unlike Python's hash() of a str) is the same in
+every process and run.  Different words may share a row (a bucket), and are
+then counted as one word: with V distinct words in 2**iBits buckets, a
+fraction of about V / 2**(iBits+1) of the buckets used hold more than one word
+(while V is small compared with 2**iBits).
+
+To print the rows as words, FeatureHasher keeps for each bucket the (at most
+iMaxForms) words seen in it in the most documents, by the "space saving"
+method: a word not yet kept replaces the kept word with the lowest count, and
+takes over its count plus one.  So the words kept include every word in more
+than 1/iMaxForms of the bucket's documents.  Collisions are detected by also
+keeping, for each bucket, 32 other bits of the hash of the first word seen in
+it: a word with different bits is a different word.
+"""
+
+import hashlib
+
+import numpy
+
+
+iDEFAULT_MAX_FORMS = 3 #Words kept per bucket, for labels
+
+
+def hash_word(sWord):
+    """Return a 64-bit hash of a word, the same in every process and run."""
+    return int.from_bytes(hashlib.blake2b(sWord.encode('utf-8'), digest_size=8).digest(),
+                          'little')
+
+
+class FeatureHasher:
+    """
+    Maps words to buckets (see module documentation), and keeps the most
+    frequent words seen in each bucket, and which buckets have held more than
+    one word.  iBits must be at most 32.
+    """
+    def __init__(self, iBits, iMaxForms=iDEFAULT_MAX_FORMS):
+        self.iBits = iBits
+        self.iMask = (1 << iBits) - 1
+        self.iMaxForms = iMaxForms
+        self.Forms = {}        #Bucket -> {word: number of documents}, the words kept
+        self.Fingerprints = {} #Bucket -> top 32 bits of the hash of its first word
+        self.Collided = set()  #Buckets which have held more than one word
+
+    def add(self, sWord):
+        """
+        Return the bucket of a word, and count the word as occurring in one more
+        document (so call this once per document the word occurs in).
+        """
+        iHash = hash_word(sWord)
+        iBucket = iHash & self.iMask
+        iFingerprint = iHash >> 32
+        Forms = self.Forms.get(iBucket)
+        if Forms is None:
+            self.Forms[iBucket] = {sWord: 1}
+            self.Fingerprints[iBucket] = iFingerprint
+            return iBucket
+        if sWord in Forms:
+            Forms[sWord] += 1
+            return iBucket
+        if iFingerprint != self.Fingerprints[iBucket]:
+            self.Collided.add(iBucket)
+        if len(Forms) < self.iMaxForms:
+            Forms[sWord] = 1
+        else:
+            sLeast = min(Forms, key=Forms.get)
+            Forms[sWord] = Forms.pop(sLeast) + 1
+        return iBucket
+
+    def label(self, iBucket):
+        """Return the words kept for a bucket, most frequent first, joined by '|'."""
+        Forms = self.Forms[iBucket]
+        return '|'.join(sorted(Forms, key=lambda sWord: (-Forms[sWord], sWord)))
+
+    def merge(self, Other):
+        """
+        Add the words kept, and the buckets known to have collided, by another
+        FeatureHasher with the same number of bits (e.g. of another shard).
+        """
+        self.Collided |= Other.Collided
+        for iBucket, OtherForms in Other.Forms.items():
+            Forms = self.Forms.get(iBucket)
+            if Forms is None:
+                self.Forms[iBucket] = dict(OtherForms)
+                self.Fingerprints[iBucket] = Other.Fingerprints[iBucket]
+                continue
+            if Other.Fingerprints[iBucket] != self.Fingerprints[iBucket] \
+               or len(set(Forms) | set(OtherForms)) > 1:
+                self.Collided.add(iBucket)
+            for sWord, iCount in OtherForms.items():
+                Forms[sWord] = Forms.get(sWord, 0) + iCount
+            while len(Forms) > self.iMaxForms:
+                del Forms[min(Forms, key=lambda sWord: (Forms[sWord], sWord))]
+
+    def to_arrays(self):
+        """Return the state as a dict of numpy arrays (e.g. to save with numpy.savez())."""
+        Buckets = sorted(self.Forms)
+        FormBuckets, FormWords, FormCounts = [], [], []
+        for iBucket in Buckets:
+            for sWord, iCount in self.Forms[iBucket].items():
+                FormBuckets.append(iBucket)
+                FormWords.append(sWord)
+                FormCounts.append(iCount)
+        return {'HashBits': numpy.array(self.iBits),
+                'HashBuckets': numpy.array(Buckets, dtype=numpy.int64),
+                'HashFingerprints': numpy.array([self.Fingerprints[iBucket] for iBucket in Buckets],
+                                                dtype=numpy.int64),
+                'HashCollided': numpy.array(sorted(self.Collided), dtype=numpy.int64),
+                'HashFormBuckets': numpy.array(FormBuckets, dtype=numpy.int64),
+                'HashFormWords': numpy.array(FormWords, dtype=str),
+                'HashFormCounts': numpy.array(FormCounts, dtype=numpy.int64)}
+
+    @classmethod
+    def from_arrays(cls, Arrays, iMaxForms=iDEFAULT_MAX_FORMS):
+        """Return a FeatureHasher with the state in Arrays (as returned by to_arrays())."""
+        Hasher = cls(int(Arrays['HashBits']), iMaxForms)
+        Hasher.Fingerprints = dict(zip(Arrays['HashBuckets'].tolist(),
+                                       Arrays['HashFingerprints'].tolist()))
+        Hasher.Collided = set(Arrays['HashCollided'].tolist())
+        for iBucket, sWord, iCount in zip(Arrays['HashFormBuckets'].tolist(),
+                                          Arrays['HashFormWords'].tolist(),
+                                          Arrays['HashFormCounts'].tolist()):
+            Hasher.Forms.setdefault(iBucket, {})[sWord] = iCount
+        return Hasher
+
+    def report(self):
+        """Return a summary of the buckets used, and of collisions."""
+        iUsed = len(self.Forms)
+        return "%i of %i hash buckets used; %i of them (%.2f%%) hold more than one word\n" \
+            %(iUsed, self.iMask + 1, len(self.Collided),
+              100.0 * len(self.Collided) / max(iUsed, 1))
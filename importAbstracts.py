@@ -23,7 +23,8 @@ ID, space character, space-separated tokens of abstract
 
 WARNING: This does not check for duplicate abstracts!  In particular, running
 this program twice on the same input file will result in all that file's abstracts
-being duplicated.
+being duplicated.  (dedup.py, or the -D arg of build_topic_model.py, removes
+duplicate and near-duplicate abstracts before modeling.)
 """
 
 from argparse import ArgumentParser
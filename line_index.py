@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Line-offset indexes of abstract files (one abstract per line, as read by
+build_topic_model.py), so that the corpus can be sampled or split by abstract
+without reading it all first.
+
+The index of a file is kept beside it, in .<file>.lineidx.npz (hidden, so that
+a glob for the corpus, e.g. 'abstracts/*', doesn't match it): the byte offset
+of the start of each line (and of the end of the file) in the decompressed
+text, the document ID at the start of each line, and the file's size and
+modification time when it was indexed.  It is built the first time it is
+needed (one pass over the file) and rebuilt if the file has changed since,
+or if it can't be read.
+If the file's directory isn't writable, the index is built but not kept.
+
+With the indexes of all the files, the number of abstracts in the corpus is
+known without reading it, so that
+  - a uniform random sample of exactly N abstracts can be drawn from the whole
+    corpus (CorpusIndex.sample()), rather than taking the first N; and
+  - the corpus can be split into shards of (nearly) equal numbers of abstracts,
+    each a contiguous range of lines (CorpusIndex.shard()).
+The selected lines of an uncompressed file are read by seeking straight to
+them; a compressed file has to be decompressed up to the last line selected,
+but lines not selected are skipped without being decoded.
+
+Command line (to build the indexes in advance, e.g. before starting shards on
+several nodes, which would otherwise all build them at once):
+     line_index.py '<glob>'
+"""
+
+import os
+from pathlib import Path
+import sys
+
+import numpy
+
+from compressed_io import compression_of, open_binary_reader
+
+
+sINDEX_SUFFIX = '.lineidx.npz'
+
+
+def index_fname(sFileName):
+    """Return the name of the index file of an abstract file."""
+    FilePath = Path(str(sFileName))
+    return str(FilePath.with_name('.' + FilePath.name + sINDEX_SUFFIX))
+
+
+def build_index(sFileName):
+    """
+    Read a (possibly compressed) file, and return (Offsets, DocIDs): a numpy
+    int64 array of the byte offsets of the start of each line and of the end of
+    the file, and a numpy bytes array of the first token of each line.
+    """
+    Offsets = [0]
+    DocIDs = []
+    iOffset = 0
+    with open_binary_reader(sFileName) as strIn:
+        for sLine in strIn:
+            iOffset += len(sLine)
+            Offsets.append(iOffset)
+            DocIDs.append(sLine.split(b' ', 1)[0].rstrip(b'\r\n'))
+    return numpy.array(Offsets, dtype=numpy.int64), numpy.array(DocIDs, dtype=bytes)
+
+
+class LineIndex:
+    """
+    The line index of one file (see module documentation).  Offsets and DocIDs
+    are as returned by build_index(); iLines is the number of lines.
+    """
+    def __init__(self, sFileName):
+        self.sFileName = str(sFileName)
+        Stat = os.stat(self.sFileName)
+        sIndexFName = index_fname(self.sFileName)
+        try:
+            with numpy.load(sIndexFName) as Saved:
+                if int(Saved['iSize']) == Stat.st_size and int(Saved['iMtime']) == Stat.st_mtime_ns:
+                    self.Offsets, self.DocIDs = Saved['Offsets'], Saved['DocIDs']
+                    self.iLines = len(self.DocIDs)
+                    return
+        except Exception: #Missing, stale format, or unreadable (e.g. truncated): rebuild it
+            pass
+        sys.stderr.write("Indexing lines of '%s'\n" %self.sFileName)
+        self.Offsets, self.DocIDs = build_index(self.sFileName)
+        self.iLines = len(self.DocIDs)
+        #Written to a temporary file and then renamed, so that another process
+        #never sees a partly written index:
+        sTmpFName = '%s.tmp.%i' %(sIndexFName, os.getpid())
+        try:
+            with open(sTmpFName, 'wb') as strOut: #So savez doesn't add .npz
+                numpy.savez(strOut, Offsets=self.Offsets, DocIDs=self.DocIDs,
+                            iSize=Stat.st_size, iMtime=Stat.st_mtime_ns)
+            os.replace(sTmpFName, sIndexFName)
+        except (PermissionError, IOError):
+            sys.stderr.write("Unable to write line index '%s'; not keeping it\n" %sIndexFName)
+            if os.path.exists(sTmpFName):
+                os.remove(sTmpFName)
+
+    def read_lines(self, Lines):
+        """
+        Yield (iLine, sLine) for the lines numbered (from 0) in Lines, a sorted
+        sequence of line numbers, with each sLine decoded as UTF-8 text.
+        """
+        if compression_of(self.sFileName) is not None:
+            Wanted = iter(Lines)
+            iWanted = next(Wanted, None)
+            with open_binary_reader(self.sFileName) as strIn:
+                for iLine, sLine in enumerate(strIn):
+                    if iWanted is None:
+                        return
+                    if iLine == iWanted:
+                        yield iLine, sLine.decode('utf-8')
+                        iWanted = next(Wanted, None)
+            return
+        with open(self.sFileName, 'rb') as strIn:
+            iPosition = 0
+            for iLine in Lines:
+                iStart = int(self.Offsets[iLine])
+                if iStart != iPosition: #Consecutive lines are read without seeking
+                    strIn.seek(iStart)
+                iPosition = int(self.Offsets[iLine + 1])
+                yield iLine, strIn.read(iPosition - iStart).decode('utf-8')
+
+
+class CorpusIndex:
+    """
+    The line indexes of a list of files, taken in the order given.  Lines are
+    numbered from 0 across all the files: Starts[iFile] is the number of the
+    first line of file iFile (from 0), and iLines the total.
+
+    A selection of lines (as returned by sample() and shard()) is a list with,
+    for each file, a sorted numpy array of the numbers (within that file) of its
+    lines selected.
+    """
+    def __init__(self, PathList):
+        self.Indexes = [LineIndex(sFileName) for sFileName in PathList]
+        Counts = [Index.iLines for Index in self.Indexes]
+        self.Starts = numpy.concatenate([[0], numpy.cumsum(Counts, dtype=numpy.int64)])
+        self.iLines = int(self.Starts[-1])
+
+    def _split(self, Lines):
+        """Turn a sorted array of corpus line numbers into a selection."""
+        Bounds = numpy.searchsorted(Lines, self.Starts)
+        return [Lines[Bounds[iFile] : Bounds[iFile + 1]] - self.Starts[iFile]
+                for iFile in range(len(self.Indexes))]
+
+    def sample(self, iSample, iSeed=0):
+        """
+        Select iSample lines uniformly at random (without replacement) from the
+        whole corpus; or all of them, if there are no more than iSample.
+        """
+        if iSample >= self.iLines:
+            return self._split(numpy.arange(self.iLines))
+        #Generator.choice() (unlike RandomState.choice()) draws a sample small
+        # compared with the corpus by Floyd's algorithm, in time and memory
+        # proportional to the sample, rather than permuting the whole corpus:
+        Random = numpy.random.default_rng(iSeed)
+        return self._split(numpy.sort(Random.choice(self.iLines, iSample, replace=False,
+                                                    shuffle=False)))
+
+    def shard(self, iShard, iShards):
+        """
+        Select shard iShard (from 0) of iShards: a contiguous range of lines,
+        with the shards' sizes differing by at most one line.
+        """
+        iFirst = self.iLines * iShard // iShards
+        iStop = self.iLines * (iShard + 1) // iShards
+        return self._split(numpy.arange(iFirst, iStop))
+
+    def read(self, Selection):
+        """
+        Yield (iFile, iLine, sLine) for each line selected (iFile numbered
+        from 0; iLine within the corpus, as for Starts).
+        """
+        for iFile, (Index, Lines) in enumerate(zip(self.Indexes, Selection)):
+            for iLine, sLine in Index.read_lines(Lines):
+                yield iFile, int(self.Starts[iFile]) + iLine, sLine
+
+
+
+if __name__ == '__main__':
+    from glob import glob
+    if len(sys.argv) != 2:
+        sys.stderr.write("Usage: line_index.py '<glob>'\n")
+        exit(1)
+    PathList = sorted(glob(sys.argv[1]))
+    if not PathList:
+        sys.stderr.write("No files match '%s'\n" %sys.argv[1])
+        exit(1)
+    Corpus = CorpusIndex(PathList)
+    sys.stderr.write("%i abstracts in %i files\n" %(Corpus.iLines, len(PathList)))
@@ -2,14 +2,35 @@
 """
 Create a file containing a subset of the PubMed abstract corpus, tokenized.
 Arguments:
+  -r   Root directory for PubMed abstracts
+  -o   Destination file, defaults to stdout; compressed if the name ends in
+       .gz, .zst or .xz (see compressed_io.py)
+  -n   Numerator for the fraction of abstracts to retain, defaults to 1
+  -d   Denominator for the fraction of abstracts to retain, defaults to 1000
+  -S <fraction> <fname>
+       Write a sample of <fraction> of the abstracts to <fname>; may be repeated
+       to write several samples in a single pass over the tree.  If used, -o,
+       -n and -d are ignored.
+  -e   Seed for the sampling hash, defaults to 0
+  -m   Use (and refresh) a manifest of the tree instead of listing it
 
+Sampling:
+An abstract is selected by hashing its PubMed ID to a number u in [0, 1), and
+keeping it if u < the sample fraction.  The selection therefore depends only on
+the PubMed ID (and the seed), so it is the same from run to run, and abstracts
+already in a sample stay in it as the tree grows.  Samples written in the same
+run are nested: every abstract in a 1% sample is also in the 10% sample.
 """
 
 from argparse import ArgumentParser
+import codecs
 from pathlib import Path
 import regex  #Note regex, not re
 import sys
 
+from compressed_io import open_text
+from pubmed_manifest import refresh_manifest
+
 
 iUpdateInterval = 1000 #Output a status message at every N files
 
@@ -31,6 +52,7 @@ def GetCmdLineParameters():
                        , help    = "Takes arg <OutputFile>. Optional, defaults to stdout."
                        )
     parser.add_argument( "-n", "--iNumerator"
+                       , type    = int
                        , dest    = "iNumerator"
                        , default = 1
                        , help    = "Numerator for fraction of files to retain.  Optional, defaults to 1."
@@ -41,45 +63,86 @@ def GetCmdLineParameters():
                        , help    = "Denominator for fraction of files to retain.  Optional, defaults to 1000."
                        , default = 1000
                        )
+    parser.add_argument( "-S", "--Sample"
+                       , dest    = "Samples"
+                       , nargs   = 2
+                       , action  = "append"
+                       , metavar = ("<Fraction>", "<OutputFile>")
+                       , help    = "Write a sample of <Fraction> (e.g. 0.01) of the abstracts to <OutputFile>.  May be repeated; all samples are written in one pass."
+                       )
+    parser.add_argument( "-e", "--Seed"
+                       , type    = int
+                       , dest    = "iSeed"
+                       , default = 0
+                       , help    = "Seed for the sampling hash; different seeds give independent samples.  Optional, defaults to 0."
+                       )
+    parser.add_argument( "-m", "--Manifest"
+                       , dest    = "sManifestFName"
+                       , nargs   = "?"
+                       , const   = ""
+                       , default = None
+                       , help    = "Take the list of abstract files from a manifest (see pubmed_manifest.py), refreshing it first.  Optional arg is the manifest file, defaults to one for <RootDir> in ~/.cache/pubmed_manifests/ (see pubmed_manifest.py).  Without this arg, the directory tree is listed on every run."
+                       )
     args = parser.parse_args()
 
     #Validate input dir:
     if not Path(args.sRootDir).is_dir(): #Does not check permissions
         sys.stderr.write("Directory %s does not appear to exist." %args.sRootDir)
         exit(1)
-    #Open output:
-    try:
-        if args.sOutFileName == 'stdout':
-            strOut = codecs.getwriter('utf-8')(sys.stdout.buffer)
-        else:
-            strOut = open(args.sOutFileName, 'w+', encoding='utf-8')
-    except:
-        sys.stderr.write("Failed to open output file %s for writing"
-            %args.sOutFileName)
-        exit(1)
+    #Validate sample fractions and open outputs:
+    if args.Samples:
+        SampleArgs = args.Samples
+    else:
+        if not (0 < args.iNumerator <= args.iDenominator):
+            sys.stderr.write("Numerator must be between 1 and the denominator (%i).\n"
+                %args.iDenominator)
+            exit(1)
+        SampleArgs = [(args.iNumerator / args.iDenominator, args.sOutFileName)]
+    Samples = []
+    for sFraction, sOutFileName in SampleArgs:
+        try:
+            fFraction = float(sFraction)
+        except ValueError:
+            fFraction = -1
+        if not (0 < fFraction <= 1):
+            sys.stderr.write("Sample fraction %s is not a number between 0 and 1.\n"
+                %sFraction)
+            exit(1)
+        try:
+            if sOutFileName == 'stdout':
+                strOut = codecs.getwriter('utf-8')(sys.stdout.buffer)
+            else:
+                strOut = open_text(sOutFileName, 'w')
+        except:
+            sys.stderr.write("Failed to open output file %s for writing"
+                %sOutFileName)
+            exit(1)
+        Samples.append((fFraction, strOut))
 
-    return (args.sRootDir, strOut, args.iNumerator, args.iDenominator)
+    return (args.sRootDir, Samples, args.iSeed, args.sManifestFName)
 
 
 
-def build_subset(sRootDir, iNumerator, iDenominator, strOut):
+def pmid_fraction(iPMID, iSeed=0):
+    """
+    Hash a PubMed ID (and seed) to a number in [0, 1).  Uses the splitmix64
+    finalizer, which is cheap and spreads consecutive IDs uniformly.
     """
-    Iterate over abstracts and extract a subset into a file.
+    x = (iPMID + (iSeed + 1) * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    x ^= x >> 31
+    return x / 2.0**64
 
-    Args:
-        sRootDir:     Path to the root directory for PubMed abstracts.
-        iNumerator:   (int) keep this many files out of iDenominator.
-        iDenominator: (int) keep iNumerator files out of this many.
-        strOut:       Output file stream
-    No return value.
-    Side effects:
-        Writes one line per sampled abstract to output stream. Each line will
-        begin with a PubMed ID followed by a space and one or more space-separated
-        word tokens.
+
+
+def list_tree(sRootDir):
+    """
+    List the abstract files in the PubMed abstract tree by reading the
+    directories.
+    Returns a tuple (iSubdirs, iterator over (iNthDir, iPMID, Path) for each
+    abstract file, in sorted order).  iNthDir starts at 1.
     """
-    Intervals  = [iNth * iDenominator // iNumerator for iNth in range(iNumerator)]
-    iFilesInAll = 0
-    iProcessed  = 0
     try:
         SubDirs = sorted([path for path in Path(sRootDir).glob('*') if path.is_dir()])
     except:
@@ -88,46 +151,114 @@ def build_subset(sRootDir, iNumerator, iDenominator, strOut):
         exit(1)
     #If we get here, we have permission to read the root directory.  (We'll check
     # each subdir below.)
-    iSubdirs = len(SubDirs)
-    for iNthDir, sSubdir in enumerate(SubDirs, start=1): #iNthDir used for status
-        # message, so start=1 to make sense to non-computer scientists
-        try:
-            Files = sorted([sFName for sFName in sSubdir.glob('*.txt')],
-                           key=lambda x: int(x.stem.lstrip('PMID')))
-              #'PMID' means "PubMedID"
-        except:
-            sys.stderr.write("Failure listing files in directory %s.  Perhaps you do not have permission to read from this directory?"
-                %sSubdir)
-            exit(1)
-        #If we get here, we have permission to at least read this directory
-        for iNthFileInDir, sTxtFName in enumerate(Files):
-            iFilesInAll += 1 #Overall number of files processed
-            if iFilesInAll % iUpdateInterval == 0:
-                sys.stderr.write("Processing directory {} of {}, file {}; {} files included so far.\r"
-                                 .format(iNthDir, iSubdirs, iFilesInAll, iProcessed))
-                sys.stderr.flush()
-            if not (iFilesInAll % iDenominator in Intervals):
-                continue #Skip this one
-            #If we get here, we want to process this abstract file
-            iProcessed += 1
+    def iter_files():
+        for iNthDir, sSubdir in enumerate(SubDirs, start=1): #iNthDir used for status
+            # message, so start=1 to make sense to non-computer scientists
             try:
-                with sTxtFName.open('r', encoding='utf-8') as strTxtFile:
-                    sData = strTxtFile.read().lower().strip()
-                    if not sData:
-                        sys.stderr.write("Found empty file %s\n" %sTxtFName)
-                        continue
-                    Tokens = regex.findall(r"[\w-]+", sData, flags=regex.VERSION1)
-                    sPubMedID = sTxtFName.stem.lstrip('PMID')
-                    strOut.write('{:08d} {}\n'.format(int(sPubMedID), ' '.join(Tokens)))
+                Files = sorted([sFName for sFName in sSubdir.glob('*.txt')],
+                               key=lambda x: int(x.stem.lstrip('PMID')))
+                  #'PMID' means "PubMedID"
             except:
-               sys.stderr.write("Failure processing file %s.  Perhaps you do not have read permission on this file?"
-                   %sTxtFName)
-               exit(1)
+                sys.stderr.write("Failure listing files in directory %s.  Perhaps you do not have permission to read from this directory?"
+                    %sSubdir)
+                exit(1)
+            #If we get here, we have permission to at least read this directory
+            for sTxtFName in Files:
+                yield iNthDir, int(sTxtFName.stem.lstrip('PMID')), sTxtFName
+    return len(SubDirs), iter_files()
+
+
+def list_manifest(sRootDir, sManifestFName):
+    """
+    List the abstract files in the PubMed abstract tree from its manifest,
+    refreshing the manifest first (which only rescans subdirs that have changed).
+    Returns the same tuple as list_tree().
+    """
+    try:
+        manifest = refresh_manifest(sRootDir, sManifestFName or None)
+    except (PermissionError, IOError):
+        sys.stderr.write("Failure refreshing the manifest for root directory %s.  Perhaps you do not have permission to read from this directory, or to write the manifest?"
+                %sRootDir)
+        exit(1)
+    return len(manifest.SubDirs), manifest.iter_files(sRootDir)
+
+
+def extract_abstracts(sRootDir, fMaxFraction=1.0, iSeed=0, sManifestFName=None):
+    """
+    Iterate over the abstracts in the tree whose hash (see pmid_fraction()) is
+    below fMaxFraction, reading and tokenizing each.  Writes progress messages
+    to stderr.
+
+    Args:
+        sRootDir, iSeed, sManifestFName: as for build_subset()
+        fMaxFraction: fraction of the abstracts to read
+    Yields:
+        (iPMID, fHash, Tokens) for each non-empty abstract read, in PMID order
+        within each subdir, where fHash is the abstract's pmid_fraction() and
+        Tokens its list of (lower-cased) tokens.
+    """
+    iFilesInAll = 0
+    iProcessed  = 0
+    if sManifestFName is None:
+        iSubdirs, Files = list_tree(sRootDir)
+    else:
+        iSubdirs, Files = list_manifest(sRootDir, sManifestFName)
+    for iNthDir, iPMID, sTxtFName in Files:
+        iFilesInAll += 1 #Overall number of files processed
+        if iFilesInAll % iUpdateInterval == 0:
+            sys.stderr.write("Processing directory {} of {}, file {}; {} files included so far.\r"
+                             .format(iNthDir, iSubdirs, iFilesInAll, iProcessed))
+            sys.stderr.flush()
+        fHash = pmid_fraction(iPMID, iSeed)
+        if fHash >= fMaxFraction:
+            continue #Not in any sample, skip this one
+        #If we get here, we want to process this abstract file
+        iProcessed += 1
+        try:
+            with sTxtFName.open('r', encoding='utf-8') as strTxtFile:
+                sData = strTxtFile.read().lower().strip()
+        except:
+           sys.stderr.write("Failure processing file %s.  Perhaps you do not have read permission on this file?"
+               %sTxtFName)
+           exit(1)
+        if not sData:
+            sys.stderr.write("Found empty file %s\n" %sTxtFName)
+            continue
+        yield iPMID, fHash, regex.findall(r"[\w-]+", sData, flags=regex.VERSION1)
     sys.stderr.write("\n") #Retain last progress message on-screen
 
 
+def build_subset(sRootDir, Samples, iSeed=0, sManifestFName=None):
+    """
+    Iterate over abstracts and extract one or more (nested) subsets into files,
+    in a single pass over the tree.
+
+    Args:
+        sRootDir:     Path to the root directory for PubMed abstracts.
+        Samples:      list of (fFraction, strOut) tuples: write (approximately)
+                      fFraction of the abstracts to output stream strOut.
+        iSeed:        Seed for the sampling hash (see pmid_fraction()).
+        sManifestFName: If not None, take the list of files from this manifest
+                      ('' means the default manifest file) instead of listing
+                      the directories.
+    No return value.
+    Side effects:
+        Writes one line per sampled abstract to each output stream whose
+        fraction the abstract falls under. Each line will begin with a PubMed ID
+        followed by a space and one or more space-separated word tokens.
+    """
+    Samples = sorted(Samples, key=lambda Sample: Sample[0])
+    for iPMID, fHash, Tokens in extract_abstracts(sRootDir, Samples[-1][0], iSeed,
+                                                  sManifestFName):
+        sLine = '{:08d} {}\n'.format(iPMID, ' '.join(Tokens))
+        for fFraction, strOut in reversed(Samples):
+            if fHash >= fFraction:
+                break #Samples are nested, so no smaller one wants it either
+            strOut.write(sLine)
+
 
 if __name__ == '__main__':
-    (sRootDir, strOut, iNumerator, iDenominator) = GetCmdLineParameters()
-    build_subset(sRootDir, iNumerator, iDenominator, strOut)
-    strOut.close()
+    (sRootDir, Samples, iSeed, sManifestFName) = GetCmdLineParameters()
+    build_subset(sRootDir, Samples, iSeed, sManifestFName)
+    for _, strOut in Samples:
+        strOut.close()
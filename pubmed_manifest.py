@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Build (or refresh) a manifest of the PubMed abstract tree, so that programs
+which walk the tree (e.g. prepare_pubmed_subset.py) don't have to list and
+sort millions of files on every run.
+
+Arguments:
+  -r   Root directory for PubMed abstracts, defaults to
+          /groups/identdata/topictracking/pubmed/abstracts/
+  -m   Manifest file to create or refresh, defaults to a file for the root
+       directory in the user's cache directory ($XDG_CACHE_HOME, or ~/.cache):
+          <cache>/pubmed_manifests/<hash of the root directory's path>.bin
+       so that it works when the tree is read-only, and users sharing the
+       tree don't overwrite each other's manifests
+
+Format of PubMed abstracts dir:
+The abstracts have been broken into subdirs based on the first 4 digits of the
+PubMed ID (including any leading zeros).  Each subdir contains .txt files
+whose file names consist of 'PMID' plus the PubMed ID (normally without
+leading zeros; a file whose name isn't exactly 'PMID%i.txt' of its PubMed ID,
+e.g. with leading zeros, has its name recorded in the manifest).
+
+Manifest format (binary, little-endian):
+  Header:   magic b'PMMF', version (uint32), number of subdirs (uint32),
+            number of PMIDs (uint64)
+  Subdirs:  one record per subdir, in sorted order: length of name (uint16),
+            name (UTF-8), mtime of the subdir in ns (int64), index of the
+            subdir's first PMID in the PMID array (uint64), number of PMIDs in
+            the subdir (uint64)
+  PMIDs:    uint32 array of all PMIDs, grouped by subdir and sorted within each
+            subdir.
+  Names:    number of names recorded (uint64), then one record per file whose
+            name isn't 'PMID%i.txt' of its PMID: its index in the PMID array
+            (uint64), length of name (uint16), name (UTF-8).
+The subdir's mtime changes whenever a file is added to or removed from it, so
+a refresh only needs to rescan subdirs whose mtime differs from the one
+recorded in the manifest.
+"""
+
+from argparse import ArgumentParser
+from array import array
+import hashlib
+import os
+from pathlib import Path
+import struct
+import sys
+
+
+MAGIC    = b'PMMF'
+VERSION  = 2
+HEADER   = struct.Struct('<4sIIQ')
+SUBDIR   = struct.Struct('<qQQ')  #Follows the (variable-length) subdir name
+NAMELEN  = struct.Struct('<H')
+COUNT    = struct.Struct('<Q')
+
+
+class Manifest:
+    """
+    Sorted list of all the PMIDs in the PubMed abstract tree, grouped by subdir.
+
+    Attributes:
+        SubDirs: list of (sName, iMTimeNS, iFirst, iCount) tuples, sorted by name.
+        PMIDs:   array('I') of PMIDs; PMIDs[iFirst : iFirst+iCount] are the
+                 (sorted) PMIDs in the corresponding subdir.
+        Names:   dict mapping an index in PMIDs to the file's name, for the
+                 (few) files whose name isn't 'PMID%i.txt' of their PMID.
+    """
+    def __init__(self, SubDirs=None, PMIDs=None, Names=None):
+        self.SubDirs = SubDirs if SubDirs is not None else []
+        self.PMIDs   = PMIDs if PMIDs is not None else array('I')
+        self.Names   = Names if Names is not None else {}
+
+    def __len__(self):
+        return len(self.PMIDs)
+
+    def iter_files(self, sRootDir):
+        """
+        Yield (iNthDir, iPMID, Path) for every abstract file in the manifest,
+        in the same order as a sorted walk of the tree.  iNthDir starts at 1.
+        """
+        RootDir = Path(sRootDir)
+        for iNthDir, (sName, _, iFirst, iCount) in enumerate(self.SubDirs, start=1):
+            SubDir = RootDir / sName
+            for iIndex in range(iFirst, iFirst + iCount):
+                iPMID = self.PMIDs[iIndex]
+                yield iNthDir, iPMID, SubDir / self.Names.get(iIndex, 'PMID%i.txt' %iPMID)
+
+
+def default_manifest_fname(sRootDir):
+    """
+    Return the name of the manifest file used if none is specified: one per
+    root directory, in the user's cache directory (see module documentation).
+    """
+    CacheDir = Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache')
+    sRootHash = hashlib.sha1(str(Path(sRootDir).resolve()).encode('utf-8')).hexdigest()
+    return str(CacheDir / 'pubmed_manifests' / (sRootHash + '.bin'))
+
+
+def read_manifest(sManifestFName):
+    """
+    Read a manifest from a file.  Returns a Manifest, or None if the file does
+    not exist or is not a (readable) manifest.
+    """
+    try:
+        with open(sManifestFName, 'rb') as strIn:
+            sMagic, iVersion, iSubDirs, iPMIDs = HEADER.unpack(strIn.read(HEADER.size))
+            if sMagic != MAGIC or iVersion != VERSION:
+                return None
+            SubDirs = []
+            for _ in range(iSubDirs):
+                (iNameLen,) = NAMELEN.unpack(strIn.read(NAMELEN.size))
+                sName = strIn.read(iNameLen).decode('utf-8')
+                iMTimeNS, iFirst, iCount = SUBDIR.unpack(strIn.read(SUBDIR.size))
+                SubDirs.append((sName, iMTimeNS, iFirst, iCount))
+            PMIDs = array('I')
+            PMIDs.fromfile(strIn, iPMIDs)
+            Names = {}
+            (iNames,) = COUNT.unpack(strIn.read(COUNT.size))
+            for _ in range(iNames):
+                (iIndex,) = COUNT.unpack(strIn.read(COUNT.size))
+                (iNameLen,) = NAMELEN.unpack(strIn.read(NAMELEN.size))
+                Names[iIndex] = strIn.read(iNameLen).decode('utf-8')
+    except (FileNotFoundError, struct.error, EOFError, UnicodeDecodeError):
+        return None
+    if sys.byteorder != 'little':
+        PMIDs.byteswap()
+    return Manifest(SubDirs, PMIDs, Names)
+
+
+def write_manifest(manifest, sManifestFName):
+    """
+    Write a manifest to a file (creating its directory if need be).  Writes to
+    a temporary file first, so that an interrupted write doesn't leave a
+    truncated manifest behind.
+    """
+    Path(sManifestFName).parent.mkdir(parents=True, exist_ok=True)
+    sTmpFName = '%s.tmp.%i' %(sManifestFName, os.getpid())
+    with open(sTmpFName, 'wb') as strOut:
+        strOut.write(HEADER.pack(MAGIC, VERSION, len(manifest.SubDirs), len(manifest.PMIDs)))
+        for sName, iMTimeNS, iFirst, iCount in manifest.SubDirs:
+            sEncodedName = sName.encode('utf-8')
+            strOut.write(NAMELEN.pack(len(sEncodedName)))
+            strOut.write(sEncodedName)
+            strOut.write(SUBDIR.pack(iMTimeNS, iFirst, iCount))
+        PMIDs = manifest.PMIDs
+        if sys.byteorder != 'little':
+            PMIDs = array('I', PMIDs)
+            PMIDs.byteswap()
+        PMIDs.tofile(strOut)
+        strOut.write(COUNT.pack(len(manifest.Names)))
+        for iIndex in sorted(manifest.Names):
+            sEncodedName = manifest.Names[iIndex].encode('utf-8')
+            strOut.write(COUNT.pack(iIndex))
+            strOut.write(NAMELEN.pack(len(sEncodedName)))
+            strOut.write(sEncodedName)
+    os.replace(sTmpFName, sManifestFName)
+
+
+def scan_subdir(sSubDir):
+    """
+    Return (PMIDs, Names): a sorted array('I') of the PMIDs of the abstract
+    files in sSubDir, and a dict mapping an index in it to the file's name,
+    for the files whose name isn't 'PMID%i.txt' of their PMID (e.g. with
+    leading zeros).  Uses os.scandir(), which (unlike Path.glob()) doesn't
+    stat each file.
+    """
+    Files = []
+    with os.scandir(sSubDir) as Entries:
+        for entry in Entries:
+            sName = entry.name
+            if sName.startswith('PMID') and sName.endswith('.txt'):
+                try:
+                    Files.append((int(sName[4:-4]), sName))
+                except ValueError:
+                    continue #Not an abstract file
+    Files.sort()
+    Names = {iIndex: sName for iIndex, (iPMID, sName) in enumerate(Files)
+             if sName != 'PMID%i.txt' %iPMID}
+    return array('I', (iPMID for iPMID, _ in Files)), Names
+
+
+def refresh_manifest(sRootDir, sManifestFName=None):
+    """
+    Bring the manifest for sRootDir up to date, rescanning only those subdirs
+    which are new or whose mtime has changed since the manifest was written.
+    Creates the manifest if it does not exist.
+
+    Args:
+        sRootDir:       Path to the root directory for PubMed abstracts.
+        sManifestFName: Manifest file; defaults to default_manifest_fname().
+    Returns:
+        The (up to date) Manifest.
+    Side effects:
+        (Re)writes the manifest file if anything changed.
+    """
+    if sManifestFName is None:
+        sManifestFName = default_manifest_fname(sRootDir)
+    OldManifest = read_manifest(sManifestFName) or Manifest()
+    OldSubDirs = {SubDir[0]: SubDir for SubDir in OldManifest.SubDirs}
+    with os.scandir(sRootDir) as Entries:
+        CurrentSubDirs = sorted((entry.name, entry.stat().st_mtime_ns)
+                                for entry in Entries if entry.is_dir())
+    NewManifest = Manifest()
+    iRescanned = 0
+    for sName, iMTimeNS in CurrentSubDirs:
+        OldSubDir = OldSubDirs.get(sName)
+        if OldSubDir is not None and OldSubDir[1] == iMTimeNS:
+            iOldFirst, iCount = OldSubDir[2], OldSubDir[3]
+            PMIDs = OldManifest.PMIDs[iOldFirst : iOldFirst + iCount]
+            Names = {iIndex - iOldFirst: sFileName for iIndex, sFileName in OldManifest.Names.items()
+                     if iOldFirst <= iIndex < iOldFirst + iCount}
+        else:
+            PMIDs, Names = scan_subdir(os.path.join(sRootDir, sName))
+            iRescanned += 1
+        iFirst = len(NewManifest.PMIDs)
+        NewManifest.SubDirs.append((sName, iMTimeNS, iFirst, len(PMIDs)))
+        NewManifest.PMIDs.extend(PMIDs)
+        NewManifest.Names.update((iFirst + iIndex, sFileName) for iIndex, sFileName in Names.items())
+    if iRescanned or NewManifest.SubDirs != OldManifest.SubDirs:
+        sys.stderr.write("Rescanned %i of %i subdirs; writing manifest %s\n"
+            %(iRescanned, len(CurrentSubDirs), sManifestFName))
+        write_manifest(NewManifest, sManifestFName)
+    return NewManifest
+
+
+def GetCmdLineParameters():
+    """Return a tuple of args based on command line parameters.
+    """
+    parser = ArgumentParser(description="Build or refresh the manifest of the PubMed abstract tree")
+    parser.add_argument( "-r", "--sRootDir"
+                       , dest    = "sRootDir"
+                       , type    = str
+                       , default = '/groups/identdata/topictracking/pubmed/abstracts/'
+                       , help    = "Root directory for PubMed abstracts, defaults to '/groups/identdata/topictracking/pubmed/abstracts/'"
+                       )
+    parser.add_argument( "-m", "--Manifest"
+                       , dest    = "sManifestFName"
+                       , default = None
+                       , help    = "Manifest file to create or refresh.  Optional, defaults to one for <RootDir> in ~/.cache/pubmed_manifests/"
+                       )
+    args = parser.parse_args()
+    if not Path(args.sRootDir).is_dir(): #Does not check permissions
+        sys.stderr.write("Directory %s does not appear to exist." %args.sRootDir)
+        exit(1)
+    return (args.sRootDir, args.sManifestFName)
+
+
+
+if __name__ == '__main__':
+    (sRootDir, sManifestFName) = GetCmdLineParameters()
+    try:
+        manifest = refresh_manifest(sRootDir, sManifestFName)
+    except (PermissionError, IOError) as e:
+        sys.stderr.write("Failure building manifest for %s: %s\n" %(sRootDir, e))
+        exit(1)
+    sys.stderr.write("Manifest lists %i abstracts in %i subdirs.\n"
+        %(len(manifest), len(manifest.SubDirs)))
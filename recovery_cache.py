@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+On-disk cache of the per-word solutions of topic recovery, so that a run with
+the same anchors as an earlier run (over the same corpus) can skip the
+recovery, and a run whose anchors differ only in part can start each word's
+optimization from the earlier solution, which then converges in a few
+iterations instead of many.
+
+The solution for a set of k topics is the n_words x k matrix C, whose row w
+gives word w as a convex combination of the topics' anchors (see
+anchor_model.recover_from_products()).  The cache is a directory with a
+subdirectory for each corpus fingerprint (see corpus.corpus_fingerprint()),
+and within that one for each setting of what else decides the solution: the
+pruning of Q (-P, the minimum number of documents a pair of words must
+cooccur in) and the convergence tolerance of the recovery.  So a solution is
+only reused (or used as a warm start) by a run with the same settings.  Each
+holds one .npz file per (ordered) list of anchors, named by a hash of the
+anchors.
+
+Warm start: each of the new topics whose anchor(s) are the same as one of the
+cached topics' starts with that topic's coefficients; new topics start from 0;
+and the result is mixed with a little of the uniform distribution (so that no
+coefficient starts at 0, which the exponentiated gradient could never move),
+and renormalized.
+
+Without a directory, the cache is kept in memory, and holds only the
+iMaxMemoryEntries (default iMAX_MEMORY_ENTRIES) solutions most recently stored
+or used, dropping the least recently used: each solution is n_words x k
+floats (e.g. 40 MB for 100,000 words and 50 topics), and a session's next
+edit almost always starts from one of its last few.
+"""
+
+from collections import OrderedDict
+import hashlib
+from pathlib import Path
+
+import numpy
+
+
+fUNIFORM_MIX = 0.1 #Weight of the uniform distribution in a warm start
+iMAX_MEMORY_ENTRIES = 8 #Solutions kept by a cache in memory
+
+
+def anchors_key(AnchorLists):
+    """Return a hash identifying an ordered list of anchor lists."""
+    return hashlib.sha1(repr([list(map(int, Anchors)) for Anchors in AnchorLists])
+                        .encode('ascii')).hexdigest()
+
+
+def warm_start(AnchorLists, CachedAnchors, CachedC):
+    """
+    Return the initial coefficients for AnchorLists, given the solution
+    CachedC for CachedAnchors (see module documentation).
+    """
+    k = len(AnchorLists)
+    Start = numpy.zeros((CachedC.shape[0], k))
+    CachedIndex = {tuple(Anchors): iTopic for iTopic, Anchors in enumerate(CachedAnchors)}
+    for iTopic, Anchors in enumerate(AnchorLists):
+        iCached = CachedIndex.get(tuple(Anchors))
+        if iCached is not None:
+            Start[:, iTopic] = CachedC[:, iCached]
+    Start = (1 - fUNIFORM_MIX) * Start + fUNIFORM_MIX / k
+    Start /= Start.sum(axis=1)[:, numpy.newaxis]
+    return Start
+
+
+def settings_name(iMinCoDocs, fTolerance):
+    """Return the name of the subdirectory for solutions with these settings."""
+    return 'P%i-tol%r' %(iMinCoDocs, float(fTolerance))
+
+
+def load_solution(EntryPath):
+    """Return the solution C saved in a cache entry."""
+    with numpy.load(str(EntryPath)) as Entry:
+        return Entry['C']
+
+
+class RecoveryCache:
+    """
+    Cache of recovery solutions for one corpus, computed from Q pruned to
+    pairs cooccurring in at least iMinCoDocs documents, with convergence
+    tolerance fTolerance (see module documentation).  If sCacheDir is None, the
+    cache is kept in memory only (e.g. for the edits of an interactive session),
+    and holds at most iMaxMemoryEntries solutions (see module documentation).
+    """
+    def __init__(self, sCacheDir, sFingerprint, iMinCoDocs=1, fTolerance=2e-7,
+                 iMaxMemoryEntries=iMAX_MEMORY_ENTRIES):
+        self.Dir = Path(sCacheDir) / sFingerprint / settings_name(iMinCoDocs, fTolerance) \
+            if sCacheDir else None
+        if self.Dir is not None:
+            self.Dir.mkdir(parents=True, exist_ok=True)
+        self.iMaxMemoryEntries = iMaxMemoryEntries
+        self.Memory = OrderedDict() #Key -> (AnchorLists, C), least recently used first
+
+    def _entries(self):
+        """Yield (key, AnchorLists, loader of C) for every cached solution."""
+        #Most recently used first, so that of equally good warm starts the latest is taken:
+        for sKey, (AnchorLists, C) in reversed(list(self.Memory.items())):
+            yield sKey, AnchorLists, (lambda C=C: C)
+        if self.Dir is None:
+            return
+        for EntryPath in self.Dir.glob('*.npz'):
+            if EntryPath.stem in self.Memory:
+                continue
+            try:
+                with numpy.load(str(EntryPath)) as Entry:
+                    Flat, Lengths = Entry['Anchors'], Entry['Lengths']
+            except (IOError, ValueError, KeyError):
+                continue #Unreadable (e.g. partly written) entry
+            Ends = numpy.cumsum(Lengths)
+            AnchorLists = [list(Flat[iEnd - iLength : iEnd])
+                           for iLength, iEnd in zip(Lengths, Ends)]
+            yield EntryPath.stem, AnchorLists, (lambda EntryPath=EntryPath: load_solution(EntryPath))
+
+    def lookup(self, AnchorLists):
+        """
+        Return (C, bExact): the cached solution for AnchorLists if there is
+        one (bExact True); else a warm start from the cached solution with the
+        most topics in common (bExact False); else (None, False).
+        """
+        sKey = anchors_key(AnchorLists)
+        Wanted = set(tuple(Anchors) for Anchors in AnchorLists)
+        Best, iBestOverlap = None, 0
+        for sEntryKey, CachedAnchors, fnLoad in self._entries():
+            if sEntryKey == sKey:
+                if sKey in self.Memory:
+                    self.Memory.move_to_end(sKey)
+                return fnLoad(), True
+            iOverlap = len(Wanted & set(tuple(Anchors) for Anchors in CachedAnchors))
+            if iOverlap > iBestOverlap:
+                Best, iBestOverlap = (CachedAnchors, fnLoad), iOverlap
+        if Best is None:
+            return None, False
+        return warm_start(AnchorLists, Best[0], Best[1]()), False
+
+    def store(self, AnchorLists, C):
+        """Cache the solution C for AnchorLists."""
+        AnchorLists = [list(map(int, Anchors)) for Anchors in AnchorLists]
+        sKey = anchors_key(AnchorLists)
+        if self.Dir is None:
+            self.Memory[sKey] = (AnchorLists, C)
+            self.Memory.move_to_end(sKey)
+            while len(self.Memory) > self.iMaxMemoryEntries:
+                self.Memory.popitem(last=False)
+            return
+        EntryPath = self.Dir / (sKey + '.npz')
+        sTmpFName = str(EntryPath) + '.tmp'
+        with open(sTmpFName, 'wb') as strOut:
+            numpy.savez(strOut, C=C,
+                        Anchors=numpy.array([w for Anchors in AnchorLists for w in Anchors]),
+                        Lengths=numpy.array([len(Anchors) for Anchors in AnchorLists]))
+        Path(sTmpFName).replace(EntryPath)
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+Build a topic model across several nodes, by splitting the cooccurrence
+computation into shards.  The cooccurrence statistics are sums over documents,
+so each node can compute the sums for its own slice of the corpus (against a
+vocabulary shared by all nodes), and a final step adds the partial sums and
+runs the anchor search and topic recovery.
+
+Subcommands:
+  vocab   Build the shared vocabulary file from the corpus:
+            sharded_cooccur.py vocab -i <glob> -V <VocabFile> [-s <stopwords>] [-l <int>]
+  shard   Compute the partial sums for one shard of the corpus:
+            sharded_cooccur.py shard -i <glob> -V <VocabFile> -k <ShardIndex> -K <NumShards> -p <PartialFile> [-f | -L] [-C]
+            sharded_cooccur.py shard -i <glob> --hash-features <Bits> [-s <stopwords>] [-l <int>] -k ... (as above)
+  reduce  Add the partial sums, and output the topics:
+            sharded_cooccur.py reduce -V <VocabFile> [-o <OutFile>] [-x] [-a <int>] [-w <int>] [-S] [-P <int>] <PartialFile>...
+            sharded_cooccur.py reduce --hash-features <Bits> [-o ...] (as above) <PartialFile>...
+
+The input files and the -s, -l, -o, -x, -a, -w, -S, -P and --anchor-threshold
+args are as for
+build_topic_model.py; pruning with -P requires the shards to have counted
+co-documents (-C).  The input glob is sorted, so that every node sees the
+files in the same order.  Shard k of K consists of the abstracts (lines)
+whose number (counting over all the files) is k modulo K; with -f, it consists
+instead of every K'th file, which saves each node from reading the whole corpus,
+and is the better choice when the corpus is split into many files.  With -L, it
+consists of the k'th of K contiguous ranges of abstracts, of equal size (to
+within one abstract) however the corpus is split into files; each node finds
+its range from the files' line indexes (see line_index.py, which builds them
+the first time), and reads only that range.
+
+With --hash-features, there is no vocab step: each shard gives each word the
+row of its hash bucket (see feature_hashing.py), keeping all 2**<Bits> rows,
+so that the shards' sums can be added as they are; reduce then drops the
+buckets no word fell in, and labels the rest with their most frequent words,
+as build_topic_model.py --hash-features does.  The stopwords and minimum word
+length (-s, -l) are then given to each shard, and must be the same for all.
+The sums of a shard take 16 bytes per bucket, besides the word pairs, so keep
+<Bits> to about 24 or less.
+
+To try this out on one machine, run the shards as separate local processes:
+    for k in 0 1 2 3; do
+        sharded_cooccur.py shard -i 'abstracts*.txt' -V vocab.txt -k $k -K 4 -p part$k.npz &
+    done; wait
+    sharded_cooccur.py reduce -V vocab.txt -o topics.txt part*.npz
+"""
+
+from argparse import ArgumentParser
+from collections import Counter
+from glob import glob
+import sys
+
+from compressed_io import open_text
+from corpus import check_anchor_candidates, is_word, read_stopwords, read_vocabulary, write_vocabulary
+from topic_output import open_output, write_topics
+#scipy, and the modules using it (anchor_model, cooccurrence, disk_matrix), are
+# imported by the functions that need them, so that vocab doesn't load them.
+
+
+def GetCmdLineParameters():
+    """Return the parsed command line args."""
+    parser = ArgumentParser(description="Compute cooccurrence statistics in shards, and build a topic model from them")
+    Subparsers = parser.add_subparsers(dest="sCommand")
+    Subparsers.required = True
+
+    VocabParser = Subparsers.add_parser("vocab", help="Build the shared vocabulary file")
+    ShardParser = Subparsers.add_parser("shard", help="Compute the partial sums for one shard")
+    ReduceParser = Subparsers.add_parser("reduce", help="Add partial sums and output topics")
+    for SubParser in (VocabParser, ShardParser, ReduceParser):
+        SubParser.add_argument( "-V", "--Vocabulary"
+                              , dest    = "sVocabFName"
+                              , metavar = "<VocabFile>"
+                              , required = SubParser is VocabParser
+                              , help    = "Vocabulary file shared by all shards"
+                              )
+    for SubParser in (ShardParser, ReduceParser):
+        SubParser.add_argument( "--hash-features"
+                              , type    = int
+                              , dest    = "iHashBits"
+                              , metavar = "<Bits>"
+                              , default = None
+                              , help    = "Map words to 2**Bits rows by hashing, rather than using a vocabulary file"
+                              )
+    for SubParser in (VocabParser, ShardParser):
+        SubParser.add_argument( "-i", "--InputGlob"
+                              , dest    = "sInputGlob"
+                              , metavar = "<InputGlob>"
+                              , required = True
+                              , help    = "Glob of files to read (quote if contains wildcards)"
+                              )
+    for SubParser in (VocabParser, ShardParser):
+        SubParser.add_argument( "-s", "--StopWordsFile"
+                              , dest    = "sStopWordsFName"
+                              , metavar = "<StopWordsFileName>"
+                              , default = 'stopwords.txt'
+                              , help    = "Filename of stop words (for shard, with --hash-features)"
+                              )
+        SubParser.add_argument( "-l", "--MinWordLength"
+                              , type    = int
+                              , dest    = "iMinWordLength"
+                              , metavar = "<MinWordLength>"
+                              , default = 2
+                              , help    = "Minimum length of tokens, in characters (for shard, with --hash-features)"
+                              )
+    ShardParser.add_argument( "-k", "--Shard"
+                            , type    = int
+                            , dest    = "iShard"
+                            , metavar = "<ShardIndex>"
+                            , required = True
+                            , help    = "Index of this shard, from 0 to NumShards-1"
+                            )
+    ShardParser.add_argument( "-K", "--NumShards"
+                            , type    = int
+                            , dest    = "iShards"
+                            , metavar = "<NumShards>"
+                            , required = True
+                            , help    = "Total number of shards"
+                            )
+    ShardParser.add_argument( "-f", "--ByFile"
+                            , dest    = "bByFile"
+                            , action  = "store_true"
+                            , default = False
+                            , help    = "Shard by file rather than by abstract"
+                            )
+    ShardParser.add_argument( "-L", "--ByLines"
+                            , dest    = "bByLines"
+                            , action  = "store_true"
+                            , default = False
+                            , help    = "Shard by contiguous ranges of abstracts, using line indexes"
+                            )
+    ShardParser.add_argument( "-p", "--Partial"
+                            , dest    = "sPartialFName"
+                            , metavar = "<PartialFile>"
+                            , required = True
+                            , help    = "File to write this shard's partial sums to"
+                            )
+    ShardParser.add_argument( "-C", "--CoDocs"
+                            , dest    = "bCoDocs"
+                            , action  = "store_true"
+                            , default = False
+                            , help    = "Also count the documents each word pair cooccurs in (needed for reduce -P)"
+                            )
+    ShardParser.add_argument( "-c", "--ChunkSize"
+                            , type    = int
+                            , dest    = "iChunkColumns"
+                            , metavar = "<ChunkSize>"
+                            , default = None
+                            , help    = "Number of documents per chunk, default 10,000"
+                            )
+    ReduceParser.add_argument( "Partials"
+                             , metavar = "<PartialFile>"
+                             , nargs   = "+"
+                             , help    = "Partial sums written by the shards"
+                             )
+    ReduceParser.add_argument( "-o", "--output"
+                             , dest    = "sOutFileName"
+                             , metavar = "<OutFileName>"
+                             , default = "stdout"
+                             , help    = "Takes arg <OutputFile>. Optional, defaults to stdout."
+                             )
+    ReduceParser.add_argument( "-x", "--excel"
+                             , dest    = "bExcel"
+                             , action  = "store_true"
+                             , default = False
+                             , help    = "Optional; if used, output in Excel format"
+                             )
+    ReduceParser.add_argument( "-a", "--NumAnchors"
+                             , type    = int
+                             , dest    = "iNumAnchors"
+                             , metavar = "<NumberOfAnchors>"
+                             , default = 50
+                             , help    = "Number of anchors to create"
+                             )
+    ReduceParser.add_argument( "-w", "--NumWords"
+                             , type    = int
+                             , dest    = "iNumWords"
+                             , metavar = "<NumberOfWords>"
+                             , default = 20
+                             , help    = "Number of words to output for each topic"
+                             )
+    ReduceParser.add_argument( "-S", "--SparseQ"
+                             , dest    = "bSparseQ"
+                             , action  = "store_true"
+                             , default = False
+                             , help    = "Optional; if used, keep the cooccurrence matrix sparse"
+                             )
+    ReduceParser.add_argument( "-P", "--MinCoDocs"
+                             , type    = int
+                             , dest    = "iMinCoDocs"
+                             , metavar = "<MinCoDocs>"
+                             , default = 1
+                             , help    = "With -S, minimum number of documents a word pair must cooccur in to be kept"
+                             )
+    ReduceParser.add_argument( "--anchor-threshold"
+                             , type    = float
+                             , dest    = "fAnchorThreshold"
+                             , metavar = "<AnchorThreshold>"
+                             , default = 0.01
+                             , help    = "Minimum fraction of abstracts a word must occur in to be an anchor candidate"
+                             )
+    args = parser.parse_args()
+    if args.sCommand == 'shard' and not (0 <= args.iShard < args.iShards):
+        sys.stderr.write("Shard index must be between 0 and %i.\n" %(args.iShards - 1))
+        exit(1)
+    if args.sCommand == 'shard' and args.bByFile and args.bByLines:
+        sys.stderr.write("Shard by file (-f) or by lines (-L), not both.\n")
+        exit(1)
+    if args.sCommand != 'vocab' and (args.sVocabFName is None) == (args.iHashBits is None):
+        sys.stderr.write("Give either a vocabulary file (-V) or --hash-features, not both.\n")
+        exit(1)
+    if args.sCommand != 'vocab' and args.iHashBits is not None and not (1 <= args.iHashBits <= 30):
+        sys.stderr.write("--hash-features takes between 1 and 30 bits.\n")
+        exit(1)
+    if args.sCommand == 'reduce' and args.iMinCoDocs > 1 and not args.bSparseQ:
+        sys.stderr.write("Pruning word pairs (-P) requires a sparse cooccurrence matrix (-S).\n")
+        exit(1)
+    return args
+
+
+def input_files(sInputGlob):
+    """Return the (sorted) list of files matching a glob; exits if there are none."""
+    PathList = sorted(glob(sInputGlob))
+    if not PathList:
+        sys.stderr.write("No files match '%s'\n" %sInputGlob)
+        exit(1)
+    return PathList
+
+
+def build_vocabulary(PathList, iMinWordLength, StopWords):
+    """Return the sorted list of all words in the corpus."""
+    Words = set()
+    for sFileName in PathList:
+        with open_text(sFileName) as strFile:
+            for sAbstract in strFile:
+                NewWords = set(sAbstract.strip().split(' ')[1:]) - StopWords
+                Words.update(sToken for sToken in NewWords
+                             if is_word(sToken, iMinWordLength))
+    return sorted(Words)
+
+
+def shard_abstracts(PathList, iShard, iShards, bByFile, bByLines=False):
+    """Yield the lines (abstracts) of the corpus which belong to the given shard."""
+    if bByLines:
+        from line_index import CorpusIndex
+        Corpus = CorpusIndex(PathList)
+        for _, _, sAbstract in Corpus.read(Corpus.shard(iShard, iShards)):
+            yield sAbstract
+        return
+    iLine = 0
+    for iFile, sFileName in enumerate(PathList):
+        if bByFile and iFile % iShards != iShard:
+            continue
+        with open_text(sFileName) as strFile:
+            for sAbstract in strFile:
+                if bByFile or iLine % iShards == iShard:
+                    yield sAbstract
+                iLine += 1
+
+
+def accumulate_shard(Abstracts, Words, iChunkColumns, bCoDocs=False, Hasher=None,
+                     StopWords=frozenset(), iMinWordLength=2):
+    """
+    Compute the cooccurrence sums for a sequence of abstracts.
+
+    Args:
+        Abstracts: iterable of lines (document ID followed by tokens)
+        Words (list of str): the shared vocabulary; other tokens are ignored
+        iChunkColumns: number of documents to collect before adding them to
+            the sums (None for disk_matrix.iDEFAULT_CHUNK_COLUMNS)
+        bCoDocs: also count the documents each pair of words cooccurs in
+        Hasher (feature_hashing.FeatureHasher): if given, Words is ignored,
+            and each token not in StopWords and of at least iMinWordLength
+            characters gets the row of its hash bucket, of all of Hasher's
+            buckets; Hasher keeps the buckets' labels.
+    Returns:
+        cooccurrence.CooccurrenceSums (with sparse word-word sums)
+    """
+    from scipy import sparse
+    from cooccurrence import CooccurrenceSums
+    from disk_matrix import iDEFAULT_CHUNK_COLUMNS
+    iChunkColumns = iChunkColumns or iDEFAULT_CHUNK_COLUMNS
+    if Hasher is None:
+        WordIndex = {sWord: iWord for iWord, sWord in enumerate(Words)}
+        iWords = len(Words)
+    else:
+        iWords = Hasher.iMask + 1
+    Sums = CooccurrenceSums(iWords, bSparse=True, bCoDocs=bCoDocs)
+    Indices, Counts, Indptr = [], [], [0]
+    def add_chunk():
+        Sums.add_chunk(sparse.csc_matrix((Counts, Indices, Indptr),
+                                         shape=(iWords, len(Indptr) - 1)))
+    for sAbstract in Abstracts:
+        if Hasher is None:
+            WordCounts = Counter(WordIndex[sToken] for sToken in sAbstract.strip().split(' ')[1:]
+                                 if sToken in WordIndex)
+        else:
+            WordCounts = Counter()
+            for sToken, iCount in Counter(sAbstract.strip().split(' ')[1:]).items():
+                if sToken not in StopWords and is_word(sToken, iMinWordLength):
+                    WordCounts[Hasher.add(sToken)] += iCount
+        Indices.extend(WordCounts.keys())
+        Counts.extend(WordCounts.values())
+        Indptr.append(len(Indices))
+        if len(Indptr) > iChunkColumns:
+            add_chunk()
+            Indices, Counts, Indptr = [], [], [0]
+    if len(Indptr) > 1:
+        add_chunk()
+    return Sums
+
+
+def reduce_partials(PartialFNames, iWords, sFingerprint, bCoDocs=False):
+    """
+    Add the partial sums from a list of files; exits if any doesn't match the
+    vocabulary, or (if bCoDocs) lacks co-document counts.
+    """
+    from cooccurrence import CooccurrenceSums
+    Total = None
+    for sPartialFName in PartialFNames:
+        try:
+            Sums, sPartialFingerprint = CooccurrenceSums.load(sPartialFName)
+        except (FileNotFoundError, PermissionError, IOError, KeyError, ValueError):
+            sys.stderr.write("Unable to read partial sums file '%s'\n" %sPartialFName)
+            exit(1)
+        if sPartialFingerprint != sFingerprint or Sums.iWords != iWords:
+            sys.stderr.write("Partial sums file '%s' was computed with a different vocabulary\n"
+                %sPartialFName)
+            exit(1)
+        if bCoDocs and Sums.CoDocs is None:
+            sys.stderr.write("Partial sums file '%s' has no co-document counts (use shard -C)\n"
+                %sPartialFName)
+            exit(1)
+        if Total is None:
+            Total = Sums
+        else:
+            Total.add(Sums)
+    return Total
+
+
+def hashed_fingerprint(iHashBits):
+    """Return the fingerprint of partial sums computed with --hash-features."""
+    return 'hashed, %i bits' %iHashBits
+
+
+def reduce_hashers(PartialFNames, iHashBits):
+    """Merge the FeatureHasher's saved with hashed partial sums."""
+    import numpy
+    from feature_hashing import FeatureHasher
+    Hasher = FeatureHasher(iHashBits)
+    for sPartialFName in PartialFNames:
+        with numpy.load(sPartialFName) as Arrays:
+            Hasher.merge(FeatureHasher.from_arrays(Arrays))
+    return Hasher
+
+
+def reduce_hashed_partials(PartialFNames, iHashBits, bCoDocs=False):
+    """
+    Add hashed partial sums (see reduce_partials()), and drop the buckets no
+    word fell in.  Returns (Words, CooccurrenceSums): the labels of the
+    buckets kept (see feature_hashing.py), and the sums over them.
+    """
+    import numpy
+    Sums = reduce_partials(PartialFNames, 2 ** iHashBits, hashed_fingerprint(iHashBits), bCoDocs)
+    Hasher = reduce_hashers(PartialFNames, iHashBits)
+    sys.stderr.write(Hasher.report())
+    Used = numpy.array(sorted(Hasher.Forms), dtype=numpy.int64)
+    return [Hasher.label(iBucket) for iBucket in Used], Sums.compact(Used)
+
+
+
+if __name__ == '__main__':
+    args = GetCmdLineParameters()
+    if args.sCommand == 'vocab':
+        Words = build_vocabulary(input_files(args.sInputGlob), args.iMinWordLength,
+                                 read_stopwords(args.sStopWordsFName))
+        write_vocabulary(Words, args.sVocabFName)
+        sys.stderr.write("Wrote %i words to %s\n" %(len(Words), args.sVocabFName))
+    elif args.sCommand == 'shard':
+        Abstracts = shard_abstracts(input_files(args.sInputGlob), args.iShard, args.iShards,
+                                    args.bByFile, args.bByLines)
+        if args.iHashBits:
+            from feature_hashing import FeatureHasher
+            Hasher = FeatureHasher(args.iHashBits)
+            Sums = accumulate_shard(Abstracts, None, args.iChunkColumns, args.bCoDocs, Hasher,
+                                    read_stopwords(args.sStopWordsFName), args.iMinWordLength)
+            Sums.save(args.sPartialFName, hashed_fingerprint(args.iHashBits), Hasher.to_arrays())
+        else:
+            Words, sFingerprint = read_vocabulary(args.sVocabFName)
+            Sums = accumulate_shard(Abstracts, Words, args.iChunkColumns, args.bCoDocs)
+            Sums.save(args.sPartialFName, sFingerprint)
+        sys.stderr.write("Shard %i of %i: %i abstracts\n" %(args.iShard, args.iShards, Sums.iDocs))
+    else: #reduce
+        from anchor_model import model_topics_from_sums
+        strOut = open_output(args.sOutFileName, args.bExcel)
+        if args.iHashBits:
+            Words, Sums = reduce_hashed_partials(args.Partials, args.iHashBits, args.iMinCoDocs > 1)
+        else:
+            Words, sFingerprint = read_vocabulary(args.sVocabFName)
+            Sums = reduce_partials(args.Partials, len(Words), sFingerprint, args.iMinCoDocs > 1)
+        sys.stderr.write("Read %i abstracts, containing %i Words.\n" %(Sums.iDocs, len(Words)))
+        check_anchor_candidates(Sums.DocFreqs, Sums.iDocs, args.fAnchorThreshold, args.iNumAnchors)
+        matrixWordTopic, matrixWordCoocur, Anchors = \
+            model_topics_from_sums(Sums, args.iNumAnchors, args.fAnchorThreshold, bSparseQ=args.bSparseQ,
+                                   iMinCoDocs=args.iMinCoDocs)
+        write_topics(strOut, args.bExcel, Words, Anchors, matrixWordTopic, args.iNumWords)
+        strOut.close()
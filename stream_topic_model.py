@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+"""
+Build a topic model straight from the PubMed abstract tree, without writing
+and re-reading a tokenized corpus file.  Combines prepare_pubmed_subset.py
+(extraction) with build_topic_model.py (vocabulary, word-document matrix and
+topics): a worker process reads and tokenizes the abstracts and passes them, in
+batches, through a bounded queue to this process, which interns the words and
+accumulates the matrix as they arrive, so that extraction and counting overlap.
+The vocabulary is built in the same pass as the matrix (rather than in a pass
+of its own, as build_topic_model.py does), so each abstract is read once.
+
+Command line arguments:
+     -r <dir>    Root directory for PubMed abstracts
+     -f <float>  Fraction of the abstracts to use, default 1 (see
+                 prepare_pubmed_subset.py for how they are selected)
+     -e <int>    Seed for the sampling hash, default 0
+     -m [<fname>]
+                 Take the list of abstract files from a manifest, as for
+                 prepare_pubmed_subset.py
+     -t <fname>  Also write the tokenized abstracts to <fname>, in the format
+                 read by build_topic_model.py (optional)
+     -q <int>    Maximum number of batches of abstracts waiting in the queue,
+                 default 64
+     -o, -x, -s, -l, -a, -w, -S, -P, -R, -c, -D, -E, --anchor-threshold,
+     --recovery-cache, --recovery-tolerance, --dedup-report
+                 As for build_topic_model.py (near-duplicates removed by -D are
+                 not written to the -t file either)
+
+The topics are the same as those build_topic_model.py finds in the file that
+prepare_pubmed_subset.py would write for the same fraction and seed, provided
+build_topic_model.py reads the whole file: that is, its -n (default 12,000) is
+at least the number of abstracts in it.  This script has no such limit; it
+uses every abstract selected (use -f to take fewer).
+"""
+
+from argparse import ArgumentParser
+from array import array
+import multiprocessing
+from pathlib import Path
+import queue
+import sys
+
+from build_topic_model import compute_topics
+from compressed_io import open_text
+from corpus import check_anchor_candidates, is_word, read_stopwords
+from prepare_pubmed_subset import extract_abstracts
+from topic_output import open_output, write_topics
+
+
+iBATCH_ABSTRACTS = 256 #Abstracts per queue item
+
+
+def GetCmdLineParameters():
+    """Return the parsed command line args."""
+    parser = ArgumentParser(description="Build a topic model straight from the PubMed abstract tree")
+    parser.add_argument( "-r", "--RootDir"
+                       , dest    = "sRootDir"
+                       , default = '/groups/identdata/topictracking/pubmed/abstracts/'
+                       , help    = "Root directory for PubMed abstracts"
+                       )
+    parser.add_argument( "-f", "--Fraction"
+                       , type    = float
+                       , dest    = "fFraction"
+                       , metavar = "<Fraction>"
+                       , default = 1.0
+                       , help    = "Fraction of the abstracts to use, default 1"
+                       )
+    parser.add_argument( "-e", "--Seed"
+                       , type    = int
+                       , dest    = "iSeed"
+                       , default = 0
+                       , help    = "Seed for the sampling hash, default 0"
+                       )
+    parser.add_argument( "-m", "--Manifest"
+                       , dest    = "sManifestFName"
+                       , nargs   = "?"
+                       , const   = ""
+                       , default = None
+                       , help    = "Take the list of abstract files from a manifest (see pubmed_manifest.py)"
+                       )
+    parser.add_argument( "-t", "--TokensFile"
+                       , dest    = "sTokensFName"
+                       , metavar = "<TokensFile>"
+                       , default = None
+                       , help    = "Optional; also write the tokenized abstracts to this file"
+                       )
+    parser.add_argument( "-q", "--QueueSize"
+                       , type    = int
+                       , dest    = "iQueueBatches"
+                       , metavar = "<QueueSize>"
+                       , default = 64
+                       , help    = "Maximum number of batches of abstracts in the queue, default 64"
+                       )
+    parser.add_argument( "-o", "--output"
+                       , dest    = "sOutFileName"
+                       , default = "stdout"
+                       , help    = "Takes arg <OutputFile>. Optional, defaults to stdout."
+                       )
+    parser.add_argument( "-x", "--Excel"
+                       , dest    = "bExcel"
+                       , action  = "store_true"
+                       , default = False
+                       , help    = "Optional; if used, output to Excel format"
+                       )
+    parser.add_argument( "-s", "--StopWordsFile"
+                       , dest    = "sStopWordsFName"
+                       , metavar = "<StopWordsFileName>"
+                       , default = 'stopwords.txt'
+                       , help    = "Filename of stop words"
+                       )
+    parser.add_argument( "-l", "--MinWordLength"
+                       , type    = int
+                       , dest    = "iMinWordLength"
+                       , metavar = "<MinWordLength>"
+                       , default = 2
+                       , help    = "Minimum length of tokens, in characters"
+                       )
+    parser.add_argument( "-a", "--NumAnchors"
+                       , type    = int
+                       , dest    = "iNumAnchors"
+                       , metavar = "<NumberOfAnchors>"
+                       , default = 50
+                       , help    = "Number of anchors (topics)"
+                       )
+    parser.add_argument( "-w", "--NumWords"
+                       , type    = int
+                       , dest    = "iNumWords"
+                       , metavar = "<NumberOfWords>"
+                       , default = 20
+                       , help    = "Number of words to output for each topic"
+                       )
+    parser.add_argument( "-S", "--SparseQ"
+                       , dest    = "bSparseQ"
+                       , action  = "store_true"
+                       , default = False
+                       , help    = "Optional; if used, keep the cooccurrence matrix sparse"
+                       )
+    parser.add_argument( "-P", "--MinCoDocs"
+                       , type    = int
+                       , dest    = "iMinCoDocs"
+                       , metavar = "<MinCoDocs>"
+                       , default = 1
+                       , help    = "With -S, minimum number of documents a word pair must cooccur in to be kept"
+                       )
+    parser.add_argument( "-R", "--CandidateRows"
+                       , dest    = "bCandidateRows"
+                       , action  = "store_true"
+                       , default = False
+                       , help    = "Optional; if used, compute only the anchor candidates' rows of the cooccurrence matrix"
+                       )
+    parser.add_argument( "-c", "--ChunkSize"
+                       , type    = int
+                       , dest    = "iChunkColumns"
+                       , metavar = "<ChunkSize>"
+                       , default = None
+                       , help    = "Number of documents per chunk for sparse cooccurrences (-S), default 10,000"
+                       )
+    parser.add_argument( "--anchor-threshold"
+                       , type    = float
+                       , dest    = "fAnchorThreshold"
+                       , metavar = "<AnchorThreshold>"
+                       , default = 0.01
+                       , help    = "Minimum fraction of abstracts a word must occur in to be an anchor candidate"
+                       )
+    parser.add_argument( "--recovery-cache"
+                       , dest    = "sRecoveryCacheDir"
+                       , metavar = "<RecoveryCacheDir>"
+                       , default = None
+                       , help    = "Optional; directory in which to cache topic recovery solutions"
+                       )
+    parser.add_argument( "--recovery-tolerance"
+                       , type    = float
+                       , dest    = "fRecoveryTolerance"
+                       , metavar = "<RecoveryTolerance>"
+                       , default = None
+                       , help    = "Convergence tolerance of the topic recovery (default 2e-7)"
+                       )
+    parser.add_argument( "-E", "--Evaluate"
+                       , dest    = "bEvaluate"
+                       , action  = "store_true"
+                       , default = False
+                       , help    = "Optional; if used, add topic coherence and overlap measures to the output"
+                       )
+    parser.add_argument( "-D", "--Dedup"
+                       , type    = float
+                       , dest    = "fDedupThreshold"
+                       , metavar = "<DedupThreshold>"
+                       , default = None
+                       , help    = "Optional; drop abstracts at least this similar to an earlier one"
+                       )
+    parser.add_argument( "--dedup-report"
+                       , dest    = "sDedupReportFName"
+                       , metavar = "<DedupReportFile>"
+                       , default = "stderr"
+                       , help    = "With -D, file to list the dropped abstracts in, defaults to stderr"
+                       )
+    args = parser.parse_args()
+    if not Path(args.sRootDir).is_dir(): #Does not check permissions
+        sys.stderr.write("Directory %s does not appear to exist.\n" %args.sRootDir)
+        exit(1)
+    if not (0 < args.fFraction <= 1):
+        sys.stderr.write("Fraction must be between 0 and 1.\n")
+        exit(1)
+    if not (0 <= args.fAnchorThreshold <= 1):
+        sys.stderr.write("Anchor threshold must be between 0 and 1.\n")
+        exit(1)
+    if args.fDedupThreshold is not None and not (0 < args.fDedupThreshold <= 1):
+        sys.stderr.write("Dedup threshold must be between 0 and 1.\n")
+        exit(1)
+    if args.iMinCoDocs > 1 and not args.bSparseQ:
+        sys.stderr.write("Pruning word pairs (-P) requires a sparse cooccurrence matrix (-S).\n")
+        exit(1)
+    if args.iQueueBatches < 1:
+        sys.stderr.write("Queue size must be at least 1.\n")
+        exit(1)
+    return args
+
+
+def extract_batches(QueueOut, sRootDir, fFraction, iSeed, sManifestFName):
+    """
+    Worker: put the abstracts selected by extract_abstracts() on QueueOut, as
+    lists of up to iBATCH_ABSTRACTS (iPMID, Tokens) tuples, followed by None
+    (also if extraction fails, so that the consumer never waits forever).
+    """
+    try:
+        Batch = []
+        for iPMID, _, Tokens in extract_abstracts(sRootDir, fFraction, iSeed, sManifestFName):
+            Batch.append((iPMID, Tokens))
+            if len(Batch) >= iBATCH_ABSTRACTS:
+                QueueOut.put(Batch)
+                Batch = []
+        if Batch:
+            QueueOut.put(Batch)
+    finally:
+        QueueOut.put(None)
+
+
+def stream_abstracts(sRootDir, fFraction=1.0, iSeed=0, sManifestFName=None, iQueueBatches=64):
+    """
+    Yield (iPMID, Tokens) for the abstracts selected by extract_abstracts(),
+    which runs in a worker process, so that extraction overlaps with whatever
+    the caller does with them.  Exits if the worker fails.
+    """
+    QueueIn = multiprocessing.Queue(iQueueBatches)
+    Worker = multiprocessing.Process(target=extract_batches,
+                                     args=(QueueIn, sRootDir, fFraction, iSeed, sManifestFName))
+    Worker.start()
+    try:
+        while True:
+            try:
+                Batch = QueueIn.get(timeout=1)
+            except queue.Empty:
+                if not Worker.is_alive() and QueueIn.empty():
+                    break #Died without even putting its end marker
+                continue
+            if Batch is None:
+                break
+            yield from Batch
+    finally:
+        if Worker.is_alive():
+            Worker.terminate() #The caller stopped early
+        Worker.join()
+    if Worker.exitcode:
+        sys.stderr.write("Extraction failed (exit code %i)\n" %Worker.exitcode)
+        exit(1)
+
+
+def accumulate_matrix(Abstracts, iMinWordLength, StopWords=set(), strTokens=None):
+    """
+    Build the vocabulary and word-document matrix in one pass over a stream of
+    tokenized abstracts, interning each word as it is first seen.
+
+    Args:
+        Abstracts: iterable of (iPMID, Tokens)
+        iMinWordLength, StopWords: as for
+            build_topic_model.get_words_and_documents()
+        strTokens: if given, also write each abstract to this stream, in the
+            format of prepare_pubmed_subset.py
+
+    Returns:
+        (Words, Docs, DocFreqs, matrixWordDoc), as returned by
+        build_topic_model.get_words_and_documents() and build_matrix(): the
+        words are sorted, and each abstract has a column, in the order read.
+    """
+    import numpy
+    from scipy import sparse
+    from string_store import StringStore, StringStoreBuilder
+    WordIndex = {} #Word -> row, in order of first occurrence
+    Docs = StringStoreBuilder()
+    Indices, Counts, Indptr = array('i'), array('i'), array('q', [0])
+    Rejected = set(StopWords) #Tokens known not to be words
+    for iPMID, Tokens in Abstracts:
+        if strTokens is not None:
+            strTokens.write('{:08d} {}\n'.format(iPMID, ' '.join(Tokens)))
+        Docs.append('{:08d}'.format(iPMID))
+        WordCounts = {}
+        for sToken in Tokens:
+            iWord = WordIndex.get(sToken)
+            if iWord is None:
+                if sToken in Rejected:
+                    continue
+                if not is_word(sToken, iMinWordLength):
+                    Rejected.add(sToken)
+                    continue
+                iWord = WordIndex[sToken] = len(WordIndex)
+            WordCounts[iWord] = WordCounts.get(iWord, 0) + 1
+        Indices.extend(WordCounts.keys())
+        Counts.extend(WordCounts.values())
+        Indptr.append(len(Indices))
+    #Renumber the rows in sorted word order, as build_topic_model.py does:
+    Words = sorted(WordIndex)
+    Renumber = numpy.empty(len(Words), dtype=numpy.int32)
+    Renumber[[WordIndex[sWord] for sWord in Words]] = numpy.arange(len(Words), dtype=numpy.int32)
+    matrixWordDoc = sparse.csc_matrix((numpy.frombuffer(Counts, dtype=numpy.int32).astype(int),
+                                       Renumber[numpy.frombuffer(Indices, dtype=numpy.int32)],
+                                       numpy.frombuffer(Indptr, dtype=numpy.int64)),
+                                      shape=(len(Words), len(Docs)))
+    matrixWordDoc.sort_indices()
+    DocFreqs = numpy.diff(matrixWordDoc.tocsr().indptr).tolist()
+    return StringStore.from_strings(Words), Docs.finish(), DocFreqs, matrixWordDoc
+
+
+
+if __name__ == '__main__':
+    args = GetCmdLineParameters()
+    StopWords = read_stopwords(args.sStopWordsFName)
+    strOut = open_output(args.sOutFileName, args.bExcel)
+    strTokens = open_text(args.sTokensFName, 'w') if args.sTokensFName else None
+    Abstracts = stream_abstracts(args.sRootDir, args.fFraction, args.iSeed, args.sManifestFName,
+                                 args.iQueueBatches)
+    if args.fDedupThreshold is not None:
+        from dedup import NearDuplicateFilter
+        Dedup = NearDuplicateFilter(args.fDedupThreshold)
+        Abstracts = Dedup.filter(Abstracts)
+    Words, Docs, DocFreqs, matrixWordDoc = accumulate_matrix(Abstracts, args.iMinWordLength,
+                                                             StopWords, strTokens)
+    if strTokens is not None:
+        strTokens.close()
+    if args.fDedupThreshold is not None:
+        if args.sDedupReportFName == 'stderr':
+            Dedup.write_report(sys.stderr)
+        else:
+            with open(args.sDedupReportFName, 'w', encoding='utf-8') as strReport:
+                Dedup.write_report(strReport)
+    sys.stderr.write("Read %i abstracts, containing %i Words.\n" %(len(Docs), len(Words)))
+    check_anchor_candidates(DocFreqs, len(Docs), args.fAnchorThreshold, args.iNumAnchors)
+    matrixWordTopic, matrixWordCoocur, Anchors = \
+        compute_topics(matrixWordDoc, Words, DocFreqs, args.iNumAnchors, args.fAnchorThreshold,
+                       args.iChunkColumns, args.bSparseQ, args.iMinCoDocs, args.bCandidateRows,
+                       args.sRecoveryCacheDir, args.fRecoveryTolerance)
+    Metrics = None
+    if args.bEvaluate:
+        from topic_quality import evaluate_topics, summary
+        Metrics = evaluate_topics(matrixWordDoc, Anchors, matrixWordTopic, args.iNumWords)
+        sys.stderr.write("Topic quality: %s\n" %summary(Metrics))
+    write_topics(strOut, args.bExcel, Words, Anchors, matrixWordTopic, args.iNumWords, Metrics)
+    strOut.close()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+Compact store of a list of strings, with lookup of a string's position, for
+corpora where Python's own containers cost too much: a list of millions of
+document IDs, plus a dict mapping each back to its position, takes well over a
+hundred bytes per ID in object overhead, for IDs of about eight characters.
+The document IDs are what this saves memory on: they are collected straight
+into a store.  The vocabulary (far smaller) is still counted in a dict while
+it is collected, and indexed by a dict for lookups (see below), so its peak
+memory is no less than before; it is kept in a store for saving, sharing and
+reloading.
+
+The strings are kept in one contiguous buffer of their UTF-8 encodings, with an
+array of offsets into it; lookup is by a hash table (open addressing with
+linear probing on the CRC-32 of the encoding) of positions in the list.  So a
+store of n strings of average length L bytes takes L + 8 bytes per string,
+plus 16 to 32 for the table (8-byte entries, at most half of them full); and
+the store is saved as three arrays in a directory:
+    strings.npy  uint8, the strings' UTF-8 encodings, concatenated
+    offsets.npy  int64, n + 1 entries: string i is strings[offsets[i]:offsets[i+1]]
+    slots.npy    int64, the hash table: 0 for an empty slot, else 1 + the
+                 position of a string whose hash starts its probe sequence
+                 at or before the slot
+These are standard .npy files (as in disk_matrix.py), so a saved store is
+memory-mapped when loaded, costing nothing to reload however big it is, and
+its pages are shared by all the processes that load it.
+
+If a string occurs more than once in the list, looking it up gives its last
+position (as a dict built from the list would).
+
+Lookup is done in Python, a few microseconds each, ten or more times slower
+than a dict.  So a store suits lookups once per document (e.g. of its ID), but
+for lookups once per token, index the vocabulary (which is small) with a dict
+built from the store, as build_matrix() does, and keep the store for saving,
+sharing and reloading it.
+"""
+
+from array import array
+from pathlib import Path
+import zlib
+
+import numpy
+
+
+ARRAYS = ('strings', 'offsets', 'slots')
+
+
+def build_slots(Hashes):
+    """
+    Return a hash table (see module documentation) for strings with the given
+    hashes (numpy uint32 array), with at least twice as many slots as strings.
+
+    All the strings are placed at once, in rounds: in each round, every string
+    not yet placed tries the next slot of its probe sequence, and where several
+    try the same empty slot, the one latest in the list gets it.  A string is
+    only ever placed after all the slots before it in its probe sequence are
+    full, so lookup (which stops at an empty slot) finds it; and of several
+    copies of a string, which move in step, the last is found first.
+    """
+    iSlots = 2 ** max(int(2 * len(Hashes)).bit_length(), 4)
+    iMask = iSlots - 1
+    Slots = numpy.zeros(iSlots, dtype=numpy.int64)
+    Waiting = numpy.arange(len(Hashes) - 1, -1, -1, dtype=numpy.int64) #Latest first
+    Probe = Hashes[Waiting].astype(numpy.int64) & iMask
+    while len(Waiting):
+        Free = Slots[Probe] == 0
+        #The first (so latest in the list) string trying each free slot gets it:
+        _, First = numpy.unique(Probe[Free], return_index=True)
+        Placed = numpy.flatnonzero(Free)[First]
+        Slots[Probe[Placed]] = Waiting[Placed] + 1
+        Keep = numpy.ones(len(Waiting), dtype=bool)
+        Keep[Placed] = False
+        Waiting = Waiting[Keep]
+        Probe = (Probe[Keep] + 1) & iMask
+    return Slots
+
+
+class StringStoreBuilder:
+    """
+    Collect strings one at a time (with append()), without keeping them as
+    objects, and then make them into a StringStore (with finish()).
+    """
+    def __init__(self):
+        self.Buffer = bytearray()
+        self.Ends = array('q')
+        self.Hashes = array('L')
+
+    def append(self, sString):
+        sBytes = sString.encode('utf-8')
+        self.Buffer += sBytes
+        self.Ends.append(len(self.Buffer))
+        self.Hashes.append(zlib.crc32(sBytes))
+
+    def __len__(self):
+        return len(self.Ends)
+
+    def finish(self):
+        Offsets = numpy.zeros(len(self.Ends) + 1, dtype=numpy.int64)
+        Offsets[1:] = self.Ends
+        return StringStore(numpy.frombuffer(self.Buffer, dtype=numpy.uint8), Offsets,
+                           build_slots(numpy.array(self.Hashes, dtype=numpy.uint32)))
+
+
+class StringStore:
+    """
+    A list of strings, stored compactly (see module documentation).  Supports
+    len(), indexing and iteration, as for a list of str, and index() and 'in'
+    for lookup.  Build one with from_strings() or a StringStoreBuilder, or load
+    a saved one with load().
+    """
+    def __init__(self, Strings, Offsets, Slots):
+        self.Strings = Strings
+        self.Offsets = Offsets
+        self.Slots = Slots
+        self.iMask = len(Slots) - 1
+
+    @classmethod
+    def from_strings(cls, Strings):
+        """Build a store from an iterable of str."""
+        Builder = StringStoreBuilder()
+        for sString in Strings:
+            Builder.append(sString)
+        return Builder.finish()
+
+    @classmethod
+    def load(cls, sDir, bMemoryMap=True):
+        """Load a store saved in directory sDir, memory-mapped unless bMemoryMap is False."""
+        Dir = Path(sDir)
+        return cls(*[numpy.load(str(Dir / (sName + '.npy')), mmap_mode='r' if bMemoryMap else None)
+                     for sName in ARRAYS])
+
+    def save(self, sDir):
+        """Save the store in directory sDir (created if need be)."""
+        Dir = Path(sDir)
+        Dir.mkdir(parents=True, exist_ok=True)
+        for sName, Values in zip(ARRAYS, (self.Strings, self.Offsets, self.Slots)):
+            numpy.save(str(Dir / (sName + '.npy')), Values)
+
+    def __len__(self):
+        return len(self.Offsets) - 1
+
+    def _bytes(self, i):
+        return self.Strings[self.Offsets[i] : self.Offsets[i + 1]].tobytes()
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("StringStore index out of range")
+        return self._bytes(i).decode('utf-8')
+
+    def __iter__(self):
+        #Decode a block of strings at a time, rather than slicing for each:
+        iBlock = 65536
+        for iStart in range(0, len(self), iBlock):
+            Offsets = self.Offsets[iStart : iStart + iBlock + 1]
+            sBytes = self.Strings[Offsets[0] : Offsets[-1]].tobytes()
+            Offsets = (Offsets - Offsets[0]).tolist()
+            for iFrom, iTo in zip(Offsets, Offsets[1:]):
+                yield sBytes[iFrom:iTo].decode('utf-8')
+
+    def index(self, sString, iDefault=-1):
+        """Return the (last) position of sString, or iDefault if it isn't in the store."""
+        sBytes = sString.encode('utf-8')
+        iSlot = zlib.crc32(sBytes) & self.iMask
+        while True:
+            iEntry = int(self.Slots[iSlot])
+            if iEntry == 0:
+                return iDefault
+            if self._bytes(iEntry - 1) == sBytes:
+                return iEntry - 1
+            iSlot = (iSlot + 1) & self.iMask
+
+    def __contains__(self, sString):
+        return self.index(sString) >= 0
+
+
+def is_string_store(sDir):
+    """Return True if sDir holds a saved StringStore."""
+    return all((Path(sDir) / (sName + '.npy')).exists() for sName in ARRAYS)
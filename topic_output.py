@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Output of topics in the formats described in build_topic_model.py: Excel (one
+row per topic, anchor in column A and comma-delimited topic words in column
+B), or text (anchor on one line, comma-delimited topic words on the next,
+then a blank line).
+"""
+
+import codecs
+import sys
+
+
+def open_output(sOutFileName, bExcel):
+    """
+    Open the output stream for topics: stdout, a text file, or (if bExcel) an
+    xlsxwriter.Workbook.  Exits if Excel output to stdout is requested.
+    """
+    if sOutFileName == 'stdout' and bExcel:
+        sys.stderr.write("Excel output incompatible with stdout.\n")
+        exit(1)
+    #If we get here, either output is text to stdout, or we're outputting to a file.
+    if sOutFileName == 'stdout':
+        return codecs.getwriter('utf-8')(sys.stdout.buffer)
+    if bExcel:
+        import xlsxwriter  #Output to Excel format
+        return xlsxwriter.Workbook(sOutFileName)
+    return open(sOutFileName, 'w+', encoding='utf-8')
+
+
+def write_topics(strOut, bExcel, Words, Anchors, matrixWordTopic, iNumWords, Metrics=None):
+    """
+    Write one record per topic to strOut.  If Metrics (as returned by
+    topic_quality.evaluate_topics()) is given, each text record gets a third
+    line with the topic's measures, and Excel output a second worksheet with
+    one row of measures per topic (in the same order) and a row of means.
+
+    Args:
+        strOut: text stream, or xlsxwriter.Workbook if bExcel
+        bExcel (bool): output in Excel format
+        Words (list of str): the words, indexed by row of matrixWordTopic
+        Anchors (list of list of int): anchor word(s) for each topic
+        matrixWordTopic (numpy array): word-topic matrix
+        iNumWords (int): number of words to output for each topic
+        Metrics (dict): optional, measure name -> array of values per topic
+    """
+    if bExcel:
+        TextFormat = strOut.add_format()
+        TextFormat.set_align('vjustify')   #'vjustify' means wrapped
+        strWorksheet = strOut.add_worksheet()
+        strWorksheet.set_default_row(30)  #Sets height; default is 15 (units of what?)
+        strWorksheet.set_column(0, 0,  25, TextFormat) #Column A:  25 "default" characters wide
+        strWorksheet.set_column(1, 1, 125, TextFormat) #Column B: 125 "default" characters wide
+    for iAnchor, Anchor in enumerate(Anchors, start=0):
+        if bExcel:
+            strWorksheet.write("A%i" %(iAnchor+1), " ".join(Words[iAnchor] for iAnchor in Anchor))
+        else: #Text output
+            strOut.write("%s\n" %" ".join(Words[iAnchor] for iAnchor in Anchor))
+        TopicWords = []
+        for iWord in list(matrixWordTopic[:,iAnchor].argsort())[:-(iNumWords+1):-1]:
+            TopicWords.append(Words[iWord])
+        if bExcel:
+            strWorksheet.write("B%i" %(iAnchor+1), ", ".join(TopicWords))
+        elif Metrics is not None:
+            strOut.write("%s\n%s\n\n" %(", ".join(TopicWords),
+                ", ".join("%s %.4g" %(sName, Values[iAnchor]) for sName, Values in Metrics.items())))
+        else: #Text output
+            strOut.write("%s\n\n" %", ".join(TopicWords))
+    if bExcel and Metrics is not None:
+        strQualitySheet = strOut.add_worksheet("Quality")
+        strQualitySheet.set_column(0, 0, 25)
+        strQualitySheet.write_row(0, 0, ["Anchor"] + list(Metrics))
+        for iAnchor, Anchor in enumerate(Anchors, start=0):
+            strQualitySheet.write(iAnchor+1, 0, " ".join(Words[iWord] for iWord in Anchor))
+            strQualitySheet.write_row(iAnchor+1, 1, [float(Values[iAnchor]) for Values in Metrics.values()])
+        strQualitySheet.write_row(len(Anchors)+1, 0,
+                                  ["Mean"] + [float(Values.mean()) for Values in Metrics.values()])
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Measures of topic quality, for choosing the number of topics (-a) and of
+words per topic (-w) by something better than eye.
+
+Coherence (how often a topic's top words occur in the same documents):
+    NPMI   mean, over the pairs of the topic's top words, of the normalized
+           pointwise mutual information log(P(i,j) / (P(i) P(j))) / -log P(i,j),
+           where P is the fraction of documents containing the word(s); in
+           [-1, 1], with -1 for words that never cooccur (Bouma, 2009)
+    UMass  mean, over the pairs of top words with word j ranked above word i,
+           of log((D(i,j) + 1) / D(j)), where D counts documents; at most 0,
+           and higher is better (Mimno et al., 2011)
+Distinctness:
+    WordOverlap    largest Jaccard similarity between the topic's top words and
+                   another topic's
+    AnchorOverlap  number of other topics whose top words include one of the
+                   topic's anchors
+
+All the document counts are taken from a single product B . B.T, where B is
+the boolean word-document matrix restricted to the union of all the topics'
+top words (at most topics x words rows), accumulated a chunk of documents at a
+time; so the cost is one pass over the (non-zero entries of the) matrix,
+however many topics and word pairs there are.
+"""
+
+import numpy
+from scipy import sparse
+
+from cooccurrence import column_chunks
+from disk_matrix import iDEFAULT_CHUNK_COLUMNS
+
+
+MEASURES = ('NPMI', 'UMass', 'WordOverlap', 'AnchorOverlap')
+
+
+def top_words(matrixWordTopic, iNumWords):
+    """
+    Return a topics x iNumWords array of each topic's top words (highest first),
+    as chosen by topic_output.write_topics().
+    """
+    return numpy.array([matrixWordTopic[:, iTopic].argsort()[:-(iNumWords+1):-1]
+                        for iTopic in range(matrixWordTopic.shape[1])])
+
+
+def document_counts(matrixWordDoc, Rows, iChunkColumns=iDEFAULT_CHUNK_COLUMNS):
+    """
+    Return (D, iDocs): D[a, b] is the number of documents containing both word
+    Rows[a] and word Rows[b] (so D[a, a] is word Rows[a]'s document frequency),
+    and iDocs the number of documents.
+    """
+    D = numpy.zeros((len(Rows), len(Rows)), dtype=numpy.int64)
+    iDocs = 0
+    for Chunk in column_chunks(matrixWordDoc, iChunkColumns):
+        B = sparse.csr_matrix(Chunk)[Rows]
+        B.data = (B.data != 0).astype(numpy.int32)
+        D += (B @ B.T).toarray()
+        iDocs += Chunk.shape[1]
+    return D, iDocs
+
+
+def evaluate_topics(matrixWordDoc, Anchors, matrixWordTopic, iNumWords,
+                    iChunkColumns=iDEFAULT_CHUNK_COLUMNS):
+    """
+    Compute the measures described in the module documentation.
+
+    Args:
+        matrixWordDoc: word-document matrix (scipy.sparse, or
+            disk_matrix.DiskCSCMatrix)
+        Anchors (list of list of int): anchor word(s) for each topic
+        matrixWordTopic (numpy array): word-topic matrix
+        iNumWords: number of top words per topic to evaluate
+
+    Returns:
+        dict mapping each name in MEASURES to a numpy array with one value per
+        topic
+    """
+    Top = top_words(matrixWordTopic, iNumWords)
+    k, n = Top.shape
+    Union, Local = numpy.unique(Top, return_inverse=True)
+    Local = Local.reshape(k, n)
+    D, iDocs = document_counts(matrixWordDoc, Union, iChunkColumns)
+    #Pairs (a, b) of ranks with a < b, for all topics at once:
+    RankA, RankB = numpy.triu_indices(n, 1)
+    I, J = Local[:, RankA], Local[:, RankB] #Word i ranked above word j
+    DocFreqs = numpy.diag(D).astype(float)
+    Joint = D[I, J].astype(float)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        PMI = numpy.log(Joint * iDocs / (DocFreqs[I] * DocFreqs[J]))
+        NPMI = numpy.where(Joint == 0, -1.0,
+                           numpy.where(Joint == iDocs, 1.0, PMI / -numpy.log(Joint / iDocs)))
+        UMass = numpy.log((Joint + 1) / DocFreqs[I])
+    Result = {'NPMI': NPMI.mean(axis=1) if len(RankA) else numpy.zeros(k),
+              'UMass': UMass.mean(axis=1) if len(RankA) else numpy.zeros(k)}
+    #Overlaps, from topics x words indicator matrices of top words and anchors:
+    def indicator(WordLists):
+        Lengths = [len(WordList) for WordList in WordLists]
+        return sparse.csr_matrix((numpy.ones(sum(Lengths)),
+                                  numpy.concatenate([numpy.asarray(WordList, dtype=int)
+                                                     for WordList in WordLists]),
+                                  numpy.concatenate([[0], numpy.cumsum(Lengths)])),
+                                 shape=(len(WordLists), matrixWordTopic.shape[0]))
+    Member = indicator(Top)
+    Shared = (Member @ Member.T).toarray()
+    Jaccard = Shared / (2 * n - Shared)
+    numpy.fill_diagonal(Jaccard, 0)
+    Result['WordOverlap'] = Jaccard.max(axis=1) if k > 1 else numpy.zeros(k)
+    AnchorIn = (indicator(Anchors) @ Member.T).toarray() > 0
+    numpy.fill_diagonal(AnchorIn, False)
+    Result['AnchorOverlap'] = AnchorIn.sum(axis=1)
+    return Result
+
+
+def summary(Metrics):
+    """Return a one-line summary (the mean of each measure over the topics)."""
+    return ", ".join("mean %s %.4f" %(sName, Metrics[sName].mean()) for sName in MEASURES)
@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+Interactive topic modeling session: build (or load) the cooccurrence
+statistics once, keep them in memory, and then accept commands to change the
+anchors, rerunning only the topic recovery after each change.  This is the
+"updating topics" workflow of anchor_topic
+(https://github.com/forest-snow/anchor-topic#updating-topics), without having
+to rerun build_topic_model.py (re-reading the abstracts and recomputing the
+cooccurrences) after every change.
+
+Command line arguments:
+     -i <glob>   Glob for abstracts, as for build_topic_model.py; or
+     -V <fname> <partial>...
+                 Vocabulary file and partial sums written by sharded_cooccur.py
+     -s <fname>  Filename for stopwords (with -i), default stopwords.txt
+     -l <int>    Minimum length of words in characters (with -i), default 2
+     -a <int>    Number of anchors (topics) to start with, default 50
+     -w <int>    Default number of words in each topic, default 20
+     --anchor-threshold <float>
+                 As for build_topic_model.py, default 0.01
+     -u <fname>  Listen on this Unix domain socket (accessible to its owner
+                 only), rather than reading commands from stdin and writing
+                 responses to stdout
+     -r <dir>    Cache topic recovery solutions in <dir> (see recovery_cache.py),
+                 so they outlive the session; by default the last few (see
+                 recovery_cache.iMAX_MEMORY_ENTRIES) are cached in memory only
+
+Protocol:
+Each command is a JSON object on one line; each response is a JSON object on one
+line, with "ok" (true or false), "error" (if not ok), and otherwise the current
+topics: "topics" is a list with one {"anchors": [...], "words": [...]} per
+topic, and "seconds" is the time taken by the command.  Topics are numbered from
+0; anchors are given as words.  Commands:
+    {"cmd": "topics"}                                Show the topics
+    {"cmd": "add", "anchors": ["w1", "w2"]}          Add a topic
+    {"cmd": "remove", "topic": 3}                    Remove a topic
+    {"cmd": "merge", "topics": [1, 4]}               Merge topics into one (the first)
+    {"cmd": "replace", "topic": 2, "anchors": ["w"]} Replace a topic's anchors
+    {"cmd": "set", "anchors": [["w1"], ["w2", "w3"]]} Replace all the anchors
+    {"cmd": "quit"}                                  End the session
+Any command may include "words": <int>, the number of words to return per topic.
+A command that is not ok (e.g. naming an unknown word) changes nothing.
+A topic with more than one anchor word is anchored on the harmonic mean of the
+words' cooccurrence rows (Lund et al., 2017).  Each recovery starts from the
+cached solution for the anchors closest to the new ones (usually the previous
+anchors), so an edit to one topic takes a few iterations per word rather than a
+full recovery; undoing an edit reuses the earlier solution outright.
+"""
+
+from argparse import ArgumentParser
+from glob import glob
+import io
+import json
+import os
+import socketserver
+import sys
+import time
+
+import numpy
+
+from anchor_model import greedy_anchors, row_sums, update_topics
+from cooccurrence import identify_candidates
+from corpus import check_anchor_candidates, corpus_fingerprint, read_stopwords, read_vocabulary
+from disk_matrix import iDEFAULT_CHUNK_COLUMNS
+from recovery_cache import RecoveryCache
+from sharded_cooccur import accumulate_shard, build_vocabulary, reduce_partials, \
+    shard_abstracts
+
+
+def GetCmdLineParameters():
+    """Return the parsed command line args."""
+    parser = ArgumentParser(description="Interactive topic modeling session")
+    parser.add_argument( "-i", "--InputGlob"
+                       , dest    = "sInputGlob"
+                       , metavar = "<InputGlob>"
+                       , default = None
+                       , help    = "Glob of files to read (quote if contains wildcards)"
+                       )
+    parser.add_argument( "-V", "--Vocabulary"
+                       , dest    = "sVocabFName"
+                       , metavar = "<VocabFile>"
+                       , default = None
+                       , help    = "Vocabulary file written by sharded_cooccur.py vocab"
+                       )
+    parser.add_argument( "Partials"
+                       , metavar = "<PartialFile>"
+                       , nargs   = "*"
+                       , help    = "Partial sums written by sharded_cooccur.py shard (with -V)"
+                       )
+    parser.add_argument( "-s", "--StopWordsFile"
+                       , dest    = "sStopWordsFName"
+                       , metavar = "<StopWordsFileName>"
+                       , default = 'stopwords.txt'
+                       , help    = "Filename of stop words"
+                       )
+    parser.add_argument( "-l", "--MinWordLength"
+                       , type    = int
+                       , dest    = "iMinWordLength"
+                       , metavar = "<MinWordLength>"
+                       , default = 2
+                       , help    = "Minimum length of tokens, in characters"
+                       )
+    parser.add_argument( "-a", "--NumAnchors"
+                       , type    = int
+                       , dest    = "iNumAnchors"
+                       , metavar = "<NumberOfAnchors>"
+                       , default = 50
+                       , help    = "Number of anchors to start with"
+                       )
+    parser.add_argument( "-w", "--NumWords"
+                       , type    = int
+                       , dest    = "iNumWords"
+                       , metavar = "<NumberOfWords>"
+                       , default = 20
+                       , help    = "Default number of words to output for each topic"
+                       )
+    parser.add_argument( "--anchor-threshold"
+                       , type    = float
+                       , dest    = "fAnchorThreshold"
+                       , metavar = "<AnchorThreshold>"
+                       , default = 0.01
+                       , help    = "Minimum fraction of abstracts a word must occur in to be an anchor candidate"
+                       )
+    parser.add_argument( "-u", "--Socket"
+                       , dest    = "sSocketFName"
+                       , metavar = "<SocketFile>"
+                       , default = None
+                       , help    = "Listen for commands on this Unix domain socket, rather than stdin"
+                       )
+    parser.add_argument( "-r", "--RecoveryCache"
+                       , dest    = "sRecoveryCacheDir"
+                       , metavar = "<RecoveryCacheDir>"
+                       , default = None
+                       , help    = "Directory in which to cache topic recovery solutions (default: memory)"
+                       )
+    args = parser.parse_args()
+    if bool(args.sInputGlob) == bool(args.sVocabFName) \
+       or (args.sVocabFName and not args.Partials):
+        sys.stderr.write("Give either an input glob (-i), or a vocabulary file (-V) and partial sums.\n")
+        exit(1)
+    return args
+
+
+class TopicSession:
+    """
+    The state of an interactive session: the vocabulary, the cooccurrence
+    matrix Q and its row sums (computed once), the cache of recovery solutions,
+    and the current anchors and topics.
+    """
+    def __init__(self, Words, Sums, iNumAnchors, fAnchorThreshold, iNumWords=20,
+                 sRecoveryCacheDir=None):
+        self.Words = Words
+        self.Cache = RecoveryCache(sRecoveryCacheDir,
+                                   corpus_fingerprint(Words, Sums.DocFreqs, Sums.iDocs))
+        self.WordIndex = {sWord: iWord for iWord, sWord in enumerate(Words)}
+        self.iNumWords = iNumWords
+        self.Q = Sums.sparse_Q()
+        self.RowSums = row_sums(self.Q)
+        Candidates = identify_candidates(Sums.DocFreqs, Sums.iDocs, fAnchorThreshold)
+        self.Anchors = [[w] for w in greedy_anchors(self.Q, iNumAnchors, Candidates)]
+        self.recover()
+
+    def recover(self, Anchors=None):
+        """Recover the topics for Anchors (default the current anchors), and make them current."""
+        if Anchors is None:
+            Anchors = self.Anchors
+        self.A = update_topics(self.Q, Anchors, self.RowSums, Cache=self.Cache)
+        self.Anchors = Anchors
+
+    def word_indices(self, AnchorWords):
+        """Convert a list of anchor words to word indices; raises ValueError if unknown."""
+        if not (isinstance(AnchorWords, list)
+                and all(isinstance(sWord, str) for sWord in AnchorWords)):
+            raise ValueError("A topic's anchors must be a list of words")
+        if not AnchorWords:
+            raise ValueError("A topic needs at least one anchor word")
+        Unknown = [sWord for sWord in AnchorWords if sWord not in self.WordIndex]
+        if Unknown:
+            raise ValueError("Unknown word(s): %s" %", ".join(Unknown))
+        return [self.WordIndex[sWord] for sWord in AnchorWords]
+
+    def topic_index(self, iTopic):
+        """Check a topic number; raises ValueError if out of range."""
+        if not (isinstance(iTopic, int) and 0 <= iTopic < len(self.Anchors)):
+            raise ValueError("No topic %s" %iTopic)
+        return iTopic
+
+    def topics(self, iNumWords):
+        """Return the current topics as a list of dicts (see module documentation)."""
+        Topics = []
+        for iTopic, Anchor in enumerate(self.Anchors):
+            TopWords = numpy.argsort(self.A[:, iTopic])[:-(iNumWords+1):-1]
+            Topics.append({"anchors": [self.Words[iWord] for iWord in Anchor],
+                           "words": [self.Words[iWord] for iWord in TopWords]})
+        return Topics
+
+    def execute(self, Command):
+        """
+        Execute one command (a dict, see module documentation), and return the
+        response (a dict).
+        """
+        fStart = time.time()
+        try:
+            #Check the whole command, working on a copy of the anchors, before changing anything:
+            iNumWords = int(Command.get("words", self.iNumWords))
+            if iNumWords < 1:
+                raise ValueError("Number of words must be positive")
+            sCmd = Command.get("cmd")
+            Anchors = list(self.Anchors)
+            if sCmd == "topics":
+                pass
+            elif sCmd == "add":
+                Anchors.append(self.word_indices(Command.get("anchors")))
+            elif sCmd == "remove":
+                if len(Anchors) < 2:
+                    raise ValueError("Cannot remove the last topic")
+                del Anchors[self.topic_index(Command.get("topic"))]
+            elif sCmd == "merge":
+                if not isinstance(Command.get("topics"), list):
+                    raise ValueError("Topics for \"merge\" must be a list of topic numbers")
+                Topics = [self.topic_index(iTopic) for iTopic in Command["topics"]]
+                if len(set(Topics)) < 2:
+                    raise ValueError("Merge needs at least two different topics")
+                Merged = []
+                for iTopic in Topics:
+                    Merged.extend(w for w in Anchors[iTopic] if w not in Merged)
+                Anchors[Topics[0]] = Merged
+                for iTopic in sorted(set(Topics[1:]), reverse=True):
+                    del Anchors[iTopic]
+            elif sCmd == "replace":
+                Anchors[self.topic_index(Command.get("topic"))] = \
+                    self.word_indices(Command.get("anchors"))
+            elif sCmd == "set":
+                if not isinstance(Command.get("anchors"), list):
+                    raise ValueError("Anchors for \"set\" must be a list of lists of words")
+                Anchors = [self.word_indices(AnchorWords) for AnchorWords in Command["anchors"]]
+                if not Anchors:
+                    raise ValueError("Need at least one topic")
+            else:
+                raise ValueError("Unknown command %s" %sCmd)
+        except (ValueError, TypeError) as e:
+            return {"ok": False, "error": str(e)}
+        if sCmd != "topics":
+            self.recover(Anchors)
+        return {"ok": True, "topics": self.topics(iNumWords),
+                "seconds": round(time.time() - fStart, 3)}
+
+
+def serve_stream(session, strIn, strOut):
+    """
+    Read commands (one JSON object per line) from strIn, and write responses to
+    strOut, until EOF or a "quit" command.  Returns True if the session should
+    end.
+    """
+    for sLine in strIn:
+        if not sLine.strip():
+            continue
+        try:
+            Command = json.loads(sLine)
+            if not isinstance(Command, dict):
+                raise ValueError("A command must be a JSON object")
+        except ValueError as e:
+            Response = {"ok": False, "error": "Bad command: %s" %e}
+        else:
+            if Command.get("cmd") == "quit":
+                return True
+            Response = session.execute(Command)
+        strOut.write(json.dumps(Response) + '\n')
+        strOut.flush()
+    return False
+
+
+def serve_socket(session, sSocketFName):
+    """
+    Serve one client at a time on a Unix domain socket, until a "quit" command.
+    The socket is created accessible to its owner only (mode 0600), so other
+    local users can't change the session.
+    """
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            strIn = io.TextIOWrapper(self.rfile, encoding='utf-8')
+            strOut = io.TextIOWrapper(self.wfile, encoding='utf-8', write_through=True)
+            if serve_stream(session, strIn, strOut):
+                self.server.bQuit = True
+    if os.path.exists(sSocketFName):
+        os.unlink(sSocketFName)
+    iOldUmask = os.umask(0o177) #The socket is created by bind(), with these permissions
+    try:
+        Server = socketserver.UnixStreamServer(sSocketFName, Handler)
+    finally:
+        os.umask(iOldUmask)
+    with Server:
+        Server.bQuit = False
+        sys.stderr.write("Listening on %s\n" %sSocketFName)
+        while not Server.bQuit:
+            Server.handle_request()
+    os.unlink(sSocketFName)
+
+
+def load_statistics(args):
+    """Return (Words, CooccurrenceSums) from the corpus or from partial sums."""
+    if args.sInputGlob:
+        PathList = sorted(glob(args.sInputGlob))
+        if not PathList:
+            sys.stderr.write("No files match '%s'\n" %args.sInputGlob)
+            exit(1)
+        Words = build_vocabulary(PathList, args.iMinWordLength,
+                                 read_stopwords(args.sStopWordsFName))
+        return Words, accumulate_shard(shard_abstracts(PathList, 0, 1, False), Words,
+                                       iDEFAULT_CHUNK_COLUMNS)
+    Words, sFingerprint = read_vocabulary(args.sVocabFName)
+    return Words, reduce_partials(args.Partials, len(Words), sFingerprint)
+
+
+
+if __name__ == '__main__':
+    args = GetCmdLineParameters()
+    Words, Sums = load_statistics(args)
+    sys.stderr.write("Read %i abstracts, containing %i Words.\n" %(Sums.iDocs, len(Words)))
+    check_anchor_candidates(Sums.DocFreqs, Sums.iDocs, args.fAnchorThreshold, args.iNumAnchors)
+    session = TopicSession(Words, Sums, args.iNumAnchors, args.fAnchorThreshold, args.iNumWords,
+                           args.sRecoveryCacheDir)
+    del Sums
+    sys.stderr.write("Ready.\n")
+    if args.sSocketFName:
+        serve_socket(session, args.sSocketFName)
+    else:
+        serve_stream(session, sys.stdin, sys.stdout)